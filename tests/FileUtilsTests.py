@@ -12,10 +12,18 @@ __email__ = "peisach@rcsb.rutgers.edu"
 __license__ = "Creative Commons Attribution 3.0 Unported"
 __version__ = "V0.01"
 
+import os
+import platform
+import shutil
+import tempfile
 import unittest
+from unittest import mock
 
+from wwpdb.io.file.DataExchange import DataExchange
 from wwpdb.utils.config.ConfigInfoData import ConfigInfoData
-from wwpdb.utils.session.FileUtils import FileUtilsBase
+
+from wwpdb.utils.session.FileUtils import FileUtils, FileUtilsBase
+from wwpdb.utils.session.WebRequest import InputRequest
 
 
 class MyFileUtilsBase(FileUtilsBase):
@@ -32,7 +40,16 @@ class MyFileUtilsBase(FileUtilsBase):
 
 class FileUtilTests(unittest.TestCase):
     def setUp(self):
-        pass
+        HERE = os.path.abspath(os.path.dirname(__file__))
+        TESTOUTPUT = os.path.join(HERE, "test-output", platform.python_version())
+        if not os.path.exists(TESTOUTPUT):  # pragma: no cover
+            os.makedirs(TESTOUTPUT)
+        # sessions created by each test are removed in tearDown
+        self.__sessiontop = tempfile.mkdtemp(prefix="fileutils-", dir=TESTOUTPUT)
+        os.makedirs(os.path.join(self.__sessiontop, "sessions"))
+
+    def tearDown(self):
+        shutil.rmtree(self.__sessiontop, ignore_errors=True)
 
     def testDownloadTypes(self):
         """Tests Download Types vs known in ConfigInfoData to prevent issues"""
@@ -46,6 +63,24 @@ class FileUtilTests(unittest.TestCase):
         for ct in cttypes:
             self.assertIn(ct, knownContentTypes, "%s not in known content types" % ct)
 
+    def testRenderImageShardedSession(self):
+        """Tests image links in rendered file lists point to the sharded session path"""
+        reqObj = InputRequest({"TopSessionPath": [self.__sessiontop]}, sessionConfig={"shardDepth": 2})
+        sObj = reqObj.newSessionObj(forceNew=True)
+        imgPath = os.path.join(self.__sessiontop, "D_000001_img-emdb_P1.png.V1")
+        with open(imgPath, "wb") as ofh:
+            ofh.write(b"png")
+
+        fU = FileUtils("D_000001", reqObj=reqObj)
+        with mock.patch.object(
+            DataExchange, "getContentTypeFileList", return_value=[(imgPath, "2026-10-17", 0.003)]
+        ), mock.patch.object(DataExchange, "getLogFileList", return_value=[]):
+            nF, htmlList = fU.renderFileList(fileSource="deposit", rDList=["Primary Data Files"], displayImageFlag=True)
+        self.assertEqual(nF, 2)
+        self.assertTrue(sObj.getRelativePath().startswith("/sessions/" + "/".join(sObj.getShardList())))
+        self.assertIn('<img src="%s/D_000001_img-emdb_P1.png.V1"' % sObj.getRelativePath(), "".join(htmlList))
+        self.assertTrue(os.path.islink(os.path.join(sObj.getPath(), "D_000001_img-emdb_P1.png.V1")))
+
 
 if __name__ == "__main__":  # pragma: no cover
     unittest.main()
@@ -12,12 +12,22 @@ __email__ = "peisach@rcsb.rutgers.edu"
 __license__ = "Creative Commons Attribution 3.0 Unported"
 __version__ = "V0.01"
 
+import contextlib
+import io
 import os
 import platform
 import shutil
+import sqlite3
+import time
 import unittest
+from unittest import mock
 
-from wwpdb.utils.session.SessionManager import SessionManager
+from wwpdb.utils.session import SessionAdmin
+from wwpdb.utils.session.SessionManager import (
+    SessionManager,
+    makeRandomId,
+    makeTimeOrderedId,
+)
 
 
 class SessionTests(unittest.TestCase):
@@ -72,6 +82,221 @@ class SessionTests(unittest.TestCase):
         self.assertIsNotNone(sm.remakeSessionPath(), "Creating session path uid set")
         self.assertIsNotNone(sm.getPath(), "Expected path should not be None")
 
+    def testShardedLayout(self):
+        """Tests sharded session layout, legacy path resolution and migration"""
+        sessdir = os.path.join(self.__sessiontop, "sessshard")
+        if os.path.exists(sessdir):  # pragma: no cover
+            shutil.rmtree(sessdir)
+        # Session created in the flat layout
+        smFlat = SessionManager(sessdir)
+        uid = smFlat.assignId()
+        legacyPath = smFlat.makeSessionPath()
+        self.assertEqual(legacyPath, os.path.join(sessdir, "sessions", uid))
+
+        sm = SessionManager(sessdir, shardDepth=2)
+        sm.setId(uid)
+        self.assertEqual(sm.getShardList(), [uid[-2:], uid[-4:-2]])
+        # Legacy session still resolves before migration
+        self.assertEqual(sm.getPath(), legacyPath)
+        self.assertEqual(sm.makeSessionPath(), legacyPath)
+        self.assertEqual(sm.getRelativePath(), os.path.join("/sessions", uid))
+        self.assertEqual(sm.getParentPath(), os.path.join(sessdir, "sessions"))
+
+        self.assertEqual(sm.migrateSessions(), (1, 0))
+        shardPath = os.path.join(sessdir, "sessions", uid[-2:], uid[-4:-2], uid)
+        self.assertEqual(sm.getPath(), shardPath)
+        self.assertEqual(sm.getRelativePath(), "/".join(["/sessions", uid[-2:], uid[-4:-2], uid]))
+        self.assertEqual(sm.getParentPath(), os.path.dirname(shardPath))
+        # Legacy link remains for existing URLs
+        self.assertTrue(os.path.islink(legacyPath))
+        self.assertEqual(smFlat.getPath(), legacyPath)
+        self.assertEqual(sm.migrateSessions(), (0, 0))
+
+        # New sessions are created in the sharded layout
+        sm2 = SessionManager(sessdir, shardDepth=2)
+        uid2 = sm2.assignId()
+        self.assertEqual(sm2.makeSessionPath(), os.path.join(sessdir, "sessions", uid2[-2:], uid2[-4:-2], uid2))
+        self.assertEqual(sm2.remakeSessionPath(), sm2.getPath())
+
+    def testIdGenerators(self):
+        """Tests random and time-ordered session id generation and exclusive session creation"""
+        idL = [makeRandomId() for _ in range(1000)]
+        self.assertEqual(len(set(idL)), len(idL))
+        self.assertTrue(all(len(uid) == 32 for uid in idL))
+
+        idL = []
+        for _ in range(3):
+            idL.append(makeTimeOrderedId())
+            time.sleep(0.002)
+        self.assertEqual(idL, sorted(idL))
+
+        sm = SessionManager(idType="time")
+        self.assertEqual(len(sm.assignId()), 32)
+        sm = SessionManager(idType=lambda: "fixed_id")
+        self.assertEqual(sm.assignId(), "fixed_id")
+
+        sessdir = os.path.join(self.__sessiontop, "sessexcl")
+        if os.path.exists(sessdir):  # pragma: no cover
+            shutil.rmtree(sessdir)
+        sm = SessionManager(sessdir)
+        uid = sm.assignId()
+        pth = sm.makeSessionPath(exclusive=True)
+        self.assertIsNotNone(pth)
+        # Joining an existing session is allowed unless exclusive
+        self.assertEqual(sm.makeSessionPath(), pth)
+        pth2 = sm.makeSessionPath(exclusive=True)
+        self.assertIsNotNone(pth2)
+        self.assertNotEqual(pth, pth2)
+        self.assertNotEqual(uid, sm.getId())
+        # A generator that always collides gives up
+        sm = SessionManager(sessdir, idType=lambda: uid)
+        sm.assignId()
+        self.assertIsNone(sm.makeSessionPath(exclusive=True))
+
+    def testReapSessions(self):
+        """Tests expiry of idle and aged sessions"""
+        sessdir = os.path.join(self.__sessiontop, "sessreap")
+        if os.path.exists(sessdir):  # pragma: no cover
+            shutil.rmtree(sessdir)
+        tOld = time.time() - 10 * 86400
+        pathD = {}
+        for shardDepth in (0, 2):
+            for kind in ("fresh", "idle"):
+                sm = SessionManager(sessdir, shardDepth=shardDepth)
+                sm.assignId()
+                pth = sm.makeSessionPath()
+                with open(os.path.join(pth, "data.txt"), "w") as ofh:
+                    ofh.write("x" * 100)
+                # Access is recorded explicitly or on getPath() with trackAccess
+                self.assertEqual(sm.getPath(), pth)
+                self.assertFalse(os.path.exists(os.path.join(pth, SessionManager.ACCESS_MARKER)))
+                if kind == "fresh":
+                    self.assertTrue(sm.touchAccess())
+                else:
+                    smT = SessionManager(sessdir, shardDepth=shardDepth, trackAccess=True)
+                    smT.setId(sm.getId())
+                    self.assertEqual(smT.getPath(), pth)
+                self.assertTrue(os.path.exists(os.path.join(pth, SessionManager.ACCESS_MARKER)))
+                if kind == "idle":
+                    os.utime(os.path.join(pth, SessionManager.ACCESS_MARKER), (tOld, tOld))
+                    os.utime(pth, (tOld, tOld))
+                pathD[(shardDepth, kind)] = pth
+
+        sm = SessionManager(sessdir)
+        # No access marker without a session id
+        smT = SessionManager(sessdir, trackAccess=True)
+        smT.setId("")
+        self.assertEqual(os.path.normpath(smT.getPath()), smT.getSessionsPath())
+        self.assertFalse(smT.touchAccess())
+        self.assertFalse(os.path.exists(os.path.join(smT.getSessionsPath(), SessionManager.ACCESS_MARKER)))
+        self.assertEqual(len(list(sm.iterSessions())), 4)
+        rD = sm.reapSessions(maxIdle=86400, dryRun=True)
+        self.assertEqual((rD["scanned"], rD["expired"], rD["removed"]), (4, 2, 0))
+        self.assertEqual(rD["bytes"], 200)
+
+        rD = sm.reapSessions(maxIdle=86400, batchSize=1, numWorkers=2)
+        self.assertEqual((rD["expired"], rD["removed"], rD["failed"]), (2, 2, 0))
+        self.assertEqual(rD["bytes"], 200)
+        for (_shardDepth, kind), pth in pathD.items():
+            self.assertEqual(os.path.exists(pth), kind == "fresh")
+        # Shard directories emptied by the reaper are removed
+        idlePath = pathD[(2, "idle")]
+        freshPath = pathD[(2, "fresh")]
+        self.assertFalse(os.path.exists(os.path.dirname(idlePath)))
+        if os.path.dirname(os.path.dirname(idlePath)) != os.path.dirname(os.path.dirname(freshPath)):
+            self.assertFalse(os.path.exists(os.path.dirname(os.path.dirname(idlePath))))
+        self.assertTrue(os.path.isdir(sm.getSessionsPath()))
+
+        self.assertEqual(sm.reapSessions(maxAge=86400)["removed"], 0)
+        self.assertEqual(sm.reapSessions()["scanned"], 0)
+
+    def testReapMissingSessionsPath(self):
+        """Tests reaping a top path without a sessions directory"""
+        sessdir = os.path.join(self.__sessiontop, "sessreapmissing")
+        if os.path.exists(sessdir):  # pragma: no cover
+            shutil.rmtree(sessdir)
+        sm = SessionManager(sessdir, shardDepth=2)
+        self.assertEqual(list(sm.iterSessions()), [])
+        rD = sm.reapSessions(maxAge=0, maxIdle=0)
+        self.assertEqual((rD["scanned"], rD["removed"], rD["links"]), (0, 0, 0))
+        self.assertEqual(sm.migrateSessions(), (0, 0))
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(SessionAdmin.main(["--top_path", sessdir, "reap", "--max_age_days", "1"]), 0)
+        self.assertFalse(os.path.exists(sessdir))
+
+    def testUsageQuota(self):
+        """Tests the session usage ledger and quotas"""
+        sessdir = os.path.join(self.__sessiontop, "sessusage")
+        if os.path.exists(sessdir):  # pragma: no cover
+            shutil.rmtree(sessdir)
+        os.makedirs(sessdir)
+        sm = SessionManager(sessdir, quotaSoft=150, quotaHard=300)
+        sm.assignId()
+        pth = sm.makeSessionPath()
+        for fn, nBytes in (("a.txt", 100), ("b.txt", 100), ("a.txt", 50)):
+            fp = os.path.join(pth, fn)
+            with open(fp, "w") as ofh:
+                ofh.write("x" * nBytes)
+            self.assertTrue(sm.recordFileUsage(fp))
+        self.assertEqual(sm.getUsage(), 150)
+        self.assertTrue(sm.checkQuota(100))
+        self.assertFalse(sm.checkQuota(200))
+        # Replacing a recorded file counts only the difference
+        self.assertTrue(sm.checkQuota(200, filePath=os.path.join(pth, "b.txt")))
+        self.assertFalse(sm.checkQuota(200, filePath=os.path.join(pth, "new.txt")))
+        self.assertTrue(sm.removeFileUsage(os.path.join(pth, "b.txt")))
+        self.assertEqual(sm.getUsage(), 50)
+
+        sm2 = SessionManager(sessdir, trackUsage=True)
+        sm2.assignId()
+        pth2 = sm2.makeSessionPath()
+        with open(os.path.join(pth2, "c.txt"), "w") as ofh:
+            ofh.write("x" * 500)
+        self.assertEqual(sm2.getUsage(), 0)
+        self.assertEqual(sm2.rebuildUsage(), 500)
+        self.assertEqual(sm.getUsageReport(topN=1), [(sm2.getId(), 500, 1)])
+        self.assertEqual(len(sm.getUsageReport()), 2)
+
+        # Untracked sessions are not recorded
+        sm3 = SessionManager(sessdir)
+        sm3.assignId()
+        fp = os.path.join(sm3.makeSessionPath(), "d.txt")
+        with open(fp, "w") as ofh:
+            ofh.write("x")
+        self.assertFalse(sm3.recordFileUsage(fp))
+        self.assertTrue(sm3.checkQuota(10**12))
+
+        # Removal of expired sessions clears the ledger
+        os.utime(pth2, (0, 0))
+        self.assertEqual(sm.reapSessions(maxAge=86400)["removed"], 1)
+        self.assertEqual(len(sm.getUsageReport()), 1)
+
+        # Rollback journal by default
+        ledgerPath = os.path.join(sessdir, SessionManager.USAGE_LEDGER)
+        with contextlib.closing(sqlite3.connect(ledgerPath)) as con:
+            self.assertEqual(con.execute("PRAGMA journal_mode").fetchone()[0], "delete")
+
+        # One connection is reused by the ledger
+        with mock.patch.object(sqlite3, "connect", wraps=sqlite3.connect) as mockConnect:
+            for _ in range(3):
+                self.assertTrue(sm.recordFileUsage(os.path.join(pth, "a.txt")))
+            self.assertEqual(sm.getUsage(), 50)
+        self.assertLessEqual(mockConnect.call_count, 1)
+
+        # A removed ledger is recreated
+        os.remove(ledgerPath)
+        self.assertTrue(sm.recordFileUsage(os.path.join(pth, "a.txt")))
+        self.assertEqual(sm.getUsage(), 50)
+        sm.getUsageLedger().close()
+
+        # Configured WAL mode
+        os.remove(ledgerPath)
+        sm4 = SessionManager(sessdir, trackUsage=True, usageJournalMode="WAL")
+        sm4.setId(sm.getId())
+        self.assertTrue(sm4.recordFileUsage(os.path.join(pth, "a.txt")))
+        with contextlib.closing(sqlite3.connect(ledgerPath)) as con:
+            self.assertEqual(con.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
 
 if __name__ == "__main__":  # pragma: no cover
     unittest.main()
@@ -0,0 +1,351 @@
+##
+# File: UtilDataStoreTests.py
+# Date:  17-Oct-2026
+#
+# Updates:
+##
+"""Test cases for UtilDataStore"""
+
+__docformat__ = "restructuredtext en"
+__author__ = "Ezra Peisach"
+__email__ = "peisach@rcsb.rutgers.edu"
+__license__ = "Creative Commons Attribution 3.0 Unported"
+__version__ = "V0.01"
+
+import io
+import os
+import pickle  # noqa: S403
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from wwpdb.utils.session.UtilDataStore import UtilDataStore, dumpData, loadData
+from wwpdb.utils.session.WebRequest import InputRequest
+
+
+def _makeSessionDict(nSeq=200, seqLen=400):
+    """Session dictionary resembling sequence alignment content"""
+    dd = {"entryId": "D_1000000001", "title": "Some title", "flags": [True, False, None]}
+    dd["alignments"] = {
+        "seq_%d" % ii: {
+            "sequence": ["ALA", "GLY", "SER", "THR"] * (seqLen // 4),
+            "scores": [float(jj) / 3.0 for jj in range(seqLen)],
+            "details": {"db": "UNP", "acc": "P%05d" % ii, "start": 1, "end": seqLen},
+        }
+        for ii in range(nSeq)
+    }
+    return dd
+
+
+class UtilDataStoreTests(unittest.TestCase):
+    def setUp(self):
+        HERE = os.path.abspath(os.path.dirname(__file__))
+        TESTOUTPUT = os.path.join(HERE, "test-output", platform.python_version())
+        if not os.path.exists(TESTOUTPUT):  # pragma: no cover
+            os.makedirs(TESTOUTPUT)
+        # sessions created by each test are removed in tearDown
+        self.__sessiontop = tempfile.mkdtemp(prefix="uds-", dir=TESTOUTPUT)
+        self.__paramDict = {"TopSessionPath": [self.__sessiontop], "request_path": ["service/testpath"]}
+
+    def tearDown(self):
+        shutil.rmtree(self.__sessiontop, ignore_errors=True)
+
+    def __newRequest(self):
+        reqObj = InputRequest(dict(self.__paramDict))
+        reqObj.newSessionObj(forceNew=True)
+        return reqObj
+
+    def testStoreAccess(self):
+        """Tests data store accessors and persistence"""
+        reqObj = self.__newRequest()
+        uds = UtilDataStore(reqObj)
+        self.assertTrue(uds.set("k1", "v1"))
+        self.assertTrue(uds.append("k2", 1))
+        self.assertTrue(uds.extend("k2", [2, 3]))
+        self.assertTrue(uds.updateDict("k3", "sub", 4))
+        uds.serialize()
+        uds = UtilDataStore(reqObj)
+        self.assertEqual(uds.getDictionary(), {"k1": "v1", "k2": [1, 2, 3], "k3": {"sub": 4}})
+        self.assertEqual(uds.get("missing"), "")
+
+    def testSerialFormats(self):
+        """Tests versioned formats and reading legacy protocol 0 files"""
+        reqObj = self.__newRequest()
+        dd = _makeSessionDict(nSeq=5, seqLen=8)
+        for serialFormat in ("pickle", "json", "msgpack", "legacy"):
+            uds = UtilDataStore(reqObj, prefix=serialFormat, serialFormat=serialFormat)
+            for k, v in dd.items():
+                uds.set(k, v)
+            uds.serialize()
+            self.assertEqual(UtilDataStore(reqObj, prefix=serialFormat).getDictionary(), dd)
+
+        # Legacy file written directly with protocol 0
+        uds = UtilDataStore(reqObj, prefix="old")
+        with open(uds.getFilePath(), "wb") as fb:
+            pickle.dump(dd, fb, 0)
+        self.assertEqual(UtilDataStore(reqObj, prefix="old").getDictionary(), dd)
+
+        # Content not representable in json falls back to pickle
+        uds = UtilDataStore(reqObj, prefix="fallback", serialFormat="json")
+        uds.set("s", {1, 2})
+        uds.serialize()
+        self.assertEqual(UtilDataStore(reqObj, prefix="fallback").get("s"), {1, 2})
+
+        # Content the codecs would change (int keys, tuples) is read back unchanged
+        for serialFormat in ("json", "msgpack"):
+            for obj in ({1: "a"}, {"t": (1, 2)}, {"l": [{"d": {2: (3,)}}]}, {"b": [b"x"]}):
+                fb = io.BytesIO()
+                dumpData(obj, fb, serialFormat)
+                fb.seek(0)
+                self.assertEqual(loadData(fb), obj)
+            uds = UtilDataStore(reqObj, prefix="roundtrip-" + serialFormat, serialFormat=serialFormat)
+            uds.set(1, (1, 2))
+            uds.serialize()
+            self.assertEqual(UtilDataStore(reqObj, prefix="roundtrip-" + serialFormat).get(1), (1, 2))
+
+    def testJournal(self):
+        """Tests journal mode updates, replay and compaction"""
+        reqObj = self.__newRequest()
+        uds = UtilDataStore(reqObj, journal=True, journalThreshold=300)
+        uds.set("k1", "v1")
+        uds.serialize()
+        snapSize = os.path.getsize(uds.getFilePath())
+        uds.append("k2", 1)
+        uds.extend("k2", [2, 3])
+        uds.updateDict("k3", "sub", 4)
+        uds.serialize()
+        # Snapshot untouched -- changes are in the journal
+        self.assertEqual(os.path.getsize(uds.getFilePath()), snapSize)
+        self.assertTrue(os.path.exists(uds.getJournalFilePath()))
+        expected = {"k1": "v1", "k2": [1, 2, 3], "k3": {"sub": 4}}
+        self.assertEqual(UtilDataStore(reqObj, journal=True).getDictionary(), expected)
+        # Stores not in journal mode also replay the journal
+        self.assertEqual(UtilDataStore(reqObj).getDictionary(), expected)
+
+        # Replaying a journal twice does not duplicate list entries
+        uds = UtilDataStore(reqObj, journal=True)
+        self.assertTrue(uds.compact())
+        self.assertFalse(os.path.exists(uds.getJournalFilePath()))
+        uds2 = UtilDataStore(reqObj, journal=True)
+        uds2.append("k2", 4)
+        uds2.serialize()
+        with open(uds2.getJournalFilePath(), "rb") as fb:
+            jnl = fb.read()
+        with open(uds2.getJournalFilePath(), "ab") as fb:
+            # second copy plus a torn record
+            fb.write(jnl + jnl[:5])
+        self.assertEqual(UtilDataStore(reqObj).get("k2"), [1, 2, 3, 4])
+
+        # Journal beyond threshold is compacted
+        uds = UtilDataStore(reqObj, journal=True, journalThreshold=300)
+        for ii in range(20):
+            uds.set("key%d" % ii, "x" * 20)
+            uds.serialize()
+        self.assertLess(os.path.getsize(uds.getJournalFilePath()), 400)
+        uds.reset()
+        uds.set("only", 1)
+        uds.serialize()
+        self.assertEqual(UtilDataStore(reqObj).getDictionary(), {"only": 1})
+        # Non-journal serialize removes the journal
+        uds = UtilDataStore(reqObj)
+        uds.serialize()
+        self.assertFalse(os.path.exists(uds.getJournalFilePath()))
+        self.assertEqual(UtilDataStore(reqObj).getDictionary(), {"only": 1})
+
+    def testTransaction(self):
+        """Tests concurrent read-modify-write transactions"""
+        reqObj = self.__newRequest()
+        nThreads = 4
+        nUpdates = 10
+
+        def worker(tId, journal):
+            for ii in range(nUpdates):
+                uds = UtilDataStore(reqObj, journal=journal)
+                with uds.transaction():
+                    uds.append("values", (tId, ii))
+                    uds.updateDict("last", tId, ii)
+
+        for journal in (False, True):
+            uds = UtilDataStore(reqObj)
+            uds.reset()
+            self.assertTrue(uds.serialize())
+            threadL = [threading.Thread(target=worker, args=(tId, journal)) for tId in range(nThreads)]
+            for th in threadL:
+                th.start()
+            for th in threadL:
+                th.join()
+            uds = UtilDataStore(reqObj)
+            self.assertEqual(len(uds.get("values")), nThreads * nUpdates)
+            self.assertEqual(uds.get("last"), dict.fromkeys(range(nThreads), nUpdates - 1))
+
+        # Failed transaction is not written
+        uds = UtilDataStore(reqObj)
+        with self.assertRaises(ValueError), uds.transaction():
+            uds.set("bad", 1)
+            raise ValueError("abort")
+        self.assertEqual(uds.get("bad"), "")
+        self.assertEqual(UtilDataStore(reqObj).get("bad"), "")
+        # No temporary files remain
+        sessionPath = reqObj.getSessionObj().getPath()
+        self.assertEqual([fn for fn in os.listdir(sessionPath) if fn.endswith(".tmp")], [])
+
+        # Stores are read without a lock when the lock file cannot be created
+        lockPath = uds.getFilePath()[: -len(".pic")] + ".lock"
+        os.remove(lockPath)
+        os.mkdir(lockPath)
+        self.assertEqual(len(UtilDataStore(reqObj).get("values")), nThreads * nUpdates)
+        os.rmdir(lockPath)
+
+    def testCache(self):
+        """Tests the per-process store cache"""
+        reqObj = self.__newRequest()
+        cache = UtilDataStore.getCache()
+        cache.clear()
+        for journal in (False, True):
+            prefix = "cache-jnl" if journal else "cache"
+            uds = UtilDataStore(reqObj, prefix=prefix, journal=journal, cache=True)
+            uds.set("k1", "v1")
+            uds.append("k2", 1)
+            self.assertTrue(uds.serialize())
+            stats = cache.getStats()
+            uds = UtilDataStore(reqObj, prefix=prefix, journal=journal, cache=True)
+            self.assertEqual(uds.getDictionary(), {"k1": "v1", "k2": [1]})
+            self.assertEqual(cache.getStats()["hits"], stats["hits"] + 1)
+
+            # Updates to one instance are not visible through the cached copy of another
+            uds2 = UtilDataStore(reqObj, prefix=prefix, journal=journal, cache=True)
+            uds.append("k2", 2)
+            uds.updateDict("k3", "sub", 1)
+            self.assertEqual(uds2.get("k2"), [1])
+            self.assertEqual(uds2.get("k3"), "")
+
+            # Writes by an uncached instance invalidate the entry
+            time.sleep(0.01)
+            uds3 = UtilDataStore(reqObj, prefix=prefix, journal=journal, cache=False)
+            uds3.set("k1", "v2")
+            self.assertTrue(uds3.serialize())
+            stats = cache.getStats()
+            self.assertEqual(UtilDataStore(reqObj, prefix=prefix, journal=journal, cache=True).get("k1"), "v2")
+            self.assertEqual(cache.getStats()["misses"], stats["misses"] + 1)
+
+            # A stale instance appending to the journal must not leave its view in the cache
+            uds.serialize()
+            self.assertEqual(
+                UtilDataStore(reqObj, prefix=prefix, journal=journal, cache=True).getDictionary(),
+                UtilDataStore(reqObj, prefix=prefix, journal=journal, cache=False).getDictionary(),
+            )
+
+        cache.setMaxEntries(1)
+        self.assertEqual(cache.getStats()["entries"], 1)
+        cache.setMaxEntries(64)
+
+    def testSqliteBackend(self):
+        """Tests the sqlite backend with key level access and import of file stores"""
+        reqObj = self.__newRequest()
+        uds = UtilDataStore(reqObj, prefix="old", serialFormat="pickle")
+        uds.set("k1", "v1")
+        uds.append("k2", 1)
+        uds.serialize()
+
+        # File store imported on first access
+        uds = UtilDataStore(reqObj, prefix="old", backend="sqlite")
+        self.assertTrue(uds.getFilePath().endswith("util-session.sqlite"))
+        self.assertEqual(uds.get("k2"), [1])
+        self.assertTrue(uds.append("k2", 2))
+        self.assertTrue(uds.updateDict("k3", "sub", 4))
+        self.assertTrue(uds.serialize())
+        # Only changed keys are written
+        uds2 = UtilDataStore(reqObj, prefix="old", backend="sqlite")
+        uds.set("k1", "v2")
+        uds2.set("k4", 4)
+        uds.serialize()
+        uds2.serialize()
+        uds = UtilDataStore(reqObj, prefix="old", backend="sqlite")
+        self.assertEqual(uds.getDictionary(), {"k1": "v2", "k2": [1, 2], "k3": {"sub": 4}, "k4": 4})
+        self.assertEqual(uds.get("missing"), "")
+
+        # Prefixes are independent and reset clears only the prefix
+        uds = UtilDataStore(reqObj, prefix="new", backend="sqlite")
+        uds.set((1, 2), "tuple key")
+        uds.serialize()
+        self.assertEqual(UtilDataStore(reqObj, prefix="new", backend="sqlite").get((1, 2)), "tuple key")
+        uds.reset()
+        uds.set("only", 1)
+        uds.serialize()
+        self.assertEqual(UtilDataStore(reqObj, prefix="new", backend="sqlite").getDictionary(), {"only": 1})
+        self.assertEqual(len(UtilDataStore(reqObj, prefix="old", backend="sqlite").getDictionary()), 4)
+
+        # Transactions
+        uds = UtilDataStore(reqObj, prefix="new", backend="sqlite")
+        with uds.transaction():
+            uds.append("list", 1)
+        with self.assertRaises(ValueError), uds.transaction():
+            uds.append("list", 2)
+            raise ValueError("abort")
+        self.assertEqual(UtilDataStore(reqObj, prefix="new", backend="sqlite").get("list"), [1])
+
+        # Database removed with the session directory is recreated
+        reqObj.getSessionObj().remakeSessionPath()
+        uds = UtilDataStore(reqObj, prefix="new", backend="sqlite")
+        self.assertEqual(uds.get("list"), "")
+        uds.set("list", [3])
+        self.assertTrue(uds.serialize())
+        self.assertEqual(UtilDataStore(reqObj, prefix="new", backend="sqlite").get("list"), [3])
+
+    def testLazyView(self):
+        """Tests the lazy dictionary view and linking it into a request"""
+        reqObj = self.__newRequest()
+        for backend in ("file", "sqlite"):
+            uds = UtilDataStore(reqObj, prefix="lazy", backend=backend)
+            uds.set("k1", "v1")
+            uds.set("k2", list(range(10)))
+            uds.serialize()
+
+            uds = UtilDataStore(reqObj, prefix="lazy", backend=backend)
+            view = uds.getDictionary(lazy=True)
+            self.assertEqual(sorted(view), ["k1", "k2"])
+            self.assertIn("k2", view)
+            self.assertNotIn("k3", view)
+            self.assertEqual(view["k2"], list(range(10)))
+            with self.assertRaises(KeyError):
+                view["k3"]  # pylint: disable=pointless-statement
+            self.assertEqual(dict(view), {"k1": "v1", "k2": list(range(10))})
+
+            # Linked as a fallback layer
+            rqObj = InputRequest({"k1": ["request"], "other": ["x"]})
+            rqObj.setDictionary(UtilDataStore(reqObj, prefix="lazy", backend=backend).getDictionary(lazy=True))
+            self.assertEqual(rqObj.getValue("k1"), "request")
+            self.assertEqual(rqObj.getRawValue("k2"), list(range(10)))
+            rqObj.setDictionary(UtilDataStore(reqObj, prefix="lazy", backend=backend).getDictionary(lazy=True), overWrite=True)
+            self.assertEqual(rqObj.getValue("k1"), "v1")
+            self.assertTrue(rqObj.exists("k2"))
+            rqObj.setValue("k1", "new")
+            self.assertEqual(rqObj.getValue("k1"), "new")
+            self.assertEqual(rqObj.getDictionary(), {"k1": ["new"], "k2": [list(range(10))], "other": ["x"]})
+
+    @unittest.skipUnless(os.environ.get("WWPDB_BENCHMARK"), "benchmark - set WWPDB_BENCHMARK to run")
+    def testSerializationTiming(self):
+        """Benchmark load and dump times for a large session dictionary"""
+        dd = _makeSessionDict()
+        fp = os.path.join(self.__sessiontop, "uds-benchmark.pic")
+        for serialFormat in ("legacy", "pickle", "json", "msgpack"):
+            t0 = time.time()
+            with open(fp, "wb") as fb:
+                dumpData(dd, fb, serialFormat)
+            t1 = time.time()
+            with open(fp, "rb") as fb:
+                rd = loadData(fb)
+            t2 = time.time()
+            self.assertEqual(rd["alignments"]["seq_1"]["details"], dd["alignments"]["seq_1"]["details"])
+            sys.stderr.write(
+                "UtilDataStore format %-8s size %10d bytes dump %.4f s load %.4f s\n"
+                % (serialFormat, os.path.getsize(fp), t1 - t0, t2 - t1)
+            )
+
+
+if __name__ == "__main__":  # pragma: no cover
+    unittest.main()
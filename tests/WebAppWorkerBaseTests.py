@@ -119,6 +119,38 @@ class SessionTests(unittest.TestCase):
         dst = os.path.join(sesspath, "WebAppWorkerBaseTests.py")
         self.assertTrue(os.path.exists(dst))
         self.assertTrue(filecmp.cmp(dst, self.__reffile))
+        self.assertEqual(reqObj.getRawValue("uploadFileInfo")["size"], os.path.getsize(self.__reffile))
+
+    def testWebappWorkerUploadQuota(self):
+        """Tests WebAppWorker upload rejected over the session quota"""
+        reqObj = InputRequest(self.__paramDict, sessionConfig={"quotaHard": 10})
+        app = MyWebAppWorker(reqObj, verbose=True)
+        self.assertIsNotNone(app.newSessionOp())
+        self.assertIsNone(app.uploadFile())
+        self.assertFalse(os.path.exists(os.path.join(reqObj.getSessionObj().getPath(), "WebAppWorkerBaseTests.py")))
+
+        # Quotas in request parameters are ignored
+        reqObj = InputRequest(dict(self.__paramDict, SessionQuotaHard=[10]))
+        app = MyWebAppWorker(reqObj, verbose=True)
+        self.assertIsNotNone(app.newSessionOp())
+        self.assertEqual(app.uploadFile(), "WebAppWorkerBaseTests.py")
+
+        self.__paramDict["file"][0].file.seek(0)
+        reqObj = InputRequest(self.__paramDict, sessionConfig={"quotaHard": 10**9})
+        app = MyWebAppWorker(reqObj, verbose=True)
+        self.assertIsNotNone(app.newSessionOp())
+        self.assertEqual(app.uploadFile(), "WebAppWorkerBaseTests.py")
+        self.assertEqual(reqObj.getSessionObj().getUsage(), os.path.getsize(self.__reffile))
+
+        # Replacing the same file near the quota
+        self.__paramDict["file"][0].file.seek(0)
+        reqObj = InputRequest(self.__paramDict, sessionConfig={"quotaHard": os.path.getsize(self.__reffile) * 3 // 2})
+        app = MyWebAppWorker(reqObj, verbose=True)
+        self.assertIsNotNone(app.newSessionOp())
+        self.assertEqual(app.uploadFile(), "WebAppWorkerBaseTests.py")
+        self.__paramDict["file"][0].file.seek(0)
+        self.assertEqual(app.uploadFile(), "WebAppWorkerBaseTests.py")
+        self.assertEqual(reqObj.getSessionObj().getUsage(), os.path.getsize(self.__reffile))
 
     def testWebappWorkerParameter(self):
         """Tests WebAppWorker parameter setting"""
@@ -0,0 +1,185 @@
+##
+# File: WebDownloadUtilsTests.py
+# Date:  17-Oct-2026
+#
+# Updates:
+##
+"""Test cases for WebDownloadUtils"""
+
+__docformat__ = "restructuredtext en"
+__author__ = "Ezra Peisach"
+__email__ = "peisach@rcsb.rutgers.edu"
+__license__ = "Creative Commons Attribution 3.0 Unported"
+__version__ = "V0.01"
+
+import gzip
+import io
+import os
+import platform
+import shutil
+import tempfile
+import time
+import unittest
+import zipfile
+
+from wwpdb.io.locator.PathInfo import PathInfo
+
+from wwpdb.utils.session.WebDownloadUtils import WebDownloadUtils
+from wwpdb.utils.session.WebRequest import InputRequest, ResponseContent
+
+
+class WebDownloadUtilsTests(unittest.TestCase):
+    def setUp(self):
+        HERE = os.path.abspath(os.path.dirname(__file__))
+        TESTOUTPUT = os.path.join(HERE, "test-output", platform.python_version())
+        if not os.path.exists(TESTOUTPUT):  # pragma: no cover
+            os.makedirs(TESTOUTPUT)
+        # sessions created by each test are removed in tearDown
+        self.__sessiontop = tempfile.mkdtemp(prefix="download-", dir=TESTOUTPUT)
+        os.makedirs(os.path.join(self.__sessiontop, "sessions"))
+        self.__paramDict = {"TopSessionPath": [self.__sessiontop], "file_source": ["session"]}
+        WebDownloadUtils.getCache().clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.__sessiontop, ignore_errors=True)
+
+    def __makeSession(self, paramDict):
+        reqObj = InputRequest(paramDict)
+        reqObj.newSessionObj(forceNew=True)
+        sessionPath = reqObj.getSessionObj().getPath()
+        for fN in ["D_000001_model_P1.cif.V1", "D_000001_model_P1.cif.V2", "D_000001_sf_P1.cif.V1"]:
+            with open(os.path.join(sessionPath, fN), "w") as ofh:
+                ofh.write("data_%s\n" % fN)
+        return reqObj, sessionPath
+
+    def testResolveMany(self):
+        """Tests batched path resolution and the resolver cache"""
+        reqObj, sessionPath = self.__makeSession(dict(self.__paramDict))
+        wdu = WebDownloadUtils(reqObj)
+        specL = [
+            ("D_000001", "model"),
+            ("D_000001", "model", "pdbx", "next"),
+            ("D_000001", "model", "pdbx", "previous"),
+            ("D_000001", "model", "pdbx", "original"),
+            ("D_000001", "model", "pdbx", "2"),
+            ("D_000001", "structure-factors", "pdbx", "previous"),
+            ("", "model"),
+        ]
+        expected = [
+            "D_000001_model_P1.cif.V2",
+            "D_000001_model_P1.cif.V3",
+            "D_000001_model_P1.cif.V1",
+            "D_000001_model_P1.cif.V1",
+            "D_000001_model_P1.cif.V2",
+            None,
+            None,
+        ]
+        pathL = wdu.resolveMany(specL, fileSource="session")
+        self.assertEqual([os.path.basename(pth) if pth else None for pth in pathL], expected)
+        self.assertEqual(WebDownloadUtils.getCache().getStats()["hits"], 0)
+
+        # Repeated requests are cache hits
+        self.assertEqual(wdu.resolveMany(specL[:1], fileSource="session"), pathL[:1])
+        self.assertEqual(WebDownloadUtils.getCache().getStats()["hits"], 1)
+
+        # A new version changes the directory
+        time.sleep(0.01)
+        with open(os.path.join(sessionPath, "D_000001_model_P1.cif.V3"), "w") as ofh:
+            ofh.write("data_V3\n")
+        self.assertEqual(os.path.basename(wdu.resolveMany(specL[:1], fileSource="session")[0]), "D_000001_model_P1.cif.V3")
+
+        # Cache disabled
+        WebDownloadUtils.getCache().clear()
+        reqObj.setValue("DownloadResolverCacheTtl", "0")
+        wdu = WebDownloadUtils(reqObj)
+        wdu.resolveMany(specL, fileSource="session")
+        self.assertEqual(WebDownloadUtils.getCache().getStats()["entries"], 0)
+
+    def testResolveMatchesPathInfo(self):
+        """Tests that batched version resolution agrees with PathInfo"""
+        reqObj = InputRequest(dict(self.__paramDict, DownloadResolverCacheTtl=["0"]))
+        reqObj.newSessionObj(forceNew=True)
+        sessionPath = reqObj.getSessionObj().getPath()
+        versionD = {
+            "D_000001": [],
+            "D_000002": ["V1"],
+            "D_000003": ["V1", "V2"],
+            "D_000004": ["V1", "V3", "V3.gz", "V10", "Vx"],
+        }
+        for dataSetId, vL in versionD.items():
+            for vS in vL:
+                with open(os.path.join(sessionPath, "%s_model_P1.cif.%s" % (dataSetId, vS)), "w") as ofh:
+                    ofh.write("data_%s\n" % vS)
+        # a longer partition number shares the prefix of the file name
+        with open(os.path.join(sessionPath, "D_000002_model_P11.cif.V7"), "w") as ofh:
+            ofh.write("data_V7\n")
+        pI = PathInfo(sessionPath=sessionPath)
+        wdu = WebDownloadUtils(reqObj)
+        specL = []
+        for dataSetId in versionD:
+            for versionId in ["latest", "next", "previous", "original", "1", "3"]:
+                specL.append((dataSetId, "model", "pdbx", versionId, "1"))
+        pathL = wdu.resolveMany(specL, fileSource="session")
+        for (dataSetId, contentType, formatType, versionId, partNumber), pth in zip(specL, pathL):
+            expected = pI.getFilePath(
+                dataSetId,
+                contentType=contentType,
+                formatType=formatType,
+                fileSource="session",
+                versionId=versionId,
+                partNumber=partNumber,
+            )
+            self.assertEqual(pth, expected, (dataSetId, versionId))
+        self.assertEqual(pathL[specL.index(("D_000004", "model", "pdbx", "latest", "1"))], os.path.join(sessionPath, "D_000004_model_P1.cif.V10"))
+
+    def testBundle(self):
+        """Tests streamed bundle downloads"""
+        paramDict = dict(self.__paramDict)
+        paramDict["bundle_file"] = ["D_000001,model", "D_000001,model,pdbx,1", "D_000001,model,pdbx,7"]
+        reqObj, _sessionPath = self.__makeSession(paramDict)
+        rC = WebDownloadUtils(reqObj).makeBundleResponse(archiveName="D_000001-files")
+        rD = rC.get()
+        self.assertEqual(rD["CONTENT_TYPE"], "application/zip")
+        with zipfile.ZipFile(io.BytesIO(b"".join(rD["FILE_ITERATOR"]))) as zf:
+            self.assertEqual(sorted(zf.namelist()), ["D_000001_model_P1.cif.V1", "D_000001_model_P1.cif.V2"])
+
+        rC = WebDownloadUtils(reqObj).makeBundleResponse(specList=[("D_000001", "model", "pdbx", "7")])
+        self.assertTrue(rC.get()["RETURN_STRING"].find("failure") > 0)
+
+    def testDownloadCompression(self):
+        """Tests that on-the-fly compression of downloads is opt-in"""
+        paramDict = dict(
+            self.__paramDict, data_set_id=["D_000001"], content_type=["model"], HTTP_ACCEPT_ENCODING=["gzip"]
+        )
+        reqObj, sessionPath = self.__makeSession(paramDict)
+        data = b"ATOM   1 N ALA A 1 11.104 6.134 -6.504 1.00 0.00\n" * 20000
+        with open(os.path.join(sessionPath, "D_000001_model_P1.cif.V3"), "wb") as ofh:
+            ofh.write(data)
+
+        threshold = ResponseContent.MULTIPART_THRESHOLD
+        try:
+            ResponseContent.MULTIPART_THRESHOLD = 100000
+            rD = WebDownloadUtils(reqObj).makeDownloadResponse().get()
+            self.assertIsNone(rD["ENCODING"])
+            self.assertEqual(rD["CONTENT_LENGTH"], len(data))
+            self.assertEqual(rD["ACCEPT_RANGES"], "bytes")
+            self.assertEqual(b"".join(rD["FILE_ITERATOR"]), data)
+
+            reqObj.setValue("HTTP_RANGE", "bytes=100-199")
+            rD = WebDownloadUtils(reqObj).makeDownloadResponse().get()
+            self.assertEqual(rD["STATUS_CODE"], 206)
+            self.assertEqual(rD["CONTENT_LENGTH"], 100)
+            self.assertEqual(rD["RETURN_STRING"], data[100:200])
+
+            reqObj.setValue("HTTP_RANGE", "")
+            reqObj.setValue("compress", "yes")
+            rD = WebDownloadUtils(reqObj).makeDownloadResponse().get()
+            self.assertEqual(rD["ENCODING"], "gzip")
+            self.assertNotIn("CONTENT_LENGTH", rD)
+            self.assertEqual(gzip.decompress(b"".join(rD["FILE_ITERATOR"])), data)
+        finally:
+            ResponseContent.MULTIPART_THRESHOLD = threshold
+
+
+if __name__ == "__main__":  # pragma: no cover
+    unittest.main()
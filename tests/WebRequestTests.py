@@ -12,13 +12,39 @@ __email__ = "peisach@rcsb.rutgers.edu"
 __license__ = "Creative Commons Attribution 3.0 Unported"
 __version__ = "V0.01"
 
+import email.utils
+import gc
+import gzip
+import io
+import json
 import os
 import platform
+import shutil
+import struct
 import sys
+import tarfile
+import threading
+import time
+import tracemalloc
 import unittest
+import zipfile
+import zlib
 from datetime import datetime
 
-from wwpdb.utils.session.WebRequest import InputRequest, ResponseContent, WebRequest
+from wwpdb.utils.session.SessionManager import SessionManager
+from wwpdb.utils.session.WebRequest import (
+    ArchiveIterator,
+    CompressingIterator,
+    FileIterator,
+    InputRequest,
+    ResponseContent,
+    WebRequest,
+    acceptsEncoding,
+    getCompressionCodings,
+    getGzipContentSize,
+    getWsgiFileIterable,
+    parseByteRanges,
+)
 
 
 class MyWebRequest(WebRequest):
@@ -104,10 +130,31 @@ class SessionTests(unittest.TestCase):
         self.assertIsNotNone(sid)
         sObj = ir.getSessionObj()
         self.assertEqual(sid, sObj.getId())
+        # access is recorded when the request session is used
+        self.assertTrue(os.path.exists(os.path.join(sObj.getPath(), SessionManager.ACCESS_MARKER)))
         sObj = ir.newSessionObj(forceNew=True)
         sid = sObj.getId()
         self.assertIsNotNone(sid)
 
+    def testInputRequestSessionConfig(self):
+        """Tests the session layout is set by the application and not by request parameters"""
+        paramDict = {"TopSessionPath": [self.__sessiontop], "SessionShardDepth": ["2"], "SessionIdType": ["time"]}
+        ir = InputRequest(paramDict)
+        sObj = ir.newSessionObj(forceNew=True)
+        self.assertEqual(sObj.getShardList(), [])
+        # random identifiers do not start with the creation time
+        self.assertGreater(abs(int(sObj.getId()[:12], 16) - time.time() * 1000.0), 60000.0)
+        self.assertEqual(os.path.dirname(sObj.getPath()), os.path.join(self.__sessiontop, "sessions"))
+        shutil.rmtree(sObj.getPath())
+
+        ir = InputRequest(paramDict, sessionConfig={"shardDepth": 2})
+        self.assertEqual(ir.getSessionConfig(), {"shardDepth": 2})
+        sObj = ir.newSessionObj(forceNew=True)
+        self.assertEqual(len(sObj.getShardList()), 2)
+        self.assertEqual(sObj.getPath(), os.path.join(self.__sessiontop, "sessions", *(sObj.getShardList() + [sObj.getId()])))
+        self.assertEqual(ir.getSessionObj().getPath(), sObj.getPath())
+        shutil.rmtree(sObj.getPath())
+
 
 class ResponseTests(unittest.TestCase):
     def setUp(self):
@@ -187,6 +234,534 @@ class ResponseTests(unittest.TestCase):
 
         self.assertIn("dump", rc.dump()[0])
 
+    def __makeDataFile(self, fileName, nBytes):
+        fp = os.path.join(self.__sessiontop, fileName)
+        with open(fp, "wb") as ofh:
+            ofh.write(bytes(bytearray(ii % 251 for ii in range(nBytes))))
+        return fp
+
+    def testByteRanges(self):
+        """Tests partial content responses"""
+        self.assertIsNone(parseByteRanges("", 100))
+        self.assertIsNone(parseByteRanges("lines=1-2", 100))
+        self.assertIsNone(parseByteRanges("bytes=a-b", 100))
+        self.assertEqual(parseByteRanges("bytes=0-9", 100), [(0, 9)])
+        self.assertEqual(parseByteRanges("bytes=90-", 100), [(90, 99)])
+        self.assertEqual(parseByteRanges("bytes=-10", 100), [(90, 99)])
+        self.assertEqual(parseByteRanges("bytes=50-200", 100), [(50, 99)])
+        self.assertEqual(parseByteRanges("bytes=20-29, 0-9,5-14", 100), [(0, 14), (20, 29)])
+        self.assertEqual(parseByteRanges("bytes=200-300", 100), [])
+
+        fp = self.__makeDataFile("range-test.bin", 1000)
+        with open(fp, "rb") as ifh:
+            data = ifh.read()
+        self.assertEqual(b"".join(FileIterator(fp, None, offset=100, length=50)), data[100:150])
+
+        reqObj = InputRequest(dict(self.__paramDict, HTTP_RANGE=["bytes=100-199"]))
+        rc = ResponseContent(reqObj)
+        rc.setReturnFormat("binary")
+        rc.setBinaryFile(fp, attachmentFlag=True)
+        rD = rc.get()
+        self.assertEqual(rD["STATUS_CODE"], 206)
+        self.assertEqual(rD["CONTENT_RANGE"], "bytes 100-199/1000")
+        self.assertEqual(rD["CONTENT_LENGTH"], 100)
+        self.assertEqual(rD["ACCEPT_RANGES"], "bytes")
+        self.assertEqual(rD["RETURN_STRING"], data[100:200])
+
+        # Multiple ranges
+        rc = ResponseContent(reqObj)
+        rc.setReturnFormat("binary")
+        rc.setBinaryFile(fp, rangeSpec="bytes=0-9,-10")
+        rD = rc.get()
+        self.assertEqual(rD["STATUS_CODE"], 206)
+        self.assertTrue(rD["CONTENT_TYPE"].startswith("multipart/byteranges; boundary="))
+        body = b"".join(rD["FILE_ITERATOR"])
+        self.assertEqual(len(body), rD["CONTENT_LENGTH"])
+        self.assertIn(b"Content-Range: bytes 990-999/1000\r\n\r\n" + data[990:] + b"\r\n", body)
+        self.assertTrue(body.endswith(b"--\r\n"))
+
+        # Unsatisfiable and absent ranges
+        rc = ResponseContent(reqObj)
+        rc.setReturnFormat("binary")
+        rc.setBinaryFile(fp, rangeSpec="bytes=2000-")
+        rD = rc.get()
+        self.assertEqual(rD["STATUS_CODE"], 416)
+        self.assertEqual(rD["CONTENT_RANGE"], "bytes */1000")
+        rc = ResponseContent(InputRequest(dict(self.__paramDict)))
+        rc.setReturnFormat("binary")
+        rc.setBinaryFile(fp)
+        rD = rc.get()
+        self.assertNotIn("STATUS_CODE", rD)
+        self.assertEqual(rD["RETURN_STRING"], data)
+
+    def testFileIteratorZeroCopy(self):
+        """Tests file descriptor based serving and the reused buffer iterator"""
+        fp = self.__makeDataFile("zerocopy-test.bin", 100000)
+        with open(fp, "rb") as ifh:
+            data = ifh.read()
+
+        fI = FileIterator(fp, None, offset=10, length=50000, chunkSize=4096)
+        self.assertEqual(b"".join(bytes(view) for view in fI.iterViews()), data[10:50010])
+        self.assertEqual(fI.getStats()["bytes"], 50000)
+
+        fI = FileIterator(fp, None, offset=10, length=100)
+        self.assertEqual(fI.read(60) + fI.read(), data[10:110])
+        self.assertEqual(fI.read(), b"")
+        fI.close()
+
+        outPath = os.path.join(self.__sessiontop, "zerocopy-out.bin")
+        with open(outPath, "wb") as ofh:
+            self.assertEqual(FileIterator(fp, None, offset=1000, length=90000).sendfile(ofh.fileno()), 90000)
+        with open(outPath, "rb") as ifh:
+            self.assertEqual(ifh.read(), data[1000:91000])
+
+        # wsgi.file_wrapper is used for plain files
+        reqObj = InputRequest(dict(self.__paramDict))
+        rc = ResponseContent(reqObj)
+        rc.setReturnFormat("binary")
+        rc.setBinaryFile(fp, rangeSpec="bytes=0-9,20-29")
+        rD = rc.get()
+        self.assertNotIn("FILE_DESCRIPTOR", rD)
+        self.assertIs(getWsgiFileIterable(rD, {"wsgi.file_wrapper": lambda fh, bs: ("wrapped", fh, bs)}), rD["FILE_ITERATOR"])
+        self.assertEqual(rD["CONTENT_LENGTH"], len(b"".join(rD["FILE_ITERATOR"])))
+        # without wsgi.file_wrapper the iterator is the response body - chunks must be bytes
+        rD = {"FILE_ITERATOR": FileIterator(fp, None, chunkSize=4096)}
+        chunkL = list(getWsgiFileIterable(rD, {}))
+        self.assertTrue(all(type(chunk) is bytes for chunk in chunkL))
+        self.assertEqual(b"".join(chunkL), data)
+        rD = {"FILE_ITERATOR": FileIterator(fp, None)}
+        wrapped = getWsgiFileIterable(rD, {"wsgi.file_wrapper": lambda fh, bs: ("wrapped", fh, bs)})
+        self.assertEqual(wrapped[0], "wrapped")
+        self.assertIs(getWsgiFileIterable(rD, {}), rD["FILE_ITERATOR"])
+        rD["FILE_ITERATOR"].close()
+
+    def testFileIteratorChunking(self):
+        """Tests adaptive chunk sizes, prefetching and read statistics"""
+        self.assertEqual(FileIterator.getChunkSize(1000), FileIterator.MIN_CHUNK_SIZE)
+        self.assertEqual(FileIterator.getChunkSize(8 * 1024 * 1024), 1024 * 1024)
+        self.assertEqual(FileIterator.getChunkSize(20 * 1024**3), FileIterator.CHUNK_SIZE)
+        self.assertEqual(FileIterator.getChunkSize(20 * 1024**3, maxChunkSize=32 * 1024 * 1024), 32 * 1024 * 1024)
+        self.assertEqual(FileIterator.getChunkSize(None), FileIterator.CHUNK_SIZE)
+
+        fp = self.__makeDataFile("chunking-test.bin", 300000)
+        with open(fp, "rb") as ifh:
+            data = ifh.read()
+        fI = FileIterator(fp, None, offset=5, length=250000)
+        self.assertEqual(fI.chunkSize, FileIterator.MIN_CHUNK_SIZE)
+        self.assertEqual(b"".join(fI), data[5:250005])
+        sD = fI.getStats()
+        self.assertEqual(sD["bytes"], 250000)
+        self.assertGreater(sD["elapsedSeconds"], 0)
+
+        fI = FileIterator(fp, None, chunkSize=1000, prefetch=True)
+        chunkL = list(fI)
+        self.assertEqual(len(chunkL), 300)
+        self.assertEqual(b"".join(chunkL), data)
+        self.assertTrue(all(type(chunk) is bytes for chunk in chunkL))
+        self.assertTrue(fI.getStats()["prefetch"])
+        # closed before the end
+        fI = FileIterator(fp, None, chunkSize=1000, prefetch=True)
+        self.assertEqual(next(fI), data[:1000])
+        fI.close()
+        self.assertTrue(fI.fp.closed)
+        # discarded without close()
+        fI = FileIterator(fp, None, chunkSize=1000, prefetch=True)
+        self.assertEqual(next(fI), data[:1000])
+        threadL = [th for th in threading.enumerate() if th.name == "FileIterator-prefetch"]
+        self.assertEqual(len(threadL), 1)
+        del fI
+        gc.collect()
+        threadL[0].join(timeout=5.0)
+        self.assertFalse(threadL[0].is_alive())
+
+        pD = {"ResponseChunkSize": ["4096"], "ResponsePrefetch": ["true"]}
+        saveThreshold = ResponseContent.MULTIPART_THRESHOLD
+        try:
+            ResponseContent.MULTIPART_THRESHOLD = 1000
+            rc = ResponseContent(InputRequest(dict(self.__paramDict, **pD)))
+            rc.setReturnFormat("binary")
+            rc.setBinaryFile(fp)
+            rD = rc.get()
+        finally:
+            ResponseContent.MULTIPART_THRESHOLD = saveThreshold
+        self.assertEqual(rD["FILE_ITERATOR"].chunkSize, 4096)
+        self.assertEqual(b"".join(rD["FILE_ITERATOR"]), data)
+
+    def testArchiveIterator(self):
+        """Tests streamed ZIP and tar archives of several files"""
+        pathL = [self.__makeDataFile("archive-test-%d.bin" % ii, 1000 * ii) for ii in range(1, 4)]
+        pathL.append(self.__makeDataFile("archive-test.cif.gz", 70000))
+        dataD = {}
+        for fp in pathL:
+            with open(fp, "rb") as ifh:
+                dataD[os.path.basename(fp)] = ifh.read()
+
+        for archiveFormat in ["zip", "tar", "tgz"]:
+            aI = ArchiveIterator(pathL + [pathL[0]], archiveName="D_000001", archiveFormat=archiveFormat)
+            self.assertTrue(aI.fileName.startswith("D_000001."))
+            body = b"".join(aI)
+            if archiveFormat == "zip":
+                self.assertIsNone(aI.fileSize)
+                with zipfile.ZipFile(io.BytesIO(body)) as zf:
+                    self.assertIsNone(zf.testzip())
+                    self.assertEqual({nm: zf.read(nm) for nm in zf.namelist()}, dataD)
+                    self.assertEqual(zf.getinfo("archive-test.cif.gz").compress_type, zipfile.ZIP_STORED)
+            else:
+                if archiveFormat == "tar":
+                    self.assertEqual(aI.fileSize, len(body))
+                with tarfile.open(fileobj=io.BytesIO(body)) as tf:
+                    self.assertEqual({ti.name: tf.extractfile(ti).read() for ti in tf.getmembers()}, dataD)
+
+        with self.assertRaises(ValueError):
+            ArchiveIterator(pathL, archiveFormat="rar")
+
+        rc = ResponseContent(InputRequest(dict(self.__paramDict)))
+        rc.setReturnFormat("binary")
+        self.assertTrue(rc.setArchiveFiles(pathL, archiveName="bundle", archiveFormat="tar"))
+        rD = rc.get()
+        self.assertEqual(rD["CONTENT_TYPE"], "application/x-tar")
+        self.assertEqual(rD["DISPOSITION"], "attachment; filename=bundle.tar")
+        self.assertEqual(rD["CONTENT_LENGTH"], len(b"".join(rD["FILE_ITERATOR"])))
+
+    def __makeBgzfFile(self, fileName, data, blockSize=65280):
+        """Write data as a blocked gzip (BGZF) file"""
+        fp = os.path.join(self.__sessiontop, fileName)
+        with open(fp, "wb") as ofh:
+            for ii in range(0, len(data), blockSize):
+                block = data[ii : ii + blockSize]
+                cObj = zlib.compressobj(6, zlib.DEFLATED, -15)
+                cData = cObj.compress(block) + cObj.flush()
+                head = b"\x1f\x8b\x08\x04" + b"\x00" * 4 + b"\x00\xff" + struct.pack("<HBBHH", 6, 66, 67, 2, len(cData) + 25)
+                ofh.write(head + cData + struct.pack("<II", zlib.crc32(block) & 0xFFFFFFFF, len(block)))
+        return fp
+
+    def testGzipContentSize(self):
+        """Tests uncompressed size discovery and streaming of gzip files"""
+        data = bytes(bytearray(ii % 251 for ii in range(300000)))
+        fp = self.__makeBgzfFile("bgzf-test.txt.gz", data)
+        with gzip.open(fp, "rb") as ifh:
+            self.assertEqual(ifh.read(), data)
+        self.assertEqual(getGzipContentSize(fp), len(data))
+        fI = FileIterator(fp, None, uncompress=True)
+        self.assertEqual(fI.fileSize, len(data))
+        self.assertEqual(b"".join(fI), data)
+
+        # Size of plain gzip files is not declared
+        fp = os.path.join(self.__sessiontop, "gzip-test.txt.gz")
+        with gzip.open(fp, "wb") as ofh:
+            ofh.write(data)
+        with open(fp, "ab") as ofh:
+            ofh.write(gzip.compress(data))
+        self.assertIsNone(getGzipContentSize(fp))
+        self.assertIsNone(getGzipContentSize(os.path.join(self.__sessiontop, "missing.gz")))
+        fI = FileIterator(fp, None, uncompress=True)
+        self.assertIsNone(fI.fileSize)
+        self.assertEqual(b"".join(bytes(view) for view in fI.iterViews()), data + data)
+        outPath = os.path.join(self.__sessiontop, "gzip-test.out")
+        with open(outPath, "wb") as ofh:
+            self.assertEqual(FileIterator(fp, None, uncompress=True).sendfile(ofh.fileno()), 2 * len(data))
+
+        reqObj = InputRequest(dict(self.__paramDict))
+        rc = ResponseContent(reqObj)
+        rc.setReturnFormat("binary")
+        threshold = ResponseContent.MULTIPART_THRESHOLD
+        try:
+            ResponseContent.MULTIPART_THRESHOLD = 1000
+            rc.setBinaryFile(fp, serveCompressed=False)
+        finally:
+            ResponseContent.MULTIPART_THRESHOLD = threshold
+        rD = rc.get()
+        self.assertNotIn("CONTENT_LENGTH", rD)
+        self.assertEqual(b"".join(rD["FILE_ITERATOR"]), data + data)
+
+    def testGzipNegotiation(self):
+        """Tests serving gzip files compressed or uncompressed according to Accept-Encoding"""
+        self.assertTrue(acceptsEncoding("gzip, deflate, br", "gzip"))
+        self.assertTrue(acceptsEncoding("x-gzip", "gzip"))
+        self.assertTrue(acceptsEncoding("*", "gzip"))
+        self.assertFalse(acceptsEncoding("gzip;q=0, *", "gzip"))
+        self.assertFalse(acceptsEncoding("deflate", "gzip"))
+        self.assertFalse(acceptsEncoding("", "gzip"))
+        self.assertTrue(acceptsEncoding(None, "identity"))
+
+        data = b"data_test\n" * 1000
+        fp = os.path.join(self.__sessiontop, "negotiate-test.cif.gz")
+        with gzip.open(fp, "wb") as ofh:
+            ofh.write(data)
+        with open(fp, "rb") as ifh:
+            gzData = ifh.read()
+        for acceptEncoding, expected, encoding in [("gzip, deflate", gzData, "gzip"), ("identity", data, None), (None, data, None)]:
+            pD = dict(self.__paramDict)
+            if acceptEncoding:
+                pD["HTTP_ACCEPT_ENCODING"] = [acceptEncoding]
+            rc = ResponseContent(InputRequest(pD))
+            rc.setReturnFormat("binary")
+            rc.setBinaryFile(fp, attachmentFlag=True, serveCompressed=False)
+            rD = rc.get()
+            self.assertEqual(rD["RETURN_STRING"], expected)
+            self.assertEqual(rD["ENCODING"], encoding)
+            self.assertEqual(rD["VARY"], "Accept-Encoding")
+            self.assertEqual(rD["DISPOSITION"], "attachment; filename=negotiate-test.cif")
+
+    def testCompressOnTheFly(self):
+        """Tests streaming compression of uncompressed files"""
+        fp = os.path.join(self.__sessiontop, "compress-test.cif")
+        with open(fp, "w") as ofh:
+            ofh.writelines("ATOM %6d C CA . ALA A 1 %8.3f %8.3f %8.3f\n" % (ii, ii * 0.1, ii * 0.2, ii * 0.3) for ii in range(20000))
+        with open(fp, "rb") as ifh:
+            data = ifh.read()
+        pD = dict(self.__paramDict, HTTP_ACCEPT_ENCODING=["gzip"], ResponseCompressMinSize=["1000"])
+        rc = ResponseContent(InputRequest(pD))
+        rc.setReturnFormat("binary")
+        rc.setBinaryFile(fp, attachmentFlag=True, compress=True)
+        rD = rc.get()
+        self.assertEqual(rD["ENCODING"], "gzip")
+        self.assertEqual(rD["VARY"], "Accept-Encoding")
+        self.assertEqual(gzip.decompress(rD["RETURN_STRING"]), data)
+        self.assertLess(len(rD["RETURN_STRING"]), len(data) // 3)
+
+        # Large files are compressed while streaming
+        threshold = ResponseContent.MULTIPART_THRESHOLD
+        try:
+            ResponseContent.MULTIPART_THRESHOLD = 100000
+            rc = ResponseContent(InputRequest(pD))
+            rc.setReturnFormat("binary")
+            rc.setBinaryFile(fp, attachmentFlag=True, compress=True)
+        finally:
+            ResponseContent.MULTIPART_THRESHOLD = threshold
+        rD = rc.get()
+        self.assertNotIn("CONTENT_LENGTH", rD)
+        self.assertEqual(gzip.decompress(b"".join(rD["FILE_ITERATOR"])), data)
+
+        # Not compressed - client without gzip, range requests, small or large files, or not requested
+        for pD, kwD in [
+            (dict(self.__paramDict, ResponseCompressMinSize=["1000"]), {"compress": True}),
+            (dict(self.__paramDict, HTTP_ACCEPT_ENCODING=["gzip"], HTTP_RANGE=["bytes=0-9"]), {"compress": True}),
+            (dict(self.__paramDict, HTTP_ACCEPT_ENCODING=["gzip"], ResponseCompressMinSize=["100000000"]), {"compress": True}),
+            (
+                dict(self.__paramDict, HTTP_ACCEPT_ENCODING=["gzip"], ResponseCompressMinSize=["1000"], ResponseCompressMaxSize=["2000"]),
+                {"compress": True},
+            ),
+            (dict(self.__paramDict, HTTP_ACCEPT_ENCODING=["gzip"], ResponseCompressMinSize=["1000"]), {}),
+        ]:
+            rc = ResponseContent(InputRequest(pD))
+            rc.setReturnFormat("binary")
+            rc.setBinaryFile(fp, **kwD)
+            rD = rc.get()
+            self.assertIsNone(rD["ENCODING"])
+            self.assertTrue(data.startswith(rD["RETURN_STRING"]))
+
+    def testConditionalRequests(self):
+        """Tests validators and not modified responses"""
+        fp = self.__makeDataFile("conditional-test.txt", 1000)
+        rc = ResponseContent(InputRequest(dict(self.__paramDict)))
+        rc.setReturnFormat("binary")
+        rc.setBinaryFile(fp)
+        rD = rc.get()
+        etag = rD["ETAG"]
+        lastModified = rD["LAST_MODIFIED"]
+        self.assertIn(("ETag", etag), rD["HEADERS"])
+        self.assertIn(("Last-Modified", lastModified), rD["HEADERS"])
+        self.assertEqual(len(rD["RETURN_STRING"]), 1000)
+
+        for pD in [
+            {"HTTP_IF_NONE_MATCH": ['"other", W/%s' % etag]},
+            {"HTTP_IF_MODIFIED_SINCE": [lastModified]},
+            {"HTTP_IF_NONE_MATCH": ["*"]},
+        ]:
+            for returnFormat in ["binary", "text"]:
+                rc = ResponseContent(InputRequest(dict(self.__paramDict, **pD)))
+                rc.setReturnFormat(returnFormat)
+                if returnFormat == "binary":
+                    rc.setBinaryFile(fp)
+                else:
+                    rc.setTextFile(fp)
+                rD = rc.get()
+                self.assertEqual(rD["STATUS_CODE"], 304)
+                self.assertEqual(len(rD["RETURN_STRING"]), 0)
+                self.assertNotIn("CONTENT_LENGTH", rD)
+
+        # Modified
+        for pD in [
+            {"HTTP_IF_NONE_MATCH": ['"other"']},
+            {"HTTP_IF_MODIFIED_SINCE": ["Mon, 01 Jan 2001 00:00:00 GMT"]},
+            {"HTTP_IF_MODIFIED_SINCE": ["not a date"]},
+        ]:
+            rc = ResponseContent(InputRequest(dict(self.__paramDict, **pD)))
+            rc.setReturnFormat("text")
+            rc.setTextFile(fp)
+            rD = rc.get()
+            self.assertNotIn("STATUS_CODE", rD)
+            self.assertEqual(len(rD["RETURN_STRING"]), 1000)
+
+        # Compressed representations have their own entity tags
+        pD = dict(self.__paramDict, HTTP_ACCEPT_ENCODING=["gzip"], ResponseCompressMinSize=["100"], HTTP_IF_NONE_MATCH=[etag])
+        rc = ResponseContent(InputRequest(pD))
+        rc.setReturnFormat("binary")
+        rc.setBinaryFile(fp, compress=True)
+        rD = rc.get()
+        self.assertNotIn("STATUS_CODE", rD)
+        self.assertNotEqual(rD["ETAG"], etag)
+
+        # A stored .gz file sent with and without Content-Encoding has an entity tag for each coding
+        gzPath = os.path.join(self.__sessiontop, "conditional-test.txt.gz")
+        with gzip.open(gzPath, "wb") as ofh:
+            ofh.write(b"x" * 1000)
+        etagD = {}
+        for kwD, acceptEncoding in [
+            ({"serveCompressed": False}, "gzip"),
+            ({"serveCompressed": False}, "identity"),
+            ({"serveCompressed": True}, "gzip"),
+        ]:
+            rc = ResponseContent(InputRequest(dict(self.__paramDict, HTTP_ACCEPT_ENCODING=[acceptEncoding])))
+            rc.setReturnFormat("binary")
+            rc.setBinaryFile(gzPath, **kwD)
+            rD = rc.get()
+            etagD[rD["ETAG"]] = rD["ENCODING"]
+        self.assertEqual(len(etagD), 3)
+        gzEtag = next(tag for tag, encoding in etagD.items() if encoding == "gzip")
+        pD = dict(self.__paramDict, HTTP_IF_NONE_MATCH=[gzEtag])
+        rc = ResponseContent(InputRequest(pD))
+        rc.setReturnFormat("binary")
+        rc.setBinaryFile(gzPath)
+        self.assertNotIn("STATUS_CODE", rc.get())
+
+        # Dates without a time zone are UTC whatever the local time zone
+        if hasattr(time, "tzset"):
+            tzSave = os.environ.get("TZ")
+            try:
+                os.environ["TZ"] = "Etc/GMT+12"
+                time.tzset()
+                ifModifiedSince = email.utils.formatdate(os.stat(fp).st_mtime - 3600)
+                self.assertTrue(ifModifiedSince.endswith("-0000"))
+                rc = ResponseContent(InputRequest(dict(self.__paramDict, HTTP_IF_MODIFIED_SINCE=[ifModifiedSince])))
+                rc.setReturnFormat("binary")
+                rc.setBinaryFile(fp)
+                self.assertNotIn("STATUS_CODE", rc.get())
+            finally:
+                if tzSave is None:
+                    del os.environ["TZ"]
+                else:
+                    os.environ["TZ"] = tzSave
+                time.tzset()
+
+        # Ranges are ignored if If-Range does not match
+        for ifRange, status in [(etag, 206), ('"other"', None)]:
+            pD = dict(self.__paramDict, HTTP_RANGE=["bytes=0-9"], HTTP_IF_RANGE=[ifRange])
+            rc = ResponseContent(InputRequest(pD))
+            rc.setReturnFormat("binary")
+            rc.setBinaryFile(fp)
+            self.assertEqual(rc.get().get("STATUS_CODE"), status)
+
+    def testStreamedText(self):
+        """Tests streamed text, jsonData and JSONP responses match the in-memory responses"""
+        text = "line \"quoted\" \u00e9\t\\ end\n" * 9000
+        txtPath = os.path.join(self.__sessiontop, "stream-test.txt")
+        with open(txtPath, "w", encoding="utf-8") as ofh:
+            ofh.write(text)
+        jsonPath = os.path.join(self.__sessiontop, "stream-test.json")
+        with open(jsonPath, "w") as ofh:
+            ofh.write('{"a": [1, 2, 3]}')
+
+        def body(rD):
+            return b"".join(rD["FILE_ITERATOR"]).decode("utf-8")
+
+        for fp in [txtPath, jsonPath]:
+            rcL = []
+            for stream in [False, True]:
+                rc = ResponseContent(InputRequest(dict(self.__paramDict)))
+                rc.setReturnFormat("jsonp")
+                rc.wrapFileAsJsonp(fp, "cb", stream=stream)
+                rcL.append(rc.get())
+            self.assertEqual(body(rcL[1]), rcL[0]["RETURN_STRING"])
+
+        rc = ResponseContent(InputRequest(dict(self.__paramDict)))
+        rc.setReturnFormat("jsonData")
+        rc.setJsonDataFile(txtPath)
+        rD = rc.get()
+        self.assertNotIn("CONTENT_LENGTH", rD)
+        self.assertEqual(json.loads(body(rD)), text)
+        rc.setJsonDataFile(jsonPath)
+        rD = rc.get()
+        self.assertEqual(rD["CONTENT_LENGTH"], os.path.getsize(jsonPath))
+        self.assertEqual(json.loads(body(rD)), {"a": [1, 2, 3]})
+
+        rc = ResponseContent(InputRequest(dict(self.__paramDict)))
+        rc.setReturnFormat("text")
+        rc.setTextFile(txtPath, stream=True)
+        rD = rc.get()
+        self.assertEqual(rD["CONTENT_LENGTH"], os.path.getsize(txtPath))
+        self.assertEqual(body(rD), text)
+
+    @unittest.skipUnless(os.environ.get("WWPDB_BENCHMARK"), "benchmark - set WWPDB_BENCHMARK to run")
+    def testCompressionTiming(self):
+        """Benchmark streaming compression throughput and ratio for typical content types"""
+        contentD = {
+            "mmCIF": "".join(
+                "ATOM   %5d N N   . MET A 1 1 ? %8.3f %8.3f %8.3f 1.00 %6.2f ? 1 MET A N   1\n"
+                % (ii, ii * 0.013 % 97, ii * 0.029 % 89, ii * 0.041 % 83, ii % 50 + 10.0)
+                for ii in range(100000)
+            ),
+            "XML": "".join(
+                '<ModelledSubgroup resname="ALA" resnum="%d" chain="A" rsrz="%.3f" avgoccu="1.00"/>\n' % (ii, ii * 0.007 % 3)
+                for ii in range(100000)
+            ),
+            "NMR-STAR": "".join(
+                "%d 1 1 %d ALA H H 1 %.3f 0.02 . 1\n" % (ii, ii // 7, 8.0 + ii * 0.003 % 1.5) for ii in range(100000)
+            ),
+        }
+        for contentType, text in contentD.items():
+            data = text.encode("ascii")
+            for coding in ["gzip", "zstd", "br"]:
+                if coding not in getCompressionCodings():
+                    continue
+                for level in [1, 6]:
+                    t0 = time.time()
+                    cI = CompressingIterator(iter([data[ii : ii + 1048576] for ii in range(0, len(data), 1048576)]), coding, level)
+                    for _chunk in cI:
+                        pass
+                    t1 = time.time()
+                    self.assertEqual(cI.bytesIn, len(data))
+                    sys.stderr.write(
+                        "Compression %-8s %-4s level %d size %8d ratio %6.2f  %8.1f MB/s\n"
+                        % (contentType, coding, level, len(data), len(data) / float(cI.bytesOut), len(data) / 1048576.0 / max(t1 - t0, 1.0e-6))
+                    )
+
+    @unittest.skipUnless(os.environ.get("WWPDB_BENCHMARK"), "benchmark - set WWPDB_BENCHMARK to run")
+    def testFileIteratorTiming(self):
+        """Benchmark throughput and peak allocation for the file serving modes
+
+        File size in MB is taken from the environment variable WWPDB_BENCHMARK_FILE_MB (default 100).
+        """
+        nMb = int(os.environ.get("WWPDB_BENCHMARK_FILE_MB", "100"))
+        fp = os.path.join(self.__sessiontop, "benchmark-download.bin")
+        outPath = os.path.join(self.__sessiontop, "benchmark-download.out")
+        block = os.urandom(1024 * 1024)
+        with open(fp, "wb") as ofh:
+            ofh.writelines(block for _ in range(nMb))
+        nBytes = nMb * 1024 * 1024
+        for mode in ("read", "readinto", "prefetch", "sendfile"):
+            with open(outPath, "wb") as ofh:
+                tracemalloc.start()
+                t0 = time.time()
+                if mode == "sendfile":
+                    nOut = FileIterator(fp, None).sendfile(ofh.fileno())
+                else:
+                    nOut = 0
+                    fI = FileIterator(fp, None, prefetch=mode == "prefetch")
+                    for chunk in fI.iterViews() if mode == "readinto" else fI:
+                        nOut += ofh.write(chunk)
+                t1 = time.time()
+                _current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            self.assertEqual(nOut, nBytes)
+            sys.stderr.write(
+                "FileIterator mode %-8s size %6d MB  %8.1f MB/s  peak allocation %8.2f MB\n"
+                % (mode, nMb, nMb / max(t1 - t0, 1.0e-6), peak / (1024.0 * 1024.0))
+            )
+        os.remove(fp)
+        os.remove(outPath)
+
 
 if __name__ == "__main__":  # pragma: no cover
     unittest.main()
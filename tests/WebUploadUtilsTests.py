@@ -0,0 +1,403 @@
+##
+# File: WebUploadUtilsTests.py
+# Date:  17-Oct-2026
+#
+# Updates:
+##
+"""Test cases for WebUploadUtils"""
+
+__docformat__ = "restructuredtext en"
+__author__ = "Ezra Peisach"
+__email__ = "peisach@rcsb.rutgers.edu"
+__license__ = "Creative Commons Attribution 3.0 Unported"
+__version__ = "V0.01"
+
+import bz2
+import filecmp
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+from unittest import mock
+
+from wwpdb.utils.session.WebRequest import InputRequest
+from wwpdb.utils.session.WebUploadUtils import WebUploadUtils
+
+
+class _ReadOnly:
+    """File object providing only read()"""
+
+    def __init__(self, data):
+        self.__fh = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self.__fh.read(size)
+
+
+class _Upload:
+    """Uploaded file as provided by the form parser"""
+
+    def __init__(self, filename, fh):
+        self.filename = filename
+        self.file = fh
+
+
+class WebUploadUtilsTests(unittest.TestCase):
+    def setUp(self):
+        HERE = os.path.abspath(os.path.dirname(__file__))
+        TESTOUTPUT = os.path.join(HERE, "test-output", platform.python_version())
+        if not os.path.exists(TESTOUTPUT):  # pragma: no cover
+            os.makedirs(TESTOUTPUT)
+        # sessions created by each test are removed in tearDown
+        self.__sessiontop = tempfile.mkdtemp(prefix="upload-", dir=TESTOUTPUT)
+        os.makedirs(os.path.join(self.__sessiontop, "sessions"))
+        self.__paramDict = {"TopSessionPath": [self.__sessiontop], "request_path": ["service/testpath"]}
+
+    def tearDown(self):
+        shutil.rmtree(self.__sessiontop, ignore_errors=True)
+
+    def testCopyFileObject(self):
+        """Tests the streaming copy of file objects"""
+        data = os.urandom(300000)
+        outPath = os.path.join(self.__sessiontop, "copy-test.bin")
+        with tempfile.TemporaryFile() as tfh:
+            tfh.write(data)
+            tfh.seek(1000)
+            for ifh in [tfh, io.BytesIO(data[1000:]), _ReadOnly(data[1000:])]:
+                with open(outPath, "wb") as ofh:
+                    ofh.write(b"head")
+                    self.assertEqual(WebUploadUtils.copyFileObject(ifh, ofh, bufSize=4096), len(data) - 1000)
+                    ofh.write(b"tail")
+                with open(outPath, "rb") as ifh:
+                    self.assertEqual(ifh.read(), b"head" + data[1000:] + b"tail")
+            self.assertEqual(tfh.tell(), len(data))
+
+    def testCopyToSession(self):
+        """Tests copy of an uploaded file to the session directory"""
+        fname = os.path.abspath(__file__)
+        with open(fname, "rb") as fin:
+            paramDict = dict(self.__paramDict, file=[_Upload("C:\\upload\\WebUploadUtilsTests.py", fin)])
+            reqObj = InputRequest(paramDict)
+            reqObj.newSessionObj(forceNew=True)
+            wuu = WebUploadUtils(reqObj)
+            self.assertTrue(wuu.isFileUpload())
+            self.assertEqual(wuu.copyToSession(), "WebUploadUtilsTests.py")
+        dst = os.path.join(reqObj.getSessionObj().getPath(), "WebUploadUtilsTests.py")
+        self.assertTrue(filecmp.cmp(dst, fname, shallow=False))
+
+    def testCopyDecompressed(self):
+        """Tests streaming decompression of multi-member files"""
+        data = os.urandom(100000) + b"x" * 500000
+        for coding, compress in [("gzip", gzip.compress), ("bz2", bz2.compress), ("xz", lzma.compress)]:
+            cData = compress(data) + compress(b"member2")
+            ofh = io.BytesIO()
+            teeFh = io.BytesIO()
+            nBytes = WebUploadUtils.copyDecompressed(io.BytesIO(cData), ofh, coding, bufSize=4096, teeFh=teeFh)
+            self.assertEqual(nBytes, len(data) + 7)
+            self.assertEqual(ofh.getvalue(), data + b"member2")
+            self.assertEqual(teeFh.getvalue(), cData)
+            with self.assertRaises(EOFError):
+                WebUploadUtils.copyDecompressed(io.BytesIO(cData[:-50]), io.BytesIO(), coding)
+        # Zero padding after gzip members is accepted as by the gzip module
+        for cData in [
+            gzip.compress(data) + b"\x00" * 10000,
+            gzip.compress(data) + b"\x00" * 10 + gzip.compress(b"member2") + b"\x00" * 4096,
+        ]:
+            ofh = io.BytesIO()
+            WebUploadUtils.copyDecompressed(io.BytesIO(cData), ofh, "gzip", bufSize=4096)
+            self.assertEqual(ofh.getvalue(), gzip.decompress(cData))
+        with self.assertRaises(ValueError):
+            WebUploadUtils.copyDecompressed(io.BytesIO(b""), io.BytesIO(), "rar")
+
+    def testCopyToSessionUncompress(self):
+        """Tests uploaded compressed files are uncompressed while copied"""
+        data = b"data_test\n" * 10000
+        sessionPath = None
+        for fileName, cData, kwD, expected in [
+            ("upload-a.cif.gz", gzip.compress(data), {}, ["upload-a.cif", "upload-a.cif.gz"]),
+            ("upload-b.cif.gz", gzip.compress(data), {"keepCompressed": False}, ["upload-b.cif"]),
+            ("upload-c.cif.xz", lzma.compress(data), {"uncompress": (".gz", ".xz")}, ["upload-c.cif", "upload-c.cif.xz"]),
+            ("upload-d.cif.xz", lzma.compress(data), {}, ["upload-d.cif.xz"]),
+            ("upload-e.cif.gz", gzip.compress(data)[:-20], {}, []),
+        ]:
+            reqObj = InputRequest(dict(self.__paramDict, file=[_Upload(fileName, io.BytesIO(cData))]))
+            if sessionPath is None:
+                reqObj.newSessionObj(forceNew=True)
+                sessionPath = reqObj.getSessionObj().getPath()
+                sessionId = reqObj.getSessionId()
+            else:
+                reqObj.setValue("sessionid", sessionId)
+            retName = WebUploadUtils(reqObj).copyToSession(**kwD)
+            stem = fileName.split(".")[0]
+            self.assertEqual(sorted(fN for fN in os.listdir(sessionPath) if fN.startswith(stem)), expected)
+            self.assertEqual(retName, expected[0] if expected else None)
+            if retName is not None and retName.endswith(".cif"):
+                with open(os.path.join(sessionPath, retName), "rb") as ifh:
+                    self.assertEqual(ifh.read(), data)
+
+    def testUploadDigests(self):
+        """Tests sizes and digests computed while uploads are copied"""
+        data = os.urandom(50000)
+        cData = gzip.compress(data)
+        paramDict = dict(self.__paramDict, UploadDigests=["md5, sha256,bogus"])
+        paramDict["file"] = [_Upload("digest-test.bin", io.BytesIO(data))]
+        reqObj = InputRequest(paramDict)
+        reqObj.newSessionObj(forceNew=True)
+        self.assertEqual(WebUploadUtils.getDigestNames(reqObj), ["md5", "sha256"])
+        wuu = WebUploadUtils(reqObj)
+        self.assertEqual(wuu.copyToSession(), "digest-test.bin")
+        expected = {"fileName": "digest-test.bin", "size": len(data), "md5": hashlib.md5(data).hexdigest()}  # noqa: S324
+        expected["sha256"] = hashlib.sha256(data).hexdigest()
+        self.assertEqual(wuu.getUploadFileInfo(), expected)
+        self.assertEqual(reqObj.getRawValue("uploadFileInfo"), expected)
+
+        for keepCompressed in [True, False]:
+            reqObj.setValue("file", _Upload("digest-test.bin.gz", io.BytesIO(cData)))
+            wuu = WebUploadUtils(reqObj)
+            self.assertEqual(wuu.copyToSession(keepCompressed=keepCompressed, digests=["sha1"]), "digest-test.bin")
+            infoD = wuu.getUploadFileInfo()
+            self.assertEqual(infoD["size"], len(data))
+            self.assertEqual(infoD["sha1"], hashlib.sha1(data).hexdigest())  # noqa: S324
+            self.assertEqual(infoD["compressed"]["size"], len(cData))
+            self.assertEqual(infoD["compressed"]["sha1"], hashlib.sha1(cData).hexdigest())  # noqa: S324
+            self.assertEqual(infoD["compressed"]["fileName"], "digest-test.bin.gz" if keepCompressed else None)
+
+    def testChunkedUpload(self):
+        """Tests resumable chunked uploads with retried, overlapping and concurrent chunks"""
+        data = os.urandom(100000)
+        reqObj = InputRequest(dict(self.__paramDict))
+        reqObj.newSessionObj(forceNew=True)
+        sessionPath = reqObj.getSessionObj().getPath()
+        wuu = WebUploadUtils(reqObj)
+
+        uploadId = wuu.initChunkedUpload("chunked.bin", len(data))
+        self.assertEqual(len(uploadId), 32)
+        sD = wuu.uploadChunk(uploadId, 60000, io.BytesIO(data[60000:]))
+        self.assertEqual(sD["missing"], [[0, 60000]])
+        self.assertFalse(sD["complete"])
+        self.assertIsNone(wuu.finalizeChunkedUpload(uploadId))
+        # retried and overlapping chunks
+        wuu.uploadChunk(uploadId, 60000, io.BytesIO(data[60000:]))
+        wuu.uploadChunk(uploadId, 10000, io.BytesIO(data[10000:30000]))
+        sD = wuu.uploadChunk(uploadId, 20000, io.BytesIO(data[20000:40000]))
+        self.assertEqual(sD["ranges"], [[10000, 40000], [60000, 100000]])
+        self.assertEqual(wuu.getChunkedUploadStatus(uploadId)["missing"], [[0, 10000], [40000, 60000]])
+        self.assertIsNone(wuu.uploadChunk(uploadId, len(data), io.BytesIO(b"x")))
+
+        # remaining chunks arrive concurrently
+        def send(offset, end):
+            WebUploadUtils(reqObj).uploadChunk(uploadId, offset, io.BytesIO(data[offset:end]))
+
+        posL = list(range(0, 10000, 5000)) + list(range(40000, 60000, 5000))
+        thL = [threading.Thread(target=send, args=(pos, pos + 5000)) for pos in posL]
+        for th in thL:
+            th.start()
+        for th in thL:
+            th.join()
+        self.assertTrue(wuu.getChunkedUploadStatus(uploadId)["complete"])
+        self.assertEqual(wuu.finalizeChunkedUpload(uploadId, digests=["sha256"]), "chunked.bin")
+        self.assertEqual(wuu.getUploadFileInfo()["sha256"], hashlib.sha256(data).hexdigest())
+        with open(os.path.join(sessionPath, "chunked.bin"), "rb") as ifh:
+            self.assertEqual(ifh.read(), data)
+        self.assertEqual([fN for fN in os.listdir(sessionPath) if fN.startswith(".chunked-upload-")], [])
+        self.assertIsNone(wuu.getChunkedUploadStatus(uploadId))
+
+        # compressed upload without a declared size - parameters from the request
+        cData = gzip.compress(data)
+        reqObj.setValue("file_name", "chunked.cif.gz")
+        reqObj.setValue("upload_id", wuu.initChunkedUpload())
+        for pos in range(0, len(cData), 30000):
+            reqObj.setValue("chunk_offset", str(pos))
+            reqObj.setValue("file", _Upload("blob", io.BytesIO(cData[pos : pos + 30000])))
+            self.assertIsNotNone(wuu.uploadChunk())
+        self.assertEqual(wuu.finalizeChunkedUpload(keepCompressed=False), "chunked.cif")
+        self.assertEqual(wuu.getUploadFileInfo()["compressed"]["size"], len(cData))
+        with open(os.path.join(sessionPath, "chunked.cif"), "rb") as ifh:
+            self.assertEqual(ifh.read(), data)
+        self.assertFalse(os.path.exists(os.path.join(sessionPath, "chunked.cif.gz")))
+
+        uploadId = wuu.initChunkedUpload("aborted.bin")
+        self.assertTrue(wuu.abortChunkedUpload(uploadId))
+        self.assertIsNone(wuu.getChunkedUploadStatus(uploadId))
+        self.assertIsNone(wuu.uploadChunk("../../etc", 0, io.BytesIO(b"x")))
+
+    def testChunkedUploadBounds(self):
+        """Tests that chunks are clipped to the declared size and written under the upload lock"""
+        data = os.urandom(10000)
+        reqObj = InputRequest(dict(self.__paramDict))
+        reqObj.newSessionObj(forceNew=True)
+        sessionPath = reqObj.getSessionObj().getPath()
+        wuu = WebUploadUtils(reqObj)
+
+        uploadId = wuu.initChunkedUpload("bounded.bin", 6000)
+        partPath = os.path.join(sessionPath, ".chunked-upload-%s.part" % uploadId)
+        with tempfile.TemporaryFile() as tfh:
+            tfh.write(data)
+            tfh.seek(0)
+            self.assertEqual(wuu.uploadChunk(uploadId, 0, tfh)["ranges"], [[0, 6000]])
+        self.assertEqual(os.path.getsize(partPath), 6000)
+        for ifh in [io.BytesIO(data[4000:]), _ReadOnly(data[4000:])]:
+            self.assertEqual(wuu.uploadChunk(uploadId, 4000, ifh)["ranges"], [[0, 6000]])
+            self.assertEqual(os.path.getsize(partPath), 6000)
+        self.assertEqual(wuu.finalizeChunkedUpload(uploadId), "bounded.bin")
+        with open(os.path.join(sessionPath, "bounded.bin"), "rb") as ifh:
+            self.assertEqual(ifh.read(), data[:6000])
+
+        # an abort waits for the chunk being written
+        class _Blocking(_ReadOnly):
+            def __init__(self, data, event):
+                super().__init__(data)
+                self.__event = event
+
+            def read(self, size=-1):
+                self.__event.wait(10)
+                return super().read(size)
+
+        uploadId = wuu.initChunkedUpload("blocked.bin", 1000)
+        started = threading.Event()
+        release = threading.Event()
+        resultL = []
+
+        def send():
+            started.set()
+            resultL.append(WebUploadUtils(reqObj).uploadChunk(uploadId, 0, _Blocking(data[:1000], release)))
+
+        th = threading.Thread(target=send)
+        th.start()
+        started.wait(10)
+        time.sleep(0.2)
+        abortTh = threading.Thread(target=lambda: resultL.append(WebUploadUtils(reqObj).abortChunkedUpload(uploadId)))
+        abortTh.start()
+        time.sleep(0.2)
+        self.assertTrue(abortTh.is_alive())
+        release.set()
+        th.join()
+        abortTh.join()
+        self.assertTrue(resultL[0]["complete"])
+        self.assertTrue(resultL[1])
+        self.assertEqual([fN for fN in os.listdir(sessionPath) if fN.startswith(".chunked-upload-")], [])
+        self.assertIsNone(wuu.uploadChunk(uploadId, 0, io.BytesIO(data[:1000])))
+
+    def testChunkedUploadRetry(self):
+        """Tests that a failed finalization of a chunked upload may be retried"""
+        data = os.urandom(50000)
+        cData = gzip.compress(data)
+        reqObj = InputRequest(dict(self.__paramDict))
+        reqObj.newSessionObj(forceNew=True)
+        sessionPath = reqObj.getSessionObj().getPath()
+        wuu = WebUploadUtils(reqObj)
+        for keepCompressed in [True, False]:
+            uploadId = wuu.initChunkedUpload("retry.cif.gz", len(cData))
+            self.assertTrue(wuu.uploadChunk(uploadId, 0, io.BytesIO(cData))["complete"])
+            with mock.patch.object(WebUploadUtils, "copyDecompressed", side_effect=OSError("disk full")):
+                self.assertIsNone(wuu.finalizeChunkedUpload(uploadId, keepCompressed=keepCompressed))
+            self.assertTrue(wuu.getChunkedUploadStatus(uploadId)["complete"])
+            self.assertFalse(os.path.exists(os.path.join(sessionPath, "retry.cif.gz")))
+            self.assertFalse(os.path.exists(os.path.join(sessionPath, "retry.cif")))
+            self.assertEqual(wuu.finalizeChunkedUpload(uploadId, keepCompressed=keepCompressed), "retry.cif")
+            self.assertEqual(wuu.getUploadFileInfo()["compressed"]["size"], len(cData))
+            with open(os.path.join(sessionPath, "retry.cif"), "rb") as ifh:
+                self.assertEqual(ifh.read(), data)
+            self.assertEqual(os.path.exists(os.path.join(sessionPath, "retry.cif.gz")), keepCompressed)
+            if keepCompressed:
+                with open(os.path.join(sessionPath, "retry.cif.gz"), "rb") as ifh:
+                    self.assertEqual(ifh.read(), cData)
+                os.remove(os.path.join(sessionPath, "retry.cif.gz"))
+            self.assertIsNone(wuu.getChunkedUploadStatus(uploadId))
+
+    def testRenameSessionFile(self):
+        """Tests renaming session files by link, clone or copy and move"""
+        data = os.urandom(20000)
+        reqObj = InputRequest(dict(self.__paramDict))
+        reqObj.newSessionObj(forceNew=True)
+        sessionPath = reqObj.getSessionObj().getPath()
+        with open(os.path.join(sessionPath, "rename-src.bin"), "wb") as ofh:
+            ofh.write(data)
+        with open(os.path.join(sessionPath, "rename-copy.bin"), "wb") as ofh:
+            ofh.write(b"old content")
+        wuu = WebUploadUtils(reqObj)
+
+        self.assertEqual(wuu.renameSessionFile("rename-src.bin", "rename-src.bin"), "none")
+        self.assertIn(wuu.renameSessionFile("rename-src.bin", "rename-copy.bin"), ["reflink", "copy"])
+        self.assertEqual(wuu.renameSessionFile("rename-src.bin", "rename-link.bin", link=True), "link")
+        srcStat = os.stat(os.path.join(sessionPath, "rename-src.bin"))
+        self.assertEqual(os.stat(os.path.join(sessionPath, "rename-link.bin")).st_ino, srcStat.st_ino)
+        self.assertNotEqual(os.stat(os.path.join(sessionPath, "rename-copy.bin")).st_ino, srcStat.st_ino)
+        self.assertEqual(wuu.renameSessionFile("rename-src.bin", "rename-move.bin", move=True), "replace")
+        self.assertFalse(os.path.exists(os.path.join(sessionPath, "rename-src.bin")))
+        for fN in ["rename-copy.bin", "rename-link.bin", "rename-move.bin"]:
+            with open(os.path.join(sessionPath, fN), "rb") as ifh:
+                self.assertEqual(ifh.read(), data)
+        self.assertFalse(wuu.renameSessionFile("rename-src.bin", "rename-other.bin"))
+        self.assertEqual([fN for fN in os.listdir(sessionPath) if fN.endswith(".tmp")], [])
+
+    @unittest.skipUnless(os.environ.get("WWPDB_BENCHMARK"), "benchmark - set WWPDB_BENCHMARK to run")
+    def testDecompressTiming(self):
+        """Benchmark in-process decompression against a gzip -cd subprocess per file"""
+        nFiles = 20
+        gzPath = os.path.join(self.__sessiontop, "benchmark-upload.cif.gz")
+        outPath = os.path.join(self.__sessiontop, "benchmark-upload.cif")
+        with gzip.open(gzPath, "wb") as ofh:
+            ofh.write(b"ATOM   1 N   ALA A 1  1.0 2.0 3.0\n" * 20000)
+        modeL = ["in-process"]
+        if shutil.which("gzip"):
+            modeL.append("subprocess")
+        for mode in modeL:
+            t0 = time.time()
+            for _ in range(nFiles):
+                if mode == "subprocess":
+                    with open(outPath, "wb") as ofh:
+                        subprocess.run(["gzip", "-cd", gzPath], stdout=ofh, check=True)  # noqa: S603,S607
+                else:
+                    with open(gzPath, "rb") as ifh, open(outPath, "wb") as ofh:
+                        WebUploadUtils.copyDecompressed(ifh, ofh)
+            t1 = time.time()
+            sys.stderr.write("Decompress %-10s %3d files  %8.2f ms/file\n" % (mode, nFiles, 1000.0 * (t1 - t0) / nFiles))
+        os.remove(gzPath)
+        os.remove(outPath)
+
+    @unittest.skipUnless(os.environ.get("WWPDB_BENCHMARK"), "benchmark - set WWPDB_BENCHMARK to run")
+    def testCopyTiming(self):
+        """Benchmark throughput and peak allocation of the upload copy
+
+        File size in MB is taken from the environment variable WWPDB_BENCHMARK_FILE_MB (default 100).
+        """
+        nMb = int(os.environ.get("WWPDB_BENCHMARK_FILE_MB", "100"))
+        outPath = os.path.join(self.__sessiontop, "benchmark-upload.out")
+        block = os.urandom(1024 * 1024)
+        with tempfile.TemporaryFile(dir=self.__sessiontop) as tfh:
+            tfh.writelines(block for _ in range(nMb))
+            for mode in ("read", "copyFileObject"):
+                tfh.seek(0)
+                with open(outPath, "wb") as ofh:
+                    tracemalloc.start()
+                    t0 = time.time()
+                    if mode == "read":
+                        ofh.write(tfh.read())
+                    else:
+                        WebUploadUtils.copyFileObject(tfh, ofh)
+                    t1 = time.time()
+                    _current, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                self.assertEqual(os.path.getsize(outPath), nMb * 1024 * 1024)
+                if mode == "copyFileObject":
+                    self.assertLessEqual(peak, WebUploadUtils.COPY_BUFFER_SIZE + 64 * 1024)
+                sys.stderr.write(
+                    "Upload copy %-14s size %6d MB  %8.1f MB/s  peak allocation %8.2f MB\n"
+                    % (mode, nMb, nMb / max(t1 - t0, 1.0e-6), peak / (1024.0 * 1024.0))
+                )
+        os.remove(outPath)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    unittest.main()
@@ -196,14 +196,8 @@ class FileUtils(FileUtilsBase):
             for ky in rDList:
                 if ky not in self._rD:
                     continue
-                ctList = self._rD[ky]
                 title = titlePrefix + ky + titleSuffix
-                fList = []
-                fList.extend(ctList)
-                for ct in ctList:
-                    for ms in self.__msL:
-                        mt = ct + "-" + ms
-                        fList.append(mt)
+                fList = self.__getContentTypeList(ky)
                 nF, oL = self.__renderContentTypeFileList(
                     self.__entryId,
                     fileSource=fileSource,
@@ -241,6 +235,42 @@ class FileUtils(FileUtilsBase):
                     nTot += nF
         return nTot, htmlList
 
+    def __getContentTypeList(self, category):
+        """Return the content types in category and their milestone variants."""
+        ctList = self._rD[category]
+        fList = []
+        fList.extend(ctList)
+        for ct in ctList:
+            for ms in self.__msL:
+                mt = ct + "-" + ms
+                fList.append(mt)
+        return fList
+
+    def getCategoryFilePathList(self, fileSource="archive", rDList=None):
+        """Return the paths of the files listed by renderFileList() for the categories in rDList
+        (e.g. "Primary Data Files") -- all versions, resolved in a single pass.
+        """
+        if rDList is None:
+            rDList = self._rDList
+        de = DataExchange(
+            reqObj=self.__reqObj,
+            depDataSetId=self.__entryId,
+            wfInstanceId=None,
+            fileSource=fileSource,
+            siteId=self.__siteId,
+            verbose=self.__verbose,
+            log=self.__lfh,
+        )
+        pathList = []
+        for ky in rDList:
+            if ky not in self._rD:
+                continue
+            tupL = de.getContentTypeFileList(fileSource=fileSource, contentTypeList=self.__getContentTypeList(ky))
+            for tup in tupL:
+                if tup[0] not in pathList:
+                    pathList.append(tup[0])
+        return pathList
+
     def __renderContentTypeFileList(
         self, entryId, fileSource="archive", wfInstanceId=None, contentTypeList=None, title=None, displayImageFlag=False
     ):
@@ -275,9 +305,10 @@ class FileUtils(FileUtilsBase):
                 if os.access(imgFile, os.F_OK):
                     os.remove(imgFile)
                 os.symlink(tup[0], imgFile)
+                self.__sObj.recordFileUsage(imgFile)
                 imgHtml = (
-                    '<img src="/sessions/'
-                    + self.__sessionId
+                    '<img src="'
+                    + self.__sObj.getRelativePath()
                     + "/"
                     + fN
                     + '" border="0" alt="Image" width="400" height="400">'
@@ -0,0 +1,110 @@
+##
+# File:    SessionAdmin.py
+# Date:    17-Oct-2026
+#
+# Updates:
+##
+"""
+Command line maintenance tasks for the session directory tree.
+
+   wwpdb_session_admin --top_path <path> migrate --shard_depth 2
+   wwpdb_session_admin --top_path <path> reap --max_idle_hours 48 --batch_size 50 --pause 1
+   wwpdb_session_admin --top_path <path> usage --top 20
+
+"""
+
+__docformat__ = "restructuredtext en"
+__author__ = "Ezra Peisach"
+__email__ = "ezra.peisach@rcsb.org"
+__license__ = "Apache 2.0"
+
+import argparse
+import os
+import sys
+import time
+
+from wwpdb.utils.session.SessionManager import SessionManager
+
+
+def _migrateOp(args):
+    sm = SessionManager(
+        topPath=args.top_path, verbose=args.verbose, shardDepth=args.shard_depth, shardWidth=args.shard_width
+    )
+    nMoved, nSkipped = sm.migrateSessions(linkLegacy=not args.no_link, dryRun=args.dry_run)
+    sys.stdout.write("Sessions migrated %d skipped %d\n" % (nMoved, nSkipped))
+    return 0
+
+
+def _reapOp(args):
+    sm = SessionManager(topPath=args.top_path, verbose=args.verbose, shardWidth=args.shard_width, trackAccess=False)
+    maxAge = args.max_age_days * 86400.0 if args.max_age_days is not None else None
+    maxIdle = args.max_idle_hours * 3600.0 if args.max_idle_hours is not None else None
+    while True:
+        rD = sm.reapSessions(
+            maxAge=maxAge,
+            maxIdle=maxIdle,
+            batchSize=args.batch_size,
+            batchPause=args.pause,
+            maxSessions=args.limit,
+            numWorkers=args.workers,
+            dryRun=args.dry_run,
+        )
+        sys.stdout.write(
+            "Sessions scanned %d expired %d removed %d failed %d links %d bytes freed %d\n"
+            % (rD["scanned"], rD["expired"], rD["removed"], rD["failed"], rD["links"], rD["bytes"])
+        )
+        sys.stdout.flush()
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
+    return 0
+
+
+def _usageOp(args):
+    sm = SessionManager(topPath=args.top_path, verbose=args.verbose, trackAccess=False)
+    if not os.access(sm.getUsageLedger().getFilePath(), os.F_OK):
+        sys.stdout.write("No usage ledger in %s\n" % args.top_path)
+        return 1
+    for sessionId, nBytes, nFiles in sm.getUsageReport(topN=args.top):
+        sys.stdout.write("%-40s %16d bytes %8d files\n" % (sessionId, nBytes, nFiles))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Session directory maintenance")
+    parser.add_argument("--top_path", required=True, help="Directory containing the sessions directory")
+    parser.add_argument("--verbose", default=False, action="store_true", help="Verbose output")
+    subparsers = parser.add_subparsers(dest="op")
+
+    mp = subparsers.add_parser("migrate", help="Move sessions from the flat layout into the sharded layout")
+    mp.add_argument("--shard_depth", type=int, default=2, help="Number of shard directory levels")
+    mp.add_argument("--shard_width", type=int, default=2, help="Number of characters naming each shard directory")
+    mp.add_argument("--no_link", default=False, action="store_true", help="Do not leave links at the legacy paths")
+    mp.add_argument("--dry_run", default=False, action="store_true", help="Report sessions without moving them")
+    mp.set_defaults(func=_migrateOp)
+
+    rp = subparsers.add_parser("reap", help="Remove expired sessions")
+    rp.add_argument("--max_age_days", type=float, default=None, help="Expire sessions unmodified for this many days")
+    rp.add_argument("--max_idle_hours", type=float, default=None, help="Expire sessions not accessed for this many hours")
+    rp.add_argument("--batch_size", type=int, default=100, help="Sessions removed between pauses")
+    rp.add_argument("--pause", type=float, default=0.0, help="Seconds to pause after each batch")
+    rp.add_argument("--limit", type=int, default=None, help="Maximum number of sessions expired per pass")
+    rp.add_argument("--workers", type=int, default=1, help="Number of removal threads")
+    rp.add_argument("--shard_width", type=int, default=2, help="Number of characters naming each shard directory")
+    rp.add_argument("--interval", type=float, default=0.0, help="Repeat every interval seconds (0 runs once)")
+    rp.add_argument("--dry_run", default=False, action="store_true", help="Report expired sessions without removal")
+    rp.set_defaults(func=_reapOp)
+
+    up = subparsers.add_parser("usage", help="Report the sessions with the largest recorded disk usage")
+    up.add_argument("--top", type=int, default=20, help="Number of sessions to report")
+    up.set_defaults(func=_usageOp)
+
+    args = parser.parse_args(argv)
+    if args.op is None:
+        parser.print_help()
+        return 1
+    return args.func(args)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -17,11 +17,14 @@ are provided to create temporary directories to preserve session files.
 """
 
 import contextlib
-import hashlib
 import os.path
+import secrets
 import shutil
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+from wwpdb.utils.session.SessionUsageLedger import SessionUsageLedger
 
 __docformat__ = "restructuredtext en"
 __author__ = "John Westbrook"
@@ -30,25 +33,83 @@ __license__ = "Creative Commons Attribution 3.0 Unported"
 __version__ = "V0.07"
 
 
+def makeRandomId():
+    """Return a random 128-bit session identifier as 32 hexadecimal characters."""
+    return secrets.token_hex(16)
+
+
+def makeTimeOrderedId():
+    """Return a 128-bit session identifier as 32 hexadecimal characters which sorts by creation time.
+
+    The leading 48 bits hold the creation time in milliseconds (as in ULID/UUIDv7) and the
+    remaining 80 bits are random.
+    """
+    return "%012x%s" % (int(time.time() * 1000) & 0xFFFFFFFFFFFF, secrets.token_hex(10))
+
+
+_ID_GENERATORS = {"random": makeRandomId, "time": makeTimeOrderedId}
+
+
 class SessionManager:
     """
     Utilities for session directory maintenance.
 
     """
 
-    def __init__(self, topPath=".", verbose=False):
+    # marker file updated on access to support idle session expiry --
+    ACCESS_MARKER = ".session-access"
+    # minimum interval in seconds between marker updates
+    ACCESS_RESOLUTION = 60
+    # disk usage ledger database in the top path
+    USAGE_LEDGER = "session-usage.sqlite"
+
+    def __init__(
+        self,
+        topPath=".",
+        verbose=False,
+        shardDepth=0,
+        shardWidth=2,
+        idType="random",
+        trackAccess=False,
+        trackUsage=False,
+        quotaSoft=None,
+        quotaHard=None,
+        usageJournalMode=None,
+    ):
         """
         Organization of session directory is --
-        <topPath>/<sha-hash>/<session_files>
+        <topPath>/sessions/<sha-hash>/<session_files>
+
+        or with the optional sharded layout (shardDepth > 0) --
+        <topPath>/sessions/<shard_1>/../<shard_n>/<sha-hash>/<session_files>
 
         Parameters:
         :topPath: is the path to the directory containing the hash-id sub-directory.
+        :shardDepth: number of intermediate shard directory levels (0 selects the flat layout)
+        :shardWidth: number of identifier characters used to name each shard directory
+        :idType: session identifier generator -- "random", "time" (time-ordered) or a callable returning a new identifier
+        :trackAccess: update the access marker file in the session directory on every getPath() --
+            otherwise the marker is updated only by touchAccess()
+        :trackUsage: record the size of files written to the session in the usage ledger
+        :quotaSoft: session usage in bytes above which a warning is issued (implies trackUsage)
+        :quotaHard: session usage in bytes which may not be exceeded (implies trackUsage)
+        :usageJournalMode: SQLite journal mode of the usage ledger (default rollback journal, see SessionUsageLedger)
 
+        Sessions created in the flat layout remain accessible when sharding is enabled.
 
         """
         self.__verbose = verbose
         self.__topSessionPath = topPath
         self.__uid = None
+        self.__shardDepth = shardDepth or 0
+        self.__shardWidth = shardWidth
+        self.__trackAccess = trackAccess
+        self.__idGenerator = idType if callable(idType) else _ID_GENERATORS.get(idType, makeRandomId)
+        self.__quotaSoft = quotaSoft
+        self.__quotaHard = quotaHard
+        self.__trackUsage = trackUsage or quotaSoft is not None or quotaHard is not None
+        self.__usageJournalMode = usageJournalMode
+        self.__ledger = None
 
     def __str__(self):
         return "\n+SessionManager() Session top path: %s\nUnique identifier: %s\nSession path: %s\n" % (
@@ -67,22 +128,91 @@ class SessionManager:
         return self.__uid
 
     def assignId(self):
-        # Need to convert to str (python2)/bytes (python3)
-        tmp = repr(time.time()).encode("utf-8")
-        self.__uid = hashlib.sha1(tmp).hexdigest()  # noqa: S324
+        self.__uid = self.__idGenerator()
         return self.__uid
 
     def getSessionsPath(self):
         return os.path.join(self.getTopPath(), "sessions")
 
+    def getShardList(self, uid=None):
+        """Return the list of shard directory names for the input (or current) session identifier.
+
+        Shard names are taken from the trailing characters of the identifier so that
+        time-ordered identifiers are spread evenly.  An empty list is returned for the flat layout.
+        """
+        if uid is None:
+            uid = self.__uid
+        if self.__shardDepth < 1 or uid is None or len(uid) <= self.__shardDepth * self.__shardWidth:
+            return []
+        sL = []
+        for ii in range(self.__shardDepth):
+            iEnd = len(uid) - ii * self.__shardWidth
+            sL.append(uid[iEnd - self.__shardWidth : iEnd])
+        return sL
+
+    def __getLayoutPath(self):
+        return os.path.join(self.getSessionsPath(), *(self.getShardList() + [self.__uid]))
+
+    def __getLegacyPath(self):
+        return os.path.join(self.getSessionsPath(), self.__uid)
+
+    def __getCandidatePathList(self):
+        """Session directory candidates -- the configured layout followed by the legacy flat path."""
+        pL = [self.__getLayoutPath()]
+        if self.getShardList():
+            pL.append(self.__getLegacyPath())
+        return pL
+
     def getPath(self):
         try:
-            pth = os.path.join(self.getSessionsPath(), self.__uid)
-            if self.__verbose:
-                sys.stderr.write("+SessionManager.getPath() path %s\n" % pth)
-            if os.access(pth, os.F_OK):
-                return pth
+            for pth in self.__getCandidatePathList():
+                if self.__verbose:
+                    sys.stderr.write("+SessionManager.getPath() path %s\n" % pth)
+                if os.access(pth, os.F_OK):
+                    # without a session id the path is the sessions directory itself
+                    if self.__trackAccess and self.__uid:
+                        self.__touchAccessMarker(pth)
+                    return pth
+            return None
+        except:  # noqa: E722 pylint: disable=bare-except
             return None
+
+    def touchAccess(self):
+        """Record an access to the current session in its access marker file (used by reapSessions(maxIdle=...)).
+
+        The marker is rewritten at most once every ACCESS_RESOLUTION seconds.
+        """
+        if not self.__uid:
+            return False
+        for pth in self.__getCandidatePathList():
+            if os.access(pth, os.F_OK):
+                self.__touchAccessMarker(pth)
+                return True
+        return False
+
+    def __touchAccessMarker(self, pth):
+        fp = os.path.join(pth, self.ACCESS_MARKER)
+        try:
+            if time.time() - os.stat(fp).st_mtime >= self.ACCESS_RESOLUTION:
+                os.utime(fp, None)
+        except FileNotFoundError:
+            with contextlib.suppress(OSError):
+                open(fp, "a").close()
+        except OSError:
+            pass
+
+    def getParentPath(self):
+        """Return the directory containing the current session directory.
+
+        The sessions path is returned if no session identifier has been assigned.
+        """
+        try:
+            if not self.__uid:
+                return self.getSessionsPath()
+            pth = self.getPath()
+            if pth is not None:
+                return os.path.dirname(pth)
+            return os.path.join(self.getSessionsPath(), *self.getShardList())
         except:  # noqa: E722 pylint: disable=bare-except
             return None
 
@@ -92,27 +222,335 @@ class SessionManager:
     def getRelativePath(self):
         pth = None
         with contextlib.suppress(Exception):
-            pth = os.path.join("/sessions", self.__uid)
+            pL = ["/sessions"] + self.getShardList() + [self.__uid]
+            # session not yet migrated from the flat layout --
+            layoutExists = os.access(self.__getLayoutPath(), os.F_OK)
+            if len(pL) > 2 and not layoutExists and os.access(self.__getLegacyPath(), os.F_OK):
+                pL = ["/sessions", self.__uid]
+            pth = os.path.join(*pL)
         return pth
 
-    def makeSessionPath(self):
+    def makeSessionPath(self, exclusive=False, maxTries=5):
         """If the path to the current session directory does not exist
         create it and return the session path.
+
+        If exclusive is set the session directory must not already exist.  The directory is
+        created atomically and on a collision a new identifier is assigned and creation is
+        retried up to maxTries times.  None is returned on failure.
         """
         try:
-            pth = os.path.join(self.getSessionsPath(), self.__uid)
-            if not os.access(pth, os.F_OK):
-                os.makedirs(pth)
-            return pth
+            if not exclusive:
+                pth = self.getPath()
+                if pth is None:
+                    pth = self.__getLayoutPath()
+                    for _ in range(maxTries):
+                        try:
+                            os.makedirs(pth, exist_ok=True)
+                            break
+                        except FileNotFoundError:
+                            # an empty shard directory was removed by the reaper -- try again
+                            continue
+                return pth
+            for _ in range(maxTries):
+                pth = self.__getLayoutPath()
+                if self.getPath() is None:
+                    os.makedirs(os.path.dirname(pth), exist_ok=True)
+                    try:
+                        # mkdir() fails if the directory exists -- equivalent to O_CREAT|O_EXCL
+                        os.mkdir(pth)
+                        return pth
+                    except FileExistsError:
+                        pass
+                    except FileNotFoundError:
+                        # an empty shard directory was removed by the reaper -- retry with the same identifier
+                        continue
+                if self.__verbose:
+                    sys.stderr.write("+SessionManager.makeSessionPath() session id collision %s\n" % self.__uid)
+                self.assignId()
+            return None
         except:  # noqa: E722 pylint: disable=bare-except
             return None
 
     def remakeSessionPath(self):
         try:
-            pth = os.path.join(self.getSessionsPath(), self.__uid)
-            if os.access(pth, os.F_OK):
-                shutil.rmtree(pth, True)
+            for pth in self.__getCandidatePathList():
+                if os.path.islink(pth):
+                    os.remove(pth)
+                elif os.access(pth, os.F_OK):
+                    shutil.rmtree(pth, True)
+            pth = self.__getLayoutPath()
             os.makedirs(pth)
+            if self.__trackUsage:
+                self.getUsageLedger().removeSession(self.__uid)
             return pth
         except:  # noqa: E722 pylint: disable=bare-except
             return None
+
+    def migrateSessions(self, linkLegacy=True, dryRun=False):
+        """Move session directories stored in the flat layout into the sharded layout.
+
+        If linkLegacy is set a symbolic link is left at each legacy path so that existing
+        session URLs continue to resolve while the tree is migrated.
+
+        Returns: (number of sessions migrated, number of sessions skipped)
+        """
+        nMoved = 0
+        nSkipped = 0
+        if self.__shardDepth < 1:
+            return nMoved, nSkipped
+        sessionsPath = self.getSessionsPath()
+        try:
+            with os.scandir(sessionsPath) as itr:
+                entryL = [e for e in itr if e.is_dir(follow_symlinks=False) and len(e.name) > self.__shardWidth]
+        except FileNotFoundError:
+            return nMoved, nSkipped
+        for entry in entryL:
+            shardL = self.getShardList(entry.name)
+            dstPath = os.path.join(sessionsPath, *(shardL + [entry.name]))
+            if not shardL or os.path.lexists(dstPath):
+                nSkipped += 1
+                continue
+            if self.__verbose:
+                sys.stderr.write("+SessionManager.migrateSessions() %s -> %s\n" % (entry.path, dstPath))
+            if not dryRun:
+                try:
+                    os.makedirs(os.path.dirname(dstPath), exist_ok=True)
+                    os.rename(entry.path, dstPath)
+                    if linkLegacy:
+                        os.symlink(os.path.relpath(dstPath, sessionsPath), entry.path)
+                except OSError as e:
+                    sys.stderr.write("+SessionManager.migrateSessions() failed for %s %r\n" % (entry.path, str(e)))
+                    nSkipped += 1
+                    continue
+            nMoved += 1
+        return nMoved, nSkipped
+
+    def iterSessions(self):
+        """Incrementally yield a directory entry (os.DirEntry) for each session directory.
+
+        Both flat and sharded sessions are returned -- any directory with a name of the shard width
+        is taken to be a shard directory.  Nothing is yielded if the sessions directory does not exist.
+        """
+        return self.__iterSessionEntries(self.getSessionsPath())
+
+    def __iterSessionEntries(self, dirPath):
+        try:
+            itr = os.scandir(dirPath)
+        except FileNotFoundError:
+            return
+        with itr:
+            for entry in itr:
+                if not entry.is_dir(follow_symlinks=False):
+                    continue
+                if len(entry.name) == self.__shardWidth:
+                    yield from self.__iterSessionEntries(entry.path)
+                else:
+                    yield entry
+
+    def __isExpired(self, entry, tNow, maxAge, maxIdle):
+        st = entry.stat(follow_symlinks=False)
+        if maxAge is not None and tNow - st.st_mtime > maxAge:
+            return True
+        if maxIdle is not None:
+            try:
+                tAccess = os.stat(os.path.join(entry.path, self.ACCESS_MARKER)).st_mtime
+            except OSError:
+                tAccess = st.st_mtime
+            if tNow - tAccess > maxIdle:
+                return True
+        return False
+
+    @staticmethod
+    def getTreeSize(dirPath):
+        """Return the total size in bytes of the files within the input directory tree."""
+        nBytes = 0
+        with contextlib.suppress(OSError), os.scandir(dirPath) as itr:
+            for entry in itr:
+                if entry.is_dir(follow_symlinks=False):
+                    nBytes += SessionManager.getTreeSize(entry.path)
+                else:
+                    with contextlib.suppress(OSError):
+                        nBytes += entry.stat(follow_symlinks=False).st_size
+        return nBytes
+
+    def __removeSession(self, pth):
+        nBytes = self.getTreeSize(pth)
+        shutil.rmtree(pth, True)
+        if os.path.lexists(pth):
+            return False, 0
+        self.__removeEmptyShards(os.path.dirname(pth))
+        if os.access(os.path.join(self.getTopPath(), self.USAGE_LEDGER), os.F_OK):
+            self.getUsageLedger().removeSession(os.path.basename(pth))
+        return True, nBytes
+
+    def __removeEmptyShards(self, dirPath):
+        """Remove the shard directories above a deleted session which no longer contain any sessions."""
+        sessionsPath = os.path.normpath(self.getSessionsPath())
+        dirPath = os.path.normpath(dirPath)
+        while dirPath.startswith(sessionsPath + os.sep):
+            try:
+                # rmdir() fails if the directory is not empty
+                os.rmdir(dirPath)
+            except OSError:
+                break
+            dirPath = os.path.dirname(dirPath)
+
+    def __removeDanglingLinks(self):
+        nLinks = 0
+        try:
+            itr = os.scandir(self.getSessionsPath())
+        except FileNotFoundError:
+            return nLinks
+        with itr:
+            for entry in itr:
+                if entry.is_symlink() and not os.path.exists(entry.path):
+                    with contextlib.suppress(OSError):
+                        os.remove(entry.path)
+                        nLinks += 1
+        return nLinks
+
+    def reapSessions(
+        self, maxAge=None, maxIdle=None, batchSize=100, batchPause=0.0, maxSessions=None, numWorkers=1, dryRun=False
+    ):
+        """Remove expired session directories.
+
+        Parameters:
+        :maxAge: expire sessions with no change to the session directory for maxAge seconds
+        :maxIdle: expire sessions not accessed through getPath() for maxIdle seconds
+        :batchSize: number of sessions removed between pauses
+        :batchPause: seconds to sleep after each batch to bound the I/O rate
+        :maxSessions: stop after this number of expired sessions (None for no limit)
+        :numWorkers: number of threads removing the sessions in each batch
+        :dryRun: report expired sessions without removing them
+
+        Returns: dictionary with counts of sessions 'scanned', 'expired', 'removed', 'failed',
+                 legacy 'links' removed and the number of 'bytes' freed.
+        """
+        rD = {"scanned": 0, "expired": 0, "removed": 0, "failed": 0, "links": 0, "bytes": 0}
+        if maxAge is None and maxIdle is None:
+            return rD
+        tNow = time.time()
+        executor = ThreadPoolExecutor(max_workers=numWorkers) if numWorkers > 1 else None
+        try:
+            batchL = []
+            for entry in self.iterSessions():
+                rD["scanned"] += 1
+                try:
+                    if not self.__isExpired(entry, tNow, maxAge, maxIdle):
+                        continue
+                except OSError:
+                    continue
+                rD["expired"] += 1
+                if self.__verbose:
+                    sys.stderr.write("+SessionManager.reapSessions() expired session %s\n" % entry.path)
+                if dryRun:
+                    rD["bytes"] += self.getTreeSize(entry.path)
+                else:
+                    batchL.append(entry.path)
+                if len(batchL) >= batchSize:
+                    self.__reapBatch(batchL, executor, rD)
+                    batchL = []
+                    if batchPause > 0:
+                        time.sleep(batchPause)
+                if maxSessions is not None and rD["expired"] >= maxSessions:
+                    break
+            if batchL:
+                self.__reapBatch(batchL, executor, rD)
+            if not dryRun:
+                rD["links"] = self.__removeDanglingLinks()
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return rD
+
+    def __reapBatch(self, pathList, executor, rD):
+        if executor is not None:
+            resultL = list(executor.map(self.__removeSession, pathList))
+        else:
+            resultL = [self.__removeSession(pth) for pth in pathList]
+        for ok, nBytes in resultL:
+            if ok:
+                rD["removed"] += 1
+                rD["bytes"] += nBytes
+            else:
+                rD["failed"] += 1
+
+    def getUsageLedger(self):
+        if self.__ledger is None:
+            self.__ledger = SessionUsageLedger(
+                os.path.join(self.getTopPath(), self.USAGE_LEDGER), verbose=self.__verbose, journalMode=self.__usageJournalMode
+            )
+        return self.__ledger
+
+    def __getFileName(self, filePath):
+        """Return the path of the input file relative to the session directory."""
+        return os.path.relpath(os.path.abspath(filePath), os.path.abspath(self.getPath()))
+
+    def recordFileUsage(self, filePath):
+        """Record the current size of the input session file in the usage ledger."""
+        if not self.__trackUsage:
+            return False
+        try:
+            nBytes = os.lstat(filePath).st_size
+            return self.getUsageLedger().setFileSize(self.__uid, self.__getFileName(filePath), nBytes)
+        except Exception as e:  # noqa: BLE001
+            sys.stderr.write("+SessionManager.recordFileUsage() failed for %s %r\n" % (filePath, str(e)))
+        return False
+
+    def removeFileUsage(self, filePath):
+        """Remove the input session file from the usage ledger."""
+        if not self.__trackUsage:
+            return False
+        try:
+            return self.getUsageLedger().removeFile(self.__uid, self.__getFileName(filePath))
+        except Exception as e:  # noqa: BLE001
+            sys.stderr.write("+SessionManager.removeFileUsage() failed for %s %r\n" % (filePath, str(e)))
+        return False
+
+    def rebuildUsage(self):
+        """Reset the usage ledger for the current session from the contents of the session directory."""
+        pth = self.getPath()
+        ledger = self.getUsageLedger()
+        ledger.removeSession(self.__uid)
+        if pth is None:
+            return 0
+        for dirPath, _dirNameList, fileNameList in os.walk(pth):
+            for fileName in fileNameList:
+                if fileName == self.ACCESS_MARKER:
+                    continue
+                fp = os.path.join(dirPath, fileName)
+                with contextlib.suppress(OSError):
+                    ledger.setFileSize(self.__uid, os.path.relpath(fp, pth), os.lstat(fp).st_size)
+        return self.getUsage()
+
+    def getUsage(self):
+        """Return the number of bytes recorded in the usage ledger for the current session."""
+        return self.getUsageLedger().getUsage(self.__uid)[0]
+
+    def getUsageReport(self, topN=10):
+        """Return a list of (session id, bytes, number of files) for the topN sessions by recorded usage."""
+        return self.getUsageLedger().getTopSessions(topN)
+
+    def checkQuota(self, nBytes=0, filePath=None):
+        """Return True if nBytes may be added to the current session without exceeding the hard quota.
+
+        filePath is the session file the new content replaces -- its recorded size is not counted.
+        A warning is issued if the soft quota would be exceeded.
+        """
+        if self.__quotaSoft is None and self.__quotaHard is None:
+            return True
+        usage = self.getUsage() + nBytes
+        if filePath is not None:
+            usage -= self.getUsageLedger().getFileSize(self.__uid, self.__getFileName(filePath))
+        if self.__quotaHard is not None and usage > self.__quotaHard:
+            sys.stderr.write(
+                "+SessionManager.checkQuota() session %s hard quota %d exceeded by request for %d bytes (usage %d)\n"
+                % (self.__uid, self.__quotaHard, nBytes, usage)
+            )
+            return False
+        if self.__quotaSoft is not None and usage > self.__quotaSoft:
+            sys.stderr.write(
+                "+SessionManager.checkQuota() session %s soft quota %d exceeded (usage %d)\n"
+                % (self.__uid, self.__quotaSoft, usage)
+            )
+        return True
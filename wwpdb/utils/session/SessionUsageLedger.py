@@ -0,0 +1,221 @@
+##
+# File:    SessionUsageLedger.py
+# Date:    17-Oct-2026
+#
+# Updates:
+##
+"""
+Incremental ledger of the disk space used by files written to session directories.
+
+The ledger is a SQLite database shared by all processes using the same session top path.
+File sizes are recorded as files are written so that per-session usage and the heaviest
+sessions can be reported without walking the session tree.
+
+"""
+
+__docformat__ = "restructuredtext en"
+__author__ = "Ezra Peisach"
+__email__ = "ezra.peisach@rcsb.org"
+__license__ = "Apache 2.0"
+
+import contextlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_usage (
+    session_id TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    PRIMARY KEY (session_id, file_name)
+);
+CREATE TABLE IF NOT EXISTS session_usage (
+    session_id TEXT PRIMARY KEY,
+    bytes INTEGER NOT NULL,
+    files INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS session_usage_bytes ON session_usage (bytes);
+"""
+
+# ledger database path -> file identity (st_dev, st_ino) of the database whose schema was created in this process
+_schemaFileD = {}
+_schemaLock = threading.Lock()
+
+
+def _getFileId(filePath):
+    """Return the tuple (st_dev, st_ino, st_size) for filePath or None."""
+    try:
+        st = os.stat(filePath)
+        return st.st_dev, st.st_ino, st.st_size
+    except OSError:
+        return None
+
+
+class SessionUsageLedger:
+    """Per-session disk usage ledger stored in a SQLite database.
+
+    Each thread keeps one connection to the database.  The connection is reopened and the
+    schema created again if the database file is removed or replaced.
+    """
+
+    # rollback journal -- WAL requires shared memory and is unsafe on network file systems
+    JOURNAL_MODE = "DELETE"
+
+    def __init__(self, dbPath, verbose=False, log=sys.stderr, journalMode=None):
+        """
+        :journalMode: SQLite journal mode of the database (default JOURNAL_MODE) -- "WAL" may be used
+            when the top session path is on a local file system.
+        """
+        self.__dbPath = dbPath
+        self.__verbose = verbose
+        self.__lfh = log
+        self.__journalMode = journalMode or self.JOURNAL_MODE
+        self.__local = threading.local()
+
+    def getFilePath(self):
+        return self.__dbPath
+
+    def __connect(self):
+        """Return the connection of the current thread."""
+        con = getattr(self.__local, "con", None)
+        fileId = _getFileId(self.__dbPath)
+        if con is not None:
+            # the open connection keeps the inode of a removed file from being reused
+            if fileId is not None and fileId[:2] == self.__local.fileId:
+                return con
+            con.close()
+            self.__local.con = None
+        con = sqlite3.connect(self.__dbPath, timeout=30.0, isolation_level=None)
+        fileId = _getFileId(self.__dbPath)
+        with _schemaLock:
+            # a new database is empty -- its inode may have been reused
+            if fileId is None or fileId[2] == 0 or _schemaFileD.get(self.__dbPath) != fileId[:2]:
+                con.execute("PRAGMA journal_mode=%s" % self.__journalMode)
+                con.executescript(_SCHEMA)
+                fileId = _getFileId(self.__dbPath)
+                _schemaFileD[self.__dbPath] = fileId[:2] if fileId else None
+        self.__local.con = con
+        self.__local.fileId = fileId[:2] if fileId else None
+        return con
+
+    @contextlib.contextmanager
+    def __transaction(self):
+        con = self.__connect()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            yield con
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        """Close the connection of the current thread."""
+        con = getattr(self.__local, "con", None)
+        if con is not None:
+            con.close()
+            self.__local.con = None
+
+    def __adjustSession(self, con, sessionId, deltaBytes, deltaFiles):
+        row = con.execute("SELECT bytes, files FROM session_usage WHERE session_id = ?", (sessionId,)).fetchone()
+        if row is None:
+            con.execute(
+                "INSERT INTO session_usage (session_id, bytes, files, updated) VALUES (?, ?, ?, ?)",
+                (sessionId, max(deltaBytes, 0), max(deltaFiles, 0), time.time()),
+            )
+        else:
+            con.execute(
+                "UPDATE session_usage SET bytes = ?, files = ?, updated = ? WHERE session_id = ?",
+                (max(row[0] + deltaBytes, 0), max(row[1] + deltaFiles, 0), time.time(), sessionId),
+            )
+
+    def setFileSize(self, sessionId, fileName, nBytes):
+        """Record the current size of a file in the session and update the session total."""
+        try:
+            with self.__transaction() as con:
+                row = con.execute(
+                    "SELECT bytes FROM file_usage WHERE session_id = ? AND file_name = ?", (sessionId, fileName)
+                ).fetchone()
+                if row is None:
+                    con.execute(
+                        "INSERT INTO file_usage (session_id, file_name, bytes) VALUES (?, ?, ?)",
+                        (sessionId, fileName, nBytes),
+                    )
+                    self.__adjustSession(con, sessionId, nBytes, 1)
+                else:
+                    con.execute(
+                        "UPDATE file_usage SET bytes = ? WHERE session_id = ? AND file_name = ?",
+                        (nBytes, sessionId, fileName),
+                    )
+                    self.__adjustSession(con, sessionId, nBytes - row[0], 0)
+            return True
+        except sqlite3.Error as e:
+            self.__lfh.write("+SessionUsageLedger.setFileSize() failed for %s %s %r\n" % (sessionId, fileName, str(e)))
+        return False
+
+    def removeFile(self, sessionId, fileName):
+        try:
+            with self.__transaction() as con:
+                row = con.execute(
+                    "SELECT bytes FROM file_usage WHERE session_id = ? AND file_name = ?", (sessionId, fileName)
+                ).fetchone()
+                if row is not None:
+                    con.execute("DELETE FROM file_usage WHERE session_id = ? AND file_name = ?", (sessionId, fileName))
+                    self.__adjustSession(con, sessionId, -row[0], -1)
+            return True
+        except sqlite3.Error as e:
+            self.__lfh.write("+SessionUsageLedger.removeFile() failed for %s %s %r\n" % (sessionId, fileName, str(e)))
+        return False
+
+    def removeSession(self, sessionId):
+        try:
+            with self.__transaction() as con:
+                con.execute("DELETE FROM file_usage WHERE session_id = ?", (sessionId,))
+                con.execute("DELETE FROM session_usage WHERE session_id = ?", (sessionId,))
+            return True
+        except sqlite3.Error as e:
+            self.__lfh.write("+SessionUsageLedger.removeSession() failed for %s %r\n" % (sessionId, str(e)))
+        return False
+
+    def getUsage(self, sessionId):
+        """Return the tuple (bytes, number of files) recorded for the session."""
+        try:
+            row = (
+                self.__connect().execute("SELECT bytes, files FROM session_usage WHERE session_id = ?", (sessionId,)).fetchone()
+            )
+            if row is not None:
+                return row[0], row[1]
+        except sqlite3.Error as e:
+            self.__lfh.write("+SessionUsageLedger.getUsage() failed for %s %r\n" % (sessionId, str(e)))
+        return 0, 0
+
+    def getFileSize(self, sessionId, fileName):
+        """Return the number of bytes recorded for a file in the session (0 if not recorded)."""
+        try:
+            row = (
+                self.__connect()
+                .execute("SELECT bytes FROM file_usage WHERE session_id = ? AND file_name = ?", (sessionId, fileName))
+                .fetchone()
+            )
+            if row is not None:
+                return row[0]
+        except sqlite3.Error as e:
+            self.__lfh.write("+SessionUsageLedger.getFileSize() failed for %s %s %r\n" % (sessionId, fileName, str(e)))
+        return 0
+
+    def getTopSessions(self, topN=10):
+        """Return a list of (session id, bytes, number of files) for the topN sessions by usage."""
+        try:
+            return [
+                tuple(row)
+                for row in self.__connect().execute(
+                    "SELECT session_id, bytes, files FROM session_usage ORDER BY bytes DESC LIMIT ?", (topN,)
+                )
+            ]
+        except sqlite3.Error as e:
+            self.__lfh.write("+SessionUsageLedger.getTopSessions() failed %r\n" % str(e))
+        return []
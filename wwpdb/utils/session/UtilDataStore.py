@@ -13,25 +13,282 @@ Provide a storage interface for miscellaneous key,value data.
 
 """
 
+import collections
+import collections.abc
+import contextlib
+import json
 import os.path
+import secrets
+import struct
 import sys
+import threading
+import traceback
 
 try:
     import cPickle as pickle  # type: ignore[import-not-found] # noqa: N813,S403
 except ImportError:
     import pickle  # noqa: S403
 
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from wwpdb.utils.session.UtilDataStoreDb import UtilDataStoreDb
+
 __docformat__ = "restructuredtext en"
 __author__ = "John Westbrook"
 __email__ = "jwest@rcsb.rutgers.edu"
 __license__ = "Creative Commons Attribution 3.0 Unported"
 __version__ = "V0.07"
 
+#
+# Versioned file header --  magic, format version, codec identifier.
+# Files without the header are legacy pickle files (protocol 0).
+#
+_HEADER_MAGIC = b"WWUDS"
+_FORMAT_VERSION = 1
+_CODEC_IDS = {"pickle": 1, "json": 2, "msgpack": 3}
+_CODEC_NAMES = {v: k for k, v in _CODEC_IDS.items()}
+#
+# Journal records are length prefixed pickled tuples --
+#   ("set", key, value), ("extend", key, index, valueList), ("update", key, subKey, value), ("reset",)
+#
+_JOURNAL_FRAME = struct.Struct("<I")
+#
+# Database shared by all prefixes of a session for the 'sqlite' backend
+#
+_DB_FILE_NAME = "util-session.sqlite"
+
+
+def _isPortable(obj, serialFormat):
+    """Return True if obj is read back unchanged from the 'json' or 'msgpack' codec -- dicts with str keys,
+    lists, strings, numbers, booleans and None (and bytes for msgpack).
+    """
+    scalarTypes = (str, int, float, type(None), bytes) if serialFormat == "msgpack" else (str, int, float, type(None))
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            for key in value:
+                if not isinstance(key, str):
+                    return False
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+        elif not isinstance(value, scalarTypes):
+            return False
+    return True
+
+
+def dumpData(obj, fb, serialFormat="pickle"):
+    """Write obj to the binary file object fb in the input serialization format.
+
+    serialFormat is one of 'pickle' (highest protocol), 'json' or 'msgpack' -- the latter
+    two are restricted to str keys, lists, dicts, strings and numbers, and content which
+    they would not read back unchanged (e.g. tuples or int keys) is written as pickle.
+    'legacy' writes a protocol 0 pickle without a header.
+    """
+    if serialFormat == "legacy":
+        pickle.dump(obj, fb, 0)
+        return
+    if serialFormat == "msgpack" and msgpack is None:
+        serialFormat = "pickle"
+    if serialFormat != "pickle" and not _isPortable(obj, serialFormat):
+        serialFormat = "pickle"
+    fb.write(_HEADER_MAGIC + bytes(bytearray([_FORMAT_VERSION, _CODEC_IDS[serialFormat]])))
+    if serialFormat == "pickle":
+        pickle.dump(obj, fb, pickle.HIGHEST_PROTOCOL)
+    elif serialFormat == "json":
+        fb.write(json.dumps(obj, separators=(",", ":")).encode("utf-8"))
+    else:
+        msgpack.pack(obj, fb, use_bin_type=True)
+
+
+def loadData(fb):
+    """Read an object written by dumpData() (or a legacy pickle file) from the binary file object fb."""
+    head = fb.read(len(_HEADER_MAGIC) + 2)
+    if not head.startswith(_HEADER_MAGIC):
+        fb.seek(0)
+        return pickle.load(fb)  # noqa: S301
+    version, codecId = bytearray(head[len(_HEADER_MAGIC) :])
+    if version > _FORMAT_VERSION or codecId not in _CODEC_NAMES:
+        raise ValueError("Unsupported data store format version %d codec %d" % (version, codecId))
+    serialFormat = _CODEC_NAMES[codecId]
+    if serialFormat == "pickle":
+        return pickle.load(fb)  # noqa: S301
+    if serialFormat == "json":
+        return json.loads(fb.read().decode("utf-8"))
+    if msgpack is None:  # pragma: no cover
+        raise ValueError("msgpack is required to read this data store")
+    return msgpack.unpackb(fb.read(), raw=False, strict_map_key=False)
+
+
+def _applyRecord(D, rec):
+    """Apply a single journal record to the dictionary D.
+
+    List extensions carry their starting index so that replaying a record is idempotent.
+    """
+    op = rec[0]
+    if op == "set":
+        D[rec[1]] = rec[2]
+    elif op == "extend":
+        if rec[1] not in D:
+            D[rec[1]] = []
+        D[rec[1]][rec[2] : rec[2] + len(rec[3])] = rec[3]
+    elif op == "update":
+        if rec[1] not in D:
+            D[rec[1]] = {}
+        D[rec[1]][rec[2]] = rec[3]
+    elif op == "reset":
+        D.clear()
+
+
+def _getSignature(filePath, journalPath):
+    """Validation signature for the store files -- (mtime_ns, size, inode) of the store and journal files."""
+    sigL = []
+    for fp in (filePath, journalPath):
+        try:
+            st = os.stat(fp)
+            sigL.extend((st.st_mtime_ns, st.st_size, st.st_ino))
+        except OSError:
+            sigL.extend((None, None, None))
+    return tuple(sigL)
+
+
+class UtilDataStoreCache:
+    """Per-process LRU cache of loaded store dictionaries keyed by store file path (session id and prefix).
+
+    Entries are validated against the signature of the store files so a repeated load costs only
+    a stat() of the store and journal files.
+    """
+
+    def __init__(self, maxEntries=64):
+        self.__lock = threading.Lock()
+        self.__cD = collections.OrderedDict()
+        self.__maxEntries = maxEntries
+        self.__hits = 0
+        self.__misses = 0
+
+    def get(self, key, signature):
+        with self.__lock:
+            entry = self.__cD.get(key)
+            if entry is not None and entry[0] == signature:
+                self.__cD.move_to_end(key)
+                self.__hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.__cD[key]
+            self.__misses += 1
+            return None
+
+    def put(self, key, signature, D):
+        with self.__lock:
+            self.__cD[key] = (signature, D)
+            self.__cD.move_to_end(key)
+            while len(self.__cD) > self.__maxEntries:
+                self.__cD.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.__lock:
+            self.__cD.pop(key, None)
+
+    def clear(self):
+        with self.__lock:
+            self.__cD.clear()
+            self.__hits = 0
+            self.__misses = 0
+
+    def setMaxEntries(self, maxEntries):
+        with self.__lock:
+            self.__maxEntries = maxEntries
+            while len(self.__cD) > self.__maxEntries:
+                self.__cD.popitem(last=False)
+
+    def getStats(self):
+        with self.__lock:
+            return {"hits": self.__hits, "misses": self.__misses, "entries": len(self.__cD)}
+
+
+_storeCache = UtilDataStoreCache()
+
+
+class UtilDataStoreView(collections.abc.Mapping):
+    """Read-only mapping over a data store -- values are only read from the store when accessed.
+
+    The key list is taken from the store on first use.
+    """
+
+    def __init__(self, uds):
+        self.__uds = uds
+        self.__keyD = None
+
+    def __getKeys(self):
+        if self.__keyD is None:
+            self.__keyD = dict.fromkeys(self.__uds.getKeys())
+        return self.__keyD
+
+    def __getitem__(self, key):
+        if key not in self.__getKeys():
+            raise KeyError(key)
+        return self.__uds.get(key)
+
+    def __contains__(self, key):
+        return key in self.__getKeys()
+
+    def __iter__(self):
+        return iter(self.__getKeys())
+
+    def __len__(self):
+        return len(self.__getKeys())
+
 
 class UtilDataStore:
     """Provide a storage interface for miscellaneous key,value data."""
 
-    def __init__(self, reqObj, prefix=None, verbose=False, log=sys.stderr):
+    def __init__(
+        self,
+        reqObj,
+        prefix=None,
+        verbose=False,
+        log=sys.stderr,
+        serialFormat=None,
+        journal=None,
+        journalThreshold=1024 * 1024,
+        cache=None,
+        backend=None,
+    ):
+        """
+        Parameters:
+        :serialFormat: serialization format for the store file -- 'pickle', 'json', 'msgpack' or 'legacy'.
+                       Defaults to the request parameter "UtilDataStoreFormat" or 'pickle'.
+                       Files in any of these formats are read.
+        :journal: if set, serialize() appends the changes made by set/append/extend/updateDict/reset
+                  to a journal file rather than rewriting the store.  Defaults to the request
+                  parameter "UtilDataStoreJournal".
+        :journalThreshold: journal size in bytes beyond which the store file is rewritten (compacted)
+        :cache: if set, loaded stores are shared through the per-process cache (see getCache()).
+                Defaults to the request parameter "UtilDataStoreCache".  Values returned by get() and
+                getDictionary() must then be treated as read-only -- use set/append/extend/updateDict.
+        :backend: 'file' (default) or 'sqlite'.  Defaults to the request parameter "UtilDataStoreBackend".
+                  The 'sqlite' backend keeps each key in a row of a database shared by all prefixes
+                  of the session (util-session.sqlite).  Keys are read on first access, serialize()
+                  writes only the keys changed since the last load in a single transaction, and an
+                  existing <prefix>-util-session.pic store is imported on first access.  The
+                  journal and cache options do not apply to this backend.
+
+        In journal mode and with the 'sqlite' backend changes made directly to the object returned by getDictionary() are only
+        saved by compact().
+
+        Reads and writes of the store files are serialized between processes with advisory locks
+        on <prefix>-util-session.lock and the store file is replaced atomically.  Use transaction()
+        for read-modify-write updates.
+        """
         self.__verbose = verbose
         self.__debug = True
         self.__lfh = log
@@ -42,6 +299,24 @@ class UtilDataStore:
             self.__filePrefix = "general"
         self.__filePath = None
         self.__D = {}
+        self.__serialFormat = serialFormat
+        self.__journal = journal
+        self.__journalThreshold = journalThreshold
+        self.__journalPath = None
+        self.__lockPath = None
+        self.__inTransaction = False
+        self.__pendingL = []
+        self.__useCache = cache
+        # signature of the store files matching the in-memory store
+        self.__signature = None
+        # keys with values not shared with the cache
+        self.__ownedKeySet = set()
+        self.__backend = backend
+        self.__db = None
+        # sqlite backend -- keys changed since the last load, store reset and all keys loaded flags
+        self.__dirtyKeySet = set()
+        self.__cleared = False
+        self.__loadedAll = False
         self.__setup()
 
     def __setup(self):
@@ -49,13 +324,29 @@ class UtilDataStore:
         self.__sObj = self.__reqObj.getSessionObj()
         self.__sessionId = self.__sObj.getId()
         self.__sessionPath = self.__sObj.getPath()
-        #
-        # self.__pickleProtocol = pickle.HIGHEST_PROTOCOL
-        self.__pickleProtocol = 0
+        if self.__serialFormat is None:
+            self.__serialFormat = self.__reqObj.getValueOrDefault("UtilDataStoreFormat", default="pickle")
+        if self.__serialFormat not in _CODEC_IDS and self.__serialFormat != "legacy":
+            self.__serialFormat = "pickle"
+        if self.__journal is None:
+            self.__journal = self.__reqObj.getValue("UtilDataStoreJournal").lower() in ["true", "yes", "y", "1"]
+        if self.__useCache is None:
+            self.__useCache = self.__reqObj.getValue("UtilDataStoreCache").lower() in ["true", "yes", "y", "1"]
+        if self.__backend is None:
+            self.__backend = self.__reqObj.getValueOrDefault("UtilDataStoreBackend", default="file")
         try:
             self.__filePath = os.path.join(self.__sessionPath, self.__filePrefix + "-util-session.pic")
+            self.__journalPath = os.path.join(self.__sessionPath, self.__filePrefix + "-util-session.jnl")
+            self.__lockPath = os.path.join(self.__sessionPath, self.__filePrefix + "-util-session.lock")
+            if self.__backend == "sqlite":
+                self.__journal = False
+                self.__useCache = False
+                self.__db = UtilDataStoreDb(
+                    os.path.join(self.__sessionPath, _DB_FILE_NAME), self.__filePrefix, verbose=self.__verbose, log=self.__lfh
+                )
+                self.__importFileStore()
             if self.__verbose:
-                self.__lfh.write("\n+UtilDataStore.__setup() - data store path %s\n" % self.__filePath)
+                self.__lfh.write("\n+UtilDataStore.__setup() - data store path %s\n" % self.getFilePath())
             self.deserialize()
         except Exception as e:  # noqa: BLE001
             if self.__debug:
@@ -64,68 +355,337 @@ class UtilDataStore:
                     % (self.__sessionId, self.__filePrefix, self.__filePath, str(e))
                 )
 
+    def __importFileStore(self):
+        """Copy an existing file store for this prefix into the database on first access."""
+        if self.__db.exists():
+            return
+        with self.__db.transaction():
+            if self.__db.exists():
+                return
+            D = self.__D
+            if self.__loadFiles() and self.__verbose:
+                self.__lfh.write("+UtilDataStore.__importFileStore() - importing %d keys from %s\n" % (len(self.__D), self.__filePath))
+            self.__db.putItems(self.__D, clear=True)
+            self.__D = D
+        self.__sObj.recordFileUsage(self.__db.getFilePath())
+
     def reset(self):
         self.__D = {}
+        if self.__journal:
+            self.__pendingL.append(("reset",))
+        if self.__db is not None:
+            self.__dirtyKeySet = set()
+            self.__cleared = True
+            self.__loadedAll = True
 
     def getFilePath(self):
+        if self.__db is not None:
+            return self.__db.getFilePath()
         return self.__filePath
 
+    def getJournalFilePath(self):
+        return self.__journalPath
+
+    @staticmethod
+    def getCache():
+        """Return the per-process store cache (hit/miss counters via getCache().getStats())."""
+        return _storeCache
+
+    @contextlib.contextmanager
+    def __lock(self, exclusive=True):
+        """Hold an advisory lock on the store -- a no-op within a transaction or if fcntl is unavailable."""
+        if self.__inTransaction or fcntl is None or self.__db is not None:
+            yield
+            return
+        try:
+            fh = open(self.__lockPath, "a")
+        except OSError:
+            if exclusive:
+                raise
+            # read-only session directory -- the atomic replace of the store file keeps an unlocked read consistent
+            yield
+            return
+        with fh:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+            # lock is released on close
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Atomic read-modify-write of the store --
+
+            with uds.transaction():
+                uds.set(key, value)
+                uds.append(listKey, value)
+
+        The store is reloaded under an exclusive lock on entry and the updates are written with a
+        single write and fsync on exit.  Updates are discarded if the block raises an exception.
+        """
+        if self.__db is not None:
+            with self.__db.transaction():
+                self.__inTransaction = True
+                try:
+                    self.__load()
+                    yield self
+                    self.__save()
+                except BaseException:
+                    self.__load()
+                    raise
+                finally:
+                    self.__inTransaction = False
+            return
+        with self.__lock(exclusive=True):
+            self.__inTransaction = True
+            try:
+                self.__load()
+                yield self
+                self.__save()
+            except BaseException:
+                self.__load()
+                raise
+            finally:
+                self.__inTransaction = False
+
     def serialize(self):
+        """Write the store -- within a transaction the write is deferred to the end of the transaction."""
+        if self.__inTransaction:
+            return True
+        try:
+            with self.__lock():
+                self.__save()
+            return True
+        except Exception as e:  # noqa: BLE001
+            self.__lfh.write("+UtilDataStore.serialize() failed for %s err %r\n" % (self.__filePath, str(e)))
+            if self.__verbose:
+                traceback.print_exc(file=self.__lfh)
+        return False
+
+    def __save(self):
+        if self.__db is not None:
+            self.__db.putItems({k: self.__D[k] for k in self.__dirtyKeySet if k in self.__D}, clear=self.__cleared)
+            self.__dirtyKeySet = set()
+            self.__cleared = False
+            self.__sObj.recordFileUsage(self.__db.getFilePath())
+            return
+        if self.__journal and not self.__isCompactionNeeded():
+            # the in-memory store matches the files only if no other writer appended since the load -
+            current = self.__useCache and _getSignature(self.__filePath, self.__journalPath) == self.__signature
+            self.__appendJournal()
+        else:
+            self.__writeSnapshot()
+            current = True
+        if self.__useCache:
+            if current:
+                self.__signature = _getSignature(self.__filePath, self.__journalPath)
+                self.__cachePut()
+            else:
+                self.__signature = None
+                _storeCache.invalidate(self.__filePath)
+
+    def __cachePut(self):
+        _storeCache.put(self.__filePath, self.__signature, dict(self.__D))
+        self.__ownedKeySet = set()
+
+    def compact(self):
+        """Rewrite the complete store file and discard the journal."""
         try:
-            fb = open(self.__filePath, "wb")
-            pickle.dump(self.__D, fb, self.__pickleProtocol)
-            fb.close()
+            if self.__db is not None:
+                self.__cleared = True
+                self.__dirtyKeySet = set(self.getDictionary())
+                self.__save()
+                return True
+            with self.__lock():
+                self.__writeSnapshot()
+                if self.__useCache:
+                    self.__signature = _getSignature(self.__filePath, self.__journalPath)
+                    self.__cachePut()
+            return True
         except:  # noqa: E722 pylint: disable=bare-except
-            pass
+            return False
 
-    def deserialize(self):
+    def __isCompactionNeeded(self):
         try:
-            fb = open(self.__filePath, "rb")
-            self.__D = pickle.load(fb)  # noqa: S301
-            fb.close()
+            os.stat(self.__filePath)
+        except OSError:
             return True
+        try:
+            return os.stat(self.__journalPath).st_size > self.__journalThreshold
+        except OSError:
+            return False
+
+    def __writeSnapshot(self):
+        # write to a temporary file and replace so that readers never see a partial file -
+        tmpPath = "%s.%d.%s.tmp" % (self.__filePath, os.getpid(), secrets.token_hex(4))
+        try:
+            with open(tmpPath, "xb") as fb:
+                try:
+                    dumpData(self.__D, fb, self.__serialFormat)
+                except (TypeError, ValueError):
+                    # content not supported by the selected codec -
+                    fb.seek(0)
+                    fb.truncate()
+                    dumpData(self.__D, fb, "pickle")
+                fb.flush()
+                os.fsync(fb.fileno())
+            os.replace(tmpPath, self.__filePath)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmpPath)
+            raise
+        self.__pendingL = []
+        self.__sObj.recordFileUsage(self.__filePath)
+        if os.path.exists(self.__journalPath):
+            os.remove(self.__journalPath)
+            self.__sObj.removeFileUsage(self.__journalPath)
+
+    def __appendJournal(self):
+        if not self.__pendingL:
+            return
+        bL = []
+        for rec in self.__pendingL:
+            payload = pickle.dumps(rec, pickle.HIGHEST_PROTOCOL)
+            bL.append(_JOURNAL_FRAME.pack(len(payload)))
+            bL.append(payload)
+        with open(self.__journalPath, "ab") as fb:
+            fb.write(b"".join(bL))
+            fb.flush()
+            os.fsync(fb.fileno())
+        self.__pendingL = []
+        self.__sObj.recordFileUsage(self.__journalPath)
+
+    def __replayJournal(self):
+        """Apply the records in the journal file to the store -- an incomplete trailing record is ignored."""
+        try:
+            fb = open(self.__journalPath, "rb")
+        except OSError:
+            return 0
+        nRec = 0
+        with fb:
+            while True:
+                head = fb.read(_JOURNAL_FRAME.size)
+                if len(head) < _JOURNAL_FRAME.size:
+                    break
+                (nBytes,) = _JOURNAL_FRAME.unpack(head)
+                payload = fb.read(nBytes)
+                if len(payload) < nBytes:
+                    break
+                _applyRecord(self.__D, pickle.loads(payload))  # noqa: S301
+                nRec += 1
+        return nRec
+
+    def __load(self):
+        """Load the store and replay the journal -- returns False if neither file exists.
+
+        With the 'sqlite' backend the local state is discarded and keys are read on access.
+        """
+        if self.__db is not None:
+            self.__D = {}
+            self.__dirtyKeySet = set()
+            self.__cleared = False
+            self.__loadedAll = False
+            return self.__db.exists()
+        return self.__loadFiles()
+
+    def __loadFiles(self):
+        self.__pendingL = []
+        if self.__useCache:
+            self.__signature = _getSignature(self.__filePath, self.__journalPath)
+            cD = _storeCache.get(self.__filePath, self.__signature)
+            if cD is not None:
+                self.__D = dict(cD)
+                self.__ownedKeySet = set()
+                return True
+        try:
+            with open(self.__filePath, "rb") as fb:
+                self.__D = loadData(fb)
+        except FileNotFoundError:
+            if not os.path.exists(self.__journalPath):
+                return False
+            self.__D = {}
+        self.__replayJournal()
+        if self.__useCache:
+            self.__cachePut()
+        return True
+
+    def deserialize(self):
+        try:
+            with self.__lock(exclusive=False):
+                return self.__load()
         except:  # noqa: E722 pylint: disable=bare-except
             return False
 
+    def __fetch(self, key):
+        """Read a single key from the database into the local store (sqlite backend)."""
+        if self.__db is None or self.__loadedAll or key in self.__D:
+            return
+        found, value = self.__db.getValue(key)
+        if found:
+            self.__D[key] = value
+
     def get(self, key):
         try:
+            self.__fetch(key)
             return self.__D[key]
         except:  # noqa: E722 pylint: disable=bare-except
             return ""
 
+    def __update(self, rec):
+        key = rec[1] if len(rec) > 1 else None
+        if self.__useCache and key not in self.__ownedKeySet:
+            # copy values shared with the cache before modifying them in place -
+            if rec[0] != "set" and isinstance(self.__D.get(key), (list, dict)):
+                self.__D[key] = type(self.__D[key])(self.__D[key])
+            self.__ownedKeySet.add(key)
+        _applyRecord(self.__D, rec)
+        if self.__db is not None:
+            self.__dirtyKeySet.add(key)
+        if self.__journal:
+            self.__pendingL.append(rec)
+
     def set(self, key, value):
         try:
-            self.__D[key] = value
+            self.__update(("set", key, value))
             return True
         except:  # noqa: E722 pylint: disable=bare-except
             return False
 
     def append(self, key, value):
-        try:
-            if key not in self.__D:
-                self.__D[key] = []
-            self.__D[key].append(value)
-            return True
-        except:  # noqa: E722 pylint: disable=bare-except
-            return False
+        return self.extend(key, [value])
 
     def extend(self, key, valueList):
         try:
+            valueList = list(valueList)
+            self.__fetch(key)
             if key not in self.__D:
                 self.__D[key] = []
-            self.__D[key].extend(valueList)
+            self.__update(("extend", key, len(self.__D[key]), valueList))
             return True
         except:  # noqa: E722 pylint: disable=bare-except
             return False
 
     def updateDict(self, key, subKey, value):
         try:
+            self.__fetch(key)
             if key not in self.__D:
                 self.__D[key] = {}
-            self.__D[key][subKey] = value
+            self.__update(("update", key, subKey, value))
             return True
         except:  # noqa: E722 pylint: disable=bare-except
             return False
 
-    def getDictionary(self):
+    def getKeys(self):
+        if self.__db is not None and not self.__loadedAll:
+            return list(dict.fromkeys(self.__db.getKeys() + list(self.__D)))
+        return list(self.__D)
+
+    def getDictionary(self, lazy=False):
+        """Return the store dictionary -- if lazy, return a read-only UtilDataStoreView which
+        reads individual values on access (from the database with the 'sqlite' backend).
+        """
+        if lazy:
+            return UtilDataStoreView(self)
+        if self.__db is not None and not self.__loadedAll:
+            for k, v in self.__db.getItems().items():
+                self.__D.setdefault(k, v)
+            self.__loadedAll = True
         return self.__D
@@ -0,0 +1,160 @@
+##
+# File:    UtilDataStoreDb.py
+# Date:    17-Oct-2026
+#
+# Updates:
+##
+"""
+SQLite storage for UtilDataStore key,value data.
+
+All data store prefixes of a session share a single database in the session directory.
+Values are stored as individual rows so that single keys can be read and written without
+loading or rewriting the complete store.
+
+"""
+
+__docformat__ = "restructuredtext en"
+__author__ = "Ezra Peisach"
+__email__ = "ezra.peisach@rcsb.org"
+__license__ = "Apache 2.0"
+
+import contextlib
+import sqlite3
+import sys
+import time
+
+try:
+    import cPickle as pickle  # type: ignore[import-not-found] # noqa: N813,S403
+except ImportError:
+    import pickle  # noqa: S403
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS store_data (
+    prefix TEXT NOT NULL,
+    key NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (prefix, key)
+);
+CREATE TABLE IF NOT EXISTS store_prefix (
+    prefix TEXT PRIMARY KEY,
+    created REAL NOT NULL
+);
+"""
+
+
+def _encodeKey(key):
+    # str keys are stored as text, other keys as pickled blobs
+    if isinstance(key, str):
+        return key
+    return sqlite3.Binary(pickle.dumps(key, 4))
+
+
+def _decodeKey(key):
+    if isinstance(key, str):
+        return key
+    return pickle.loads(key)  # noqa: S301
+
+
+def _encodeValue(value):
+    return sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+def _decodeValue(value):
+    return pickle.loads(value)  # noqa: S301
+
+
+class UtilDataStoreDb:
+    """Key level access to the rows of one data store prefix in a SQLite database."""
+
+    def __init__(self, dbPath, prefix, verbose=False, log=sys.stderr):
+        self.__dbPath = dbPath
+        self.__prefix = prefix
+        self.__verbose = verbose
+        self.__lfh = log
+        # connection held for the duration of a transaction
+        self.__con = None
+
+    def getFilePath(self):
+        return self.__dbPath
+
+    def __connect(self):
+        con = sqlite3.connect(self.__dbPath, timeout=30.0, isolation_level=None)
+        # the schema is created on every connect so a removed or replaced database is recreated
+        con.execute("PRAGMA journal_mode=WAL")
+        con.executescript(_SCHEMA)
+        return con
+
+    @contextlib.contextmanager
+    def __cursor(self, write=False):
+        """Yield the transaction connection or a connection for a single statement group."""
+        if self.__con is not None:
+            yield self.__con
+            return
+        with contextlib.closing(self.__connect()) as con:
+            if write:
+                con.execute("BEGIN IMMEDIATE")
+                try:
+                    yield con
+                    con.execute("COMMIT")
+                except BaseException:
+                    con.execute("ROLLBACK")
+                    raise
+            else:
+                yield con
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Hold a write transaction -- reads and writes within the block see a consistent store."""
+        with contextlib.closing(self.__connect()) as con:
+            con.execute("BEGIN IMMEDIATE")
+            self.__con = con
+            try:
+                yield self
+                con.execute("COMMIT")
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+            finally:
+                self.__con = None
+
+    def exists(self):
+        """Return True if the prefix has been created (written to or imported)."""
+        with self.__cursor() as con:
+            row = con.execute("SELECT 1 FROM store_prefix WHERE prefix = ?", (self.__prefix,)).fetchone()
+        return row is not None
+
+    def getValue(self, key):
+        """Return the tuple (True, value) for a stored key or (False, None)."""
+        with self.__cursor() as con:
+            row = con.execute(
+                "SELECT value FROM store_data WHERE prefix = ? AND key = ?", (self.__prefix, _encodeKey(key))
+            ).fetchone()
+        if row is None:
+            return False, None
+        return True, _decodeValue(row[0])
+
+    def getKeys(self):
+        with self.__cursor() as con:
+            return [_decodeKey(row[0]) for row in con.execute("SELECT key FROM store_data WHERE prefix = ?", (self.__prefix,))]
+
+    def getItems(self):
+        """Return the dictionary of all stored key,value pairs."""
+        with self.__cursor() as con:
+            return {
+                _decodeKey(row[0]): _decodeValue(row[1])
+                for row in con.execute("SELECT key, value FROM store_data WHERE prefix = ?", (self.__prefix,))
+            }
+
+    def putItems(self, itemD, clear=False):
+        """Write the key,value pairs in itemD in a single transaction -- if clear, existing keys are removed first."""
+        with self.__cursor(write=True) as con:
+            con.execute(
+                "INSERT OR IGNORE INTO store_prefix (prefix, created) VALUES (?, ?)", (self.__prefix, time.time())
+            )
+            if clear:
+                con.execute("DELETE FROM store_data WHERE prefix = ?", (self.__prefix,))
+            con.executemany(
+                "INSERT OR REPLACE INTO store_data (prefix, key, value) VALUES (?, ?, ?)",
+                [(self.__prefix, _encodeKey(k), _encodeValue(v)) for k, v in itemD.items()],
+            )
+        return True
@@ -33,6 +33,7 @@ import types
 from wwpdb.utils.config.ConfigInfo import ConfigInfo
 from wwpdb.utils.session.UtilDataStore import UtilDataStore
 from wwpdb.utils.session.WebRequest import ResponseContent
+from wwpdb.utils.session.WebUploadUtils import WebUploadUtils
 
 
 class WebAppWorkerBase:
@@ -108,13 +109,14 @@ class WebAppWorkerBase:
         try:
             # if self._uds is None:
             self._uds = UtilDataStore(reqObj=self._reqObj, prefix=prefix, verbose=self._verbose, log=self._lfh)
-            if param is not None:
-                self._uds.set(param, value)
-                self._uds.serialize()
-            if pvD is not None and len(pvD) > 0:
-                for k, v in pvD.items():
-                    self._uds.set(k, v)
-                self._uds.serialize()
+            if param is None and not pvD:
+                return True
+            with self._uds.transaction():
+                if param is not None:
+                    self._uds.set(param, value)
+                if pvD is not None and len(pvD) > 0:
+                    for k, v in pvD.items():
+                        self._uds.set(k, v)
             return True
         except Exception as e:  # noqa: BLE001
             if self._verbose:
@@ -138,7 +140,7 @@ class WebAppWorkerBase:
     def _getFileText(self, filePath):
         self._reqObj.setReturnFormat(return_format="text")
         rC = ResponseContent(reqObj=self._reqObj, verbose=self._verbose, log=self._lfh)
-        rC.setTextFile(filePath)
+        rC.setTextFile(filePath, stream=True)
         return rC
 
     def _newSessionOp(self):
@@ -166,7 +168,7 @@ class WebAppWorkerBase:
             self._sessionPath = self._sObj.getPath()
             self._rltvSessionPath = self._sObj.getRelativePath()
             uds = UtilDataStore(reqObj=self._reqObj, prefix=self._udsPrefix, verbose=self._verbose, log=self._lfh)
-            dd = uds.getDictionary()
+            dd = uds.getDictionary(lazy=True)
             if self.__debug:
                 self._lfh.write(
                     "+WebAppWorkerBase._verifySessionContext() -  importing persisted general session parameters:\n"
@@ -204,7 +206,7 @@ class WebAppWorkerBase:
 
         if useContext:
             uds = UtilDataStore(reqObj=self._reqObj, prefix=self._udsPrefix, verbose=self._verbose, log=self._lfh)
-            dd = uds.getDictionary()
+            dd = uds.getDictionary(lazy=True)
             if self.__debug:
                 self._lfh.write("+WebAppWorkerBase._getSession() -  importing persisted general session parameters:\n")
                 for k, v in dd.items():
@@ -249,9 +251,14 @@ class WebAppWorkerBase:
                     "+WebAppWorkerBase._uploadFile() - starting upload of %r to path %r\n" % (fNameInput, fPathAbs)
                 )
 
-            ofh = open(fPathAbs, "wb")
-            ofh.write(fs.file.read())
-            ofh.close()
+            sObj = self._sObj if self._sObj is not None else self._reqObj.getSessionObj()
+            if not sObj.checkQuota(WebUploadUtils.getFileObjectSize(fs.file), filePath=fPathAbs):
+                self._lfh.write(
+                    "+WebAppWorkerBase._uploadFile() - upload of %s rejected - session quota exceeded\n" % fName
+                )
+                return None
+            infoD = WebUploadUtils.copyFileToPath(fs.file, fPathAbs, WebUploadUtils.getDigestNames(self._reqObj))
+            sObj.recordFileUsage(fPathAbs)
 
             if self._verbose:
                 self._lfh.write(
@@ -259,10 +266,12 @@ class WebAppWorkerBase:
                     % (fileTag, fName)
                 )
             #
-            #  Store the file path and name in request object -
+            #  Store the file path, name, size and digests in request object -
             #
             self._reqObj.setValue("filePath", fPathAbs)
             self._reqObj.setValue("fileName", fName)
+            infoD["fileName"] = fName
+            self._reqObj.setValue("uploadFileInfo", infoD)
             return fName
         except Exception as e:  # noqa: BLE001
             if self._verbose:
@@ -296,6 +305,7 @@ class WebAppWorkerBase:
         fp = open(fPathAbs, "w")
         fp.write("%s\n" % value)
         fp.close()
+        self._reqObj.getSessionObj().recordFileUsage(fPathAbs)
         return semaphore
 
     def _semaphoreExists(self, semaphore="TMP_"):
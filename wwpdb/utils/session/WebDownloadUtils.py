@@ -21,7 +21,14 @@ Utilities to manage  web application download requests for archive and workflow
           'wf_instance'
           'version'
           'part'
-          'compress'
+          'compress'         true|yes -- compress uncompressed files on the fly for clients accepting it
+
+   bundle downloads (makeBundleResponse())
+
+          'bundle_file'      one value per file  -  data_set_id,content_type[,format[,version[,part]]]
+          'bundle_category'  FileUtils file categories for data_set_id (e.g. Primary Data Files)
+          'bundle_format'    zip|tar|tgz  (default zip)
+          'bundle_name'      archive name (default data_set_id)
 
     response corresponds to  -
 
@@ -34,10 +41,14 @@ Utilities to manage  web application download requests for archive and workflow
 
 """
 
+import collections
 import os
 import sys
+import threading
+import time
 
 from wwpdb.io.locator.PathInfo import PathInfo
+from wwpdb.utils.session.FileUtils import FileUtils
 from wwpdb.utils.session.WebRequest import ResponseContent
 
 __docformat__ = "restructuredtext en"
@@ -47,6 +58,84 @@ __license__ = "Creative Commons Attribution 3.0 Unported"
 __version__ = "V0.09"
 
 
+def _getDirMtime(dirPath):
+    try:
+        return os.stat(dirPath).st_mtime_ns
+    except OSError:
+        return None
+
+
+class PathResolverCache:
+    """Per-process LRU cache of resolved download file paths keyed by (site, session, data set, source,
+    instance, content type, format, version, part).
+
+    Entries are validated against the modification time of the directory holding the file, which
+    changes when a new version is added, and expire ttl seconds after they were resolved.
+    """
+
+    TTL = 300.0
+
+    def __init__(self, maxEntries=4096, ttl=None):
+        self.__lock = threading.Lock()
+        self.__cD = collections.OrderedDict()
+        self.__maxEntries = maxEntries
+        self.__ttl = self.TTL if ttl is None else ttl
+        self.__hits = 0
+        self.__misses = 0
+
+    def get(self, key, ttl=None):
+        """Return the cached file path for key or None."""
+        ttl = self.__ttl if ttl is None else ttl
+        with self.__lock:
+            entry = self.__cD.get(key)
+        if entry is not None:
+            filePath, dirMtime, tResolved = entry
+            if time.time() - tResolved <= ttl and _getDirMtime(os.path.dirname(filePath)) == dirMtime:
+                with self.__lock:
+                    if key in self.__cD:
+                        self.__cD.move_to_end(key)
+                    self.__hits += 1
+                return filePath
+        with self.__lock:
+            if entry is not None and self.__cD.get(key) is entry:
+                del self.__cD[key]
+            self.__misses += 1
+        return None
+
+    def put(self, key, filePath, dirMtime):
+        """Store filePath resolved from a directory with modification time dirMtime (taken before resolving)."""
+        if dirMtime is None:
+            return
+        with self.__lock:
+            self.__cD[key] = (filePath, dirMtime, time.time())
+            self.__cD.move_to_end(key)
+            while len(self.__cD) > self.__maxEntries:
+                self.__cD.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.__lock:
+            self.__cD.pop(key, None)
+
+    def clear(self):
+        with self.__lock:
+            self.__cD.clear()
+            self.__hits = 0
+            self.__misses = 0
+
+    def setMaxEntries(self, maxEntries):
+        with self.__lock:
+            self.__maxEntries = maxEntries
+            while len(self.__cD) > self.__maxEntries:
+                self.__cD.popitem(last=False)
+
+    def getStats(self):
+        with self.__lock:
+            return {"hits": self.__hits, "misses": self.__misses, "entries": len(self.__cD)}
+
+
+_resolverCache = PathResolverCache()
+
+
 class WebDownloadUtils:
     """
     This class encapsulates handling download requests for workflow data files -
@@ -60,6 +149,8 @@ class WebDownloadUtils:
         self.__sessionObj = self.__reqObj.getSessionObj()
         self.__sessionPath = self.__sessionObj.getPath()
         self.__siteId = self.__reqObj.getValue("WWPDB_SITE_ID")
+        # seconds a resolved path is reused -- 0 disables the resolver cache
+        self.__cacheTtl = float(self.__reqObj.getValueOrDefault("DownloadResolverCacheTtl", default=PathResolverCache.TTL))
 
         self.__pI = PathInfo(
             siteId=self.__siteId, sessionPath=self.__sessionPath, verbose=self.__verbose, log=self.__lfh
@@ -101,17 +192,158 @@ class WebDownloadUtils:
         versionId = self.__reqObj.getValueOrDefault("version", default="latest")
         partNumber = self.__reqObj.getValueOrDefault("part", "1")
 
-        retPath = self.__pI.getFilePath(
-            dataSetId,
-            wfInstanceId=wfInstanceId,
-            contentType=contentType,
-            formatType=formatType,
-            fileSource=fileSource,
-            versionId=versionId,
-            partNumber=partNumber,
-        )
+        retPath = self.resolveMany(
+            [(dataSetId, contentType, formatType, versionId, partNumber)], fileSource=fileSource, wfInstanceId=wfInstanceId
+        )[0]
         return retPath
 
+    @staticmethod
+    def getCache():
+        """Return the per-process path resolver cache (hit/miss counters via getCache().getStats())."""
+        return _resolverCache
+
+    def resolveMany(self, specList, fileSource="archive", wfInstanceId=None):
+        """Return the list of file paths (or None) for specList, a list of
+        (data_set_id, content_type, format, version, part) tuples -- trailing items default to
+        format pdbx, latest version and part 1.
+
+        Paths are taken from the resolver cache when valid.  Symbolic versions (latest, next,
+        previous) of the remaining specs are resolved from a single listing of each directory.
+        """
+        retL = [None] * len(specList)
+        pendingD = collections.defaultdict(list)
+        for ii, spec in enumerate(specList):
+            dataSetId, contentType, formatType, versionId, partNumber = (tuple(spec) + (None, None, None, None, None))[:5]
+            if not dataSetId or not contentType:
+                continue
+            formatType = formatType or "pdbx"
+            versionId = str(versionId or "latest")
+            partNumber = str(partNumber or "1")
+            sessionPath = self.__sessionPath if fileSource in ["session", "wf-session"] else None
+            key = (self.__siteId, sessionPath, dataSetId, fileSource, wfInstanceId, contentType, formatType, versionId, partNumber)
+            if self.__cacheTtl > 0:
+                retL[ii] = _resolverCache.get(key, ttl=self.__cacheTtl)
+                if retL[ii] is not None:
+                    continue
+            basePath = None
+            if partNumber.isdigit() and (versionId.isdigit() or versionId in ["latest", "next", "previous", "original"]):
+                basePath = self.__pI.getFilePath(
+                    dataSetId,
+                    wfInstanceId=wfInstanceId,
+                    contentType=contentType,
+                    formatType=formatType,
+                    fileSource=fileSource,
+                    versionId="none",
+                    partNumber=partNumber,
+                )
+            if basePath is None:
+                # symbolic partition or version - resolved by PathInfo
+                retL[ii] = self.__pI.getFilePath(
+                    dataSetId,
+                    wfInstanceId=wfInstanceId,
+                    contentType=contentType,
+                    formatType=formatType,
+                    fileSource=fileSource,
+                    versionId=versionId,
+                    partNumber=partNumber,
+                )
+                if retL[ii] is not None and self.__cacheTtl > 0:
+                    _resolverCache.put(key, retL[ii], _getDirMtime(os.path.dirname(retL[ii])))
+                continue
+            pendingD[os.path.dirname(basePath)].append((ii, key, os.path.basename(basePath), versionId))
+
+        for dirPath, pendingL in pendingD.items():
+            dirMtime = _getDirMtime(dirPath)
+            fileList = []
+            if any(not versionId.isdigit() and versionId != "original" for _ii, _key, _bn, versionId in pendingL):
+                try:
+                    fileList = os.listdir(dirPath)
+                except OSError:
+                    pass
+            for ii, key, baseName, versionId in pendingL:
+                fN = self.__getVersionFileName(fileList, baseName, versionId)
+                if fN is None:
+                    continue
+                retL[ii] = os.path.join(dirPath, fN)
+                if self.__cacheTtl > 0:
+                    _resolverCache.put(key, retL[ii], dirMtime)
+        return retL
+
+    @staticmethod
+    def __getVersionFileName(fileList, baseName, versionId):
+        """Return the file name of versionId of baseName (<baseName>.V#) in the directory listing fileList.
+
+        Follows the version conventions of DataReference -- testResolveMatchesPathInfo checks the two agree.
+        """
+        if versionId.isdigit():
+            return baseName + ".V" + str(int(versionId))
+        if versionId == "original":
+            return baseName + ".V1"
+        vList = [0]
+        for fN in fileList:
+            if fN.startswith(baseName):
+                fSp = fN.split(".V")
+                if len(fSp) >= 2 and fSp[1].isdigit():
+                    vList.append(int(fSp[1]))
+        iV = max(vList)
+        if versionId == "latest":
+            return baseName + ".V" + str(max(iV, 1))
+        if versionId == "next":
+            return baseName + ".V" + str(iV + 1)
+        # previous
+        if iV <= 1:
+            return None
+        return baseName + ".V" + str(iV - 1)
+
+    def makeBundleResponse(self, specList=None, categoryList=None, archiveFormat=None, archiveName=None):
+        """Return a response object streaming a ZIP or tar archive of the data files described by
+        specList, a list of (data_set_id, content_type, format, version, part) tuples, and by the
+        FileUtils categories in categoryList for the data_set_id in the request object.
+
+        Trailing spec items default to format pdbx, latest version and part 1.  Arguments which are
+        not provided are taken from the request parameters bundle_file, bundle_category, bundle_format
+        and bundle_name.  Files which do not exist are skipped.
+        """
+        if specList is None:
+            specList = [tuple(v.split(",")) for v in self.__reqObj.getValueList("bundle_file") if v]
+        if categoryList is None:
+            categoryList = [v for v in self.__reqObj.getValueList("bundle_category") if v]
+        if archiveFormat is None:
+            archiveFormat = self.__reqObj.getValueOrDefault("bundle_format", default="zip")
+        if archiveName is None:
+            archiveName = self.__reqObj.getValueOrDefault(
+                "bundle_name", default=self.__reqObj.getValueOrDefault("data_set_id", default="files")
+            )
+
+        filePathList = self.__getBundleFileList(specList, categoryList)
+        if self.__verbose:
+            self.__lfh.write("+WebDownloadUtils.makeBundleResponse() %d files in %s bundle\n" % (len(filePathList), archiveFormat))
+
+        rC = ResponseContent(reqObj=self.__reqObj, verbose=self.__verbose, log=self.__lfh)
+        if filePathList and rC.setArchiveFiles(filePathList, archiveName=archiveName, archiveFormat=archiveFormat):
+            rC.setReturnFormat("binary")
+        else:
+            rC.setReturnFormat("json")
+            rC.setError(errMsg="Bundle download failure for %r %r" % (specList, categoryList))
+        return rC
+
+    def __getBundleFileList(self, specList, categoryList):
+        """Resolve the bundle file specifications and categories to the list of existing file paths."""
+        fileSource = self.__reqObj.getValueOrDefault("file_source", default="archive")
+        wfInstanceId = self.__reqObj.getValueOrDefault("wf_instance", default=None)
+        filePathList = []
+        for filePath in self.resolveMany(specList, fileSource=fileSource, wfInstanceId=wfInstanceId):
+            if filePath is not None and os.access(filePath, os.F_OK) and filePath not in filePathList:
+                filePathList.append(filePath)
+
+        dataSetId = self.__reqObj.getValue("data_set_id")
+        if categoryList and dataSetId:
+            fU = FileUtils(dataSetId, reqObj=self.__reqObj, verbose=self.__verbose, log=self.__lfh)
+            for filePath in fU.getCategoryFilePathList(fileSource=fileSource, rDList=categoryList):
+                if filePath not in filePathList:
+                    filePathList.append(filePath)
+        return filePathList
+
     def __makeResponseContentObject(self, filePath, attachmentFlag=True, compressFlag=False):
         """Create a response content object for the input file"""
         if self.__verbose:
@@ -119,7 +351,9 @@ class WebDownloadUtils:
         rC = ResponseContent(reqObj=self.__reqObj, verbose=self.__verbose, log=self.__lfh)
         if filePath is not None and os.access(filePath, os.F_OK):
             rC.setReturnFormat("binary")
-            rC.setBinaryFile(filePath, attachmentFlag=attachmentFlag, serveCompressed=compressFlag)
+            # on-the-fly compression is opt-in as it drops the content length, byte ranges and sendfile
+            compress = self.__reqObj.getValue("compress").lower() in ["true", "yes", "y", "1"]
+            rC.setBinaryFile(filePath, attachmentFlag=attachmentFlag, serveCompressed=compressFlag, compress=compress)
         else:
             rC.setReturnFormat("json")
             rC.setError(errMsg="Download failure for %s" % filePath)
@@ -33,21 +33,41 @@ __email__ = "jwest@rcsb.rutgers.edu"
 __license__ = "Creative Commons Attribution 3.0 Unported"
 __version__ = "V0.07"
 
+import email.utils
 import gzip
-import io
 import mimetypes
 import os
+import queue
+import secrets
+import struct
 import sys
+import tarfile
+import threading
+import time
 import traceback
+import weakref
+import zipfile
+import zlib
 
 try:
     from json import dumps, loads
 except:  # noqa: E722 pylint: disable=bare-except
     from simplejson import dumps, loads  # type: ignore
 
-from datetime import datetime
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+from datetime import datetime, timezone
 
 from wwpdb.utils.session.SessionManager import SessionManager
+from wwpdb.utils.session.UtilDataStore import UtilDataStoreView
 
 
 def json_serializer_helper(obj):
@@ -78,9 +98,33 @@ class WebRequest:
         #  Single values are stored in the leading element of the list (e.g. dict[myKey][0])
         #
         self.__dict = paramDict
+        #
+        #  Fallback layers of single values (e.g. UtilDataStoreView) searched in order for keys not in the dictionary.
+        #  Values are copied into the dictionary when accessed.
+        #
+        self.__layerL = []
+
+    def __lookup(self, myKey):
+        try:
+            return self.__dict[myKey]
+        except KeyError:
+            for layer in self.__layerL:
+                if myKey in layer:
+                    self.__dict[myKey] = [layer[myKey]]
+                    return self.__dict[myKey]
+            raise
+
+    def __flatten(self):
+        """Copy all remaining fallback layer values into the dictionary."""
+        for layer in self.__layerL:
+            for k, v in layer.items():
+                if k not in self.__dict:
+                    self.__dict[k] = [v]
+        self.__layerL = []
 
     def __str__(self):
         try:
+            self.__flatten()
             sL = []
             sL.append("\n+WebRequest.printIt() WebRequest dictionary contents:\n")
             for k, vL in self.__dict.items():
@@ -96,6 +140,7 @@ class WebRequest:
     def printIt(self, ofh=sys.stdout):
         try:
             ofh.write("\n +WebRequest.printIt() WebRequest dictionary contents:\n")
+            self.__flatten()
 
             for k in sorted(self.__dict.keys()):
                 vL = self.__dict[k]
@@ -109,6 +154,7 @@ class WebRequest:
         try:
             if format == "html":
                 oL.append("<pre>\n")
+            self.__flatten()
             oL.append("\n+nWebRequest.dump() Request Dictionary Contents:\n")
             for k, vL in self.__dict.items():
                 oL.append("  - Key: %-35s  value(s): %r\n" % (k, vL))
@@ -121,10 +167,12 @@ class WebRequest:
         return oL
 
     def getJSON(self):
+        self.__flatten()
         return dumps(self.__dict)
 
     def setJSON(self, JSONString):
         self.__dict = loads(JSONString)
+        self.__layerL = []
 
     def getValue(self, myKey):
         return self._getStringValue(myKey)
@@ -144,6 +192,7 @@ class WebRequest:
         return self._getRawValue(myKey)
 
     def getDictionary(self):
+        self.__flatten()
         return self.__dict
 
     def setValue(self, myKey, aValue):
@@ -153,51 +202,81 @@ class WebRequest:
         self.__dict[myKey] = valueList
 
     def setDictionary(self, myDict, overWrite=False):
+        """Set request values from myDict.
+
+        A UtilDataStoreView is linked as a fallback layer rather than copied so that only
+        the values which are accessed are read from the data store.
+        """
+        if isinstance(myDict, UtilDataStoreView):
+            if overWrite:
+                for k in myDict:
+                    self.__dict.pop(k, None)
+                self.__layerL.insert(0, myDict)
+            else:
+                self.__layerL.append(myDict)
+            return
         for k, v in myDict.items():
             if overWrite or (not self.exists(k)):
                 self.setValue(k, v)
 
     def exists(self, myKey):
         try:
-            return myKey in self.__dict
+            return myKey in self.__dict or any(myKey in layer for layer in self.__layerL)
         except:  # noqa: E722 pylint: disable=bare-except
             return False
 
     def _getRawValue(self, myKey):
         try:
-            return self.__dict[myKey][0]
+            return self.__lookup(myKey)[0]
         except:  # noqa: E722 pylint: disable=bare-except
             return None
 
     def _getStringValue(self, myKey):
         try:
-            return str(self.__dict[myKey][0]).strip()
+            return str(self.__lookup(myKey)[0]).strip()
         except:  # noqa: E722 pylint: disable=bare-except
             return ""
 
     def _getIntegerValue(self, myKey):
         try:
-            return int(self.__dict[myKey][0])
+            return int(self.__lookup(myKey)[0])
         except:  # noqa: E722 pylint: disable=bare-except
             return None
 
     def _getDoubleValue(self, myKey):
         try:
-            return float(self.__dict[myKey][0])
+            return float(self.__lookup(myKey)[0])
         except:  # noqa: E722 pylint: disable=bare-except
             return None
 
     def _getStringList(self, myKey):
         try:
-            return self.__dict[myKey]
+            return self.__lookup(myKey)
         except:  # noqa: E722 pylint: disable=bare-except
             return []
 
 
 class InputRequest(WebRequest):
-    def __init__(self, paramDict, verbose=False, log=sys.stderr):  # noqa: ARG002 pylint: disable=unused-argument
+    def __init__(
+        self, paramDict, verbose=False, log=sys.stderr, sessionConfig=None  # noqa: ARG002 pylint: disable=unused-argument
+    ):
         super(InputRequest, self).__init__(paramDict, verbose)
         self.__returnFormatDefault = ""
+        self.__sessionConfig = {}
+        self.__sessionTouched = False
+        if sessionConfig:
+            self.setSessionConfig(**sessionConfig)
+
+    def setSessionConfig(self, **kwD):
+        """Set SessionManager options for the sessions of this request (e.g. shardDepth=2).
+
+        The options are set by the application from its server configuration and are never
+        taken from the request parameters, which may be supplied by the client.
+        """
+        self.__sessionConfig.update(kwD)
+
+    def getSessionConfig(self):
+        return dict(self.__sessionConfig)
 
     def setDefaultReturnFormat(self, return_format="html"):
         self.__returnFormatDefault = return_format
@@ -219,7 +298,8 @@ class InputRequest(WebRequest):
         return self._getStringValue("sessionid")
 
     def getSessionPath(self):
-        return SessionManager(topPath=self._getStringValue("TopSessionPath")).getSessionsPath()
+        """Return the directory containing the session directory for the current session id."""
+        return self.getSessionObj().getParentPath()
 
     def getTopSessionPath(self):
         return self._getStringValue("TopSessionPath")
@@ -227,37 +307,215 @@ class InputRequest(WebRequest):
     def getSemaphore(self):
         return self._getStringValue("semaphore")
 
-    def getSessionObj(self):
+    def __makeSessionObj(self):
+        """Session manager for the request -- the storage layout (shardDepth), identifier generator (idType,
+        default random), usage ledger (trackUsage) and session quotas in bytes (quotaSoft, quotaHard) are
+        taken only from the application session configuration (see setSessionConfig()).
+        """
+        kwD = dict(self.__sessionConfig)
         if self.exists("TopSessionPath"):
-            sObj = SessionManager(topPath=self._getStringValue("TopSessionPath"))
-        else:
-            sObj = SessionManager()
+            return SessionManager(topPath=self._getStringValue("TopSessionPath"), **kwD)
+        return SessionManager(**kwD)
+
+    def getSessionObj(self):
+        sObj = self.__makeSessionObj()
         sObj.setId(uid=self._getStringValue("sessionid"))
+        # the session access marker is updated once per request
+        if not self.__sessionTouched:
+            self.__sessionTouched = sObj.touchAccess()
         return sObj
 
     def newSessionObj(self, forceNew=False):
-        if self.exists("TopSessionPath"):
-            sObj = SessionManager(topPath=self._getStringValue("TopSessionPath"))
-        else:
-            sObj = SessionManager()
+        sObj = self.__makeSessionObj()
 
         sessionId = self._getStringValue("sessionid")
 
-        if forceNew:
+        if forceNew or len(sessionId) < 1:
             sObj.assignId()
-            sObj.makeSessionPath()
+            # a new identifier must not join an existing session directory -
+            sObj.makeSessionPath(exclusive=True)
             self.setValue("sessionid", sObj.getId())
-        elif len(sessionId) > 0:
-            sObj.setId(sessionId)
-            sObj.makeSessionPath()
         else:
-            sObj.assignId()
+            sObj.setId(sessionId)
             sObj.makeSessionPath()
-            self.setValue("sessionid", sObj.getId())
 
         return sObj
 
 
+def parseByteRanges(rangeSpec, fileSize, maxRanges=16):
+    """Parse an HTTP Range header value (e.g. 'bytes=0-499,1000-') for a file of fileSize bytes.
+
+    Returns:
+        list of (first, last) inclusive byte positions sorted with overlapping and adjacent
+        ranges merged, an empty list if no range is satisfiable, or None if the specification
+        is absent or invalid or has more than maxRanges ranges (the whole file should be sent).
+    """
+    if not rangeSpec:
+        return None
+    unit, _sep, spec = rangeSpec.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+    rL = []
+    specL = spec.split(",")
+    if len(specL) > maxRanges:
+        return None
+    for rs in specL:
+        first, sep, last = rs.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if not first:
+                # suffix range - the last N bytes
+                nBytes = int(last)
+                if nBytes <= 0:
+                    continue
+                rL.append((max(fileSize - nBytes, 0), fileSize - 1))
+                continue
+            first = int(first)
+            last = int(last) if last else None
+        except ValueError:
+            return None
+        if first < 0 or (last is not None and last < first):
+            return None
+        if last is None:
+            last = fileSize - 1
+        if first < fileSize:
+            rL.append((first, min(last, fileSize - 1)))
+    rL.sort()
+    mL = []
+    for first, last in rL:
+        if mL and first <= mL[-1][1] + 1:
+            mL[-1] = (mL[-1][0], max(mL[-1][1], last))
+        else:
+            mL.append((first, last))
+    return mL
+
+
+def getGzipContentSize(filePath):
+    """Return the uncompressed size of a gzip file without decompressing it, or None if it is not known.
+
+    The size is the sum of the ISIZE trailers of the gzip members.  This requires the compressed length
+    of each member, which is recorded in the BC extra field of blocked gzip (BGZF) files.  For other
+    files the number of members is not known and ISIZE holds the member size modulo 2**32, so None
+    is returned.
+    """
+    try:
+        with open(filePath, "rb") as fb:
+            fileSize = os.fstat(fb.fileno()).st_size
+            position = 0
+            nBytes = 0
+            while position < fileSize:
+                fb.seek(position)
+                head = fb.read(12)
+                if len(head) < 12 or head[:3] != b"\x1f\x8b\x08" or not head[3] & 0x04:
+                    return None
+                (xLen,) = struct.unpack("<H", head[10:12])
+                extra = fb.read(xLen)
+                blockSize = None
+                ii = 0
+                while ii + 4 <= len(extra):
+                    (subLen,) = struct.unpack("<H", extra[ii + 2 : ii + 4])
+                    if extra[ii : ii + 2] == b"BC" and subLen == 2:
+                        (blockSize,) = struct.unpack("<H", extra[ii + 4 : ii + 6])
+                    ii += 4 + subLen
+                if blockSize is None:
+                    return None
+                position += blockSize + 1
+                fb.seek(position - 4)
+                trailer = fb.read(4)
+                if len(trailer) < 4:
+                    return None
+                nBytes += struct.unpack("<I", trailer)[0]
+            return nBytes
+    except (OSError, struct.error):
+        return None
+
+
+def acceptsEncoding(acceptEncoding, coding):
+    """Return True if the HTTP Accept-Encoding header value acceptEncoding accepts the content coding.
+
+    An absent header is treated as accepting only the identity coding.
+    """
+    if not acceptEncoding:
+        return coding == "identity"
+    qD = {}
+    for item in acceptEncoding.split(","):
+        name, _sep, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _sep, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qD["gzip" if name == "x-gzip" else name] = q
+    if coding in qD:
+        return qD[coding] > 0.0
+    if "*" in qD:
+        return qD["*"] > 0.0
+    return coding == "identity"
+
+
+def getFileValidators(st, variant=None):
+    """Return the (ETag, Last-Modified) header values for a file from its os.stat() result st.
+
+    The entity tag is built from the inode, size and modification time.  variant distinguishes
+    representations derived from the same file -- the content coding (e.g. 'gzip' for a stored .gz
+    file or content compressed on the fly) or 'uncompress'.
+    """
+    tag = "%x-%x-%x" % (st.st_ino, st.st_size, st.st_mtime_ns)
+    if variant:
+        tag = "%s-%s" % (tag, variant)
+    return '"%s"' % tag, email.utils.formatdate(st.st_mtime, usegmt=True)
+
+
+def matchesETag(ifNoneMatch, etag):
+    """Return True if the If-None-Match (or If-Match) header value matches etag (weak comparison)."""
+    if ifNoneMatch.strip() == "*":
+        return True
+    # compare the quoted opaque tags ignoring any weak indicator W/
+    opaqueTag = etag.partition('"')[2]
+    return any(tag.partition('"')[2] == opaqueTag for tag in ifNoneMatch.split(","))
+
+
+def getCompressionCodings():
+    """Return the content codings available for on-the-fly compression in order of preference."""
+    codingL = []
+    if zstandard is not None:
+        codingL.append("zstd")
+    if brotli is not None:
+        codingL.append("br")
+    codingL.append("gzip")
+    return codingL
+
+
+class _BrotliEncoder:
+    def __init__(self, level):
+        self.__encoder = brotli.Compressor(quality=min(max(level, 0), 11))
+
+    def compress(self, data):
+        return self.__encoder.process(bytes(data))
+
+    def flush(self):
+        return self.__encoder.finish()
+
+
+def _makeEncoder(coding, level):
+    """Streaming encoder with compress(data) and flush() methods for the content coding."""
+    if coding == "gzip":
+        # wbits 16 + 15 writes the gzip header and trailer
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if coding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    if coding == "br" and brotli is not None:
+        return _BrotliEncoder(level)
+    raise ValueError("Unsupported content coding %r" % coding)
+
+
 class FileIterator:
     """File iterator for reading big files
     in chunks.
@@ -265,12 +523,35 @@ class FileIterator:
     Attributes:
         filePath (str): path of file
         fileName (str): name of file
-        fileSize (int): size in bytes of file
+        fileSize (int): number of bytes returned by the iterator -- the size of the file or of the byte range.
+            None if the uncompressed size of a gzip file is not known (see getGzipContentSize()).
+        offset (int): starting byte position within the file
+        chunkSize (int): number of bytes read per chunk (see getChunkSize())
+        zeroCopy (bool): the content is a plain file region which may be sent with os.sendfile()
+            (fileno(), offset and fileSize) or wsgi.file_wrapper
+
+    The iterator is also a file-like object (read(), fileno(), close()) bounded to the byte range
+    for use with wsgi.file_wrapper.  Iteration returns bytes chunks as required for a WSGI response
+    body -- iterViews() reads through a single reused buffer for internal copies.  Read statistics
+    are returned by getStats().
     """
 
     CHUNK_SIZE = 8 * 1024 * 1024
-
-    def __init__(self, filePath, fileSize, uncompress=False):
+    MIN_CHUNK_SIZE = 64 * 1024
+    # number of chunks read ahead by the prefetch thread
+    PREFETCH_DEPTH = 2
+
+    def __init__(
+        self,
+        filePath,
+        fileSize,
+        uncompress=False,
+        offset=0,
+        length=None,
+        chunkSize=None,
+        maxChunkSize=None,
+        prefetch=False,
+    ):
         """Opens the given file for reading.
 
         Args:
@@ -278,38 +559,552 @@ class FileIterator:
             fileSize (int): size in bytes of file
             uncompress (bool, optional): indicates if the file should be
             read uncompressed. Defaults to False.
+            offset (int, optional): byte position at which to start reading. Defaults to 0.
+            length (int, optional): number of bytes to read from offset. Defaults to the
+            remainder of the file.
+            chunkSize (int, optional): fixed number of bytes per chunk. Defaults to a size
+            chosen from the content size (see getChunkSize()).
+            maxChunkSize (int, optional): largest chunk size chosen. Defaults to CHUNK_SIZE.
+            prefetch (bool, optional): read the next chunks on a background thread while the
+            current chunk is being sent. Defaults to False.
         """
         self.filePath = filePath
         self.fileName = os.path.basename(self.filePath)
         self.fileSize = fileSize or os.path.getsize(filePath)
+        self.offset = offset
+        self.zeroCopy = not uncompress
+        self.__buffer = None
+        self.__prefetch = prefetch
+        self.__queue = None
+        self.__thread = None
+        self.__stopEvent = None
+        self.__bytesRead = 0
+        self.__readTime = 0.0
+        self.__startTime = None
+        self.__endTime = None
 
         if uncompress:
             self.fp = gzip.open(self.filePath, "rb")
 
-            # the file size will be different when uncompressing
-            self.fp.seek(0, io.SEEK_END)
-            self.fileSize = self.fp.tell()
-            self.fp.seek(0)
+            # the file size will be different when uncompressing - and is not known for most gzip files
+            self.fileSize = getGzipContentSize(self.filePath)
         else:
-            self.fp = open(filePath, "rb")
+            # unbuffered - chunks are read directly into the returned object or the reused buffer
+            self.fp = open(filePath, "rb", buffering=0)
+
+        if offset:
+            self.fp.seek(offset)
+        if length is None and self.fileSize is not None:
+            length = self.fileSize - offset
+        self.fileSize = length
+        # bytes left to read -- None when reading to the end of a file of unknown size
+        self.__remaining = length
+        self.chunkSize = chunkSize or self.getChunkSize(length, maxChunkSize=maxChunkSize)
+        if not uncompress:
+            self.__adviseSequential(offset, length)
+
+    @classmethod
+    def getChunkSize(cls, contentSize, maxChunkSize=None):
+        """Return the chunk size for contentSize bytes -- about an eighth of the content rounded up to
+        a power of two, between MIN_CHUNK_SIZE and maxChunkSize (default CHUNK_SIZE).
+        """
+        maxChunkSize = maxChunkSize or cls.CHUNK_SIZE
+        if contentSize is None:
+            return maxChunkSize
+        chunkSize = cls.MIN_CHUNK_SIZE
+        while chunkSize * 8 < contentSize and chunkSize < maxChunkSize:
+            chunkSize *= 2
+        return max(cls.MIN_CHUNK_SIZE, min(chunkSize, maxChunkSize))
+
+    def __adviseSequential(self, offset, length):
+        """Hint sequential access for the byte range and start read-ahead of the first chunk."""
+        if not hasattr(os, "posix_fadvise"):  # pragma: no cover
+            return
+        try:
+            fd = self.fp.fileno()
+            os.posix_fadvise(fd, offset, length or 0, os.POSIX_FADV_SEQUENTIAL)
+            os.posix_fadvise(fd, offset, self.__getReadSize(self.chunkSize), os.POSIX_FADV_WILLNEED)
+        except OSError:  # pragma: no cover
+            pass
 
     def __iter__(self):
         return self
 
     def next(self):
-        chunk = self.fp.read(self.CHUNK_SIZE)
+        if self.__prefetch:
+            chunk = self.__nextPrefetched()
+        else:
+            chunk = self.read(self.chunkSize)
 
         if not chunk:
-            self.fp.close()
+            self.close()
             raise StopIteration
 
         return chunk
 
     __next__ = next
 
+    def __getReadSize(self, size):
+        if self.__remaining is None:
+            return size
+        return min(size, self.__remaining)
+
+    def __timeRead(self, readFn, arg):
+        tS = time.perf_counter()
+        if self.__startTime is None:
+            self.__startTime = tS
+        ret = readFn(arg)
+        self.__readTime += time.perf_counter() - tS
+        return ret
+
+    def __readInto(self, view):
+        nBytes = self.__timeRead(self.fp.readinto, view)
+        self.__bytesRead += nBytes
+        if self.__remaining is not None:
+            self.__remaining -= nBytes
+        return nBytes
+
+    def read(self, size=-1):
+        """Read up to size bytes of the remaining byte range."""
+        if self.__remaining is not None and self.__remaining <= 0:
+            return b""
+        if size is None or size < 0:
+            size = self.__remaining if self.__remaining is not None else -1
+        chunk = self.__timeRead(self.fp.read, self.__getReadSize(size) if size >= 0 else -1)
+        self.__bytesRead += len(chunk)
+        if self.__remaining is not None:
+            self.__remaining -= len(chunk)
+        return chunk
+
+    def iterViews(self):
+        """Yield the remaining byte range as memoryview slices of a single buffer reused for every read.
+
+        Each view is overwritten by the following read and must be consumed before the next is
+        requested -- for internal copies only, not as a WSGI response body.  Not combined with
+        iteration of the FileIterator.
+        """
+        try:
+            if self.__buffer is None:
+                self.__buffer = memoryview(bytearray(self.__getReadSize(self.chunkSize) or 1))
+            while self.__remaining != 0:
+                nBytes = self.__readInto(self.__buffer[: self.__getReadSize(len(self.__buffer))])
+                if not nBytes:
+                    break
+                yield self.__buffer[:nBytes]
+        finally:
+            self.close()
+
+    def __nextPrefetched(self):
+        if self.__thread is None:
+            self.__queue = queue.Queue(maxsize=self.PREFETCH_DEPTH)
+            self.__stopEvent = threading.Event()
+            self.__thread = threading.Thread(
+                target=self.__prefetchChunks,
+                args=(weakref.ref(self), self.__queue, self.__stopEvent),
+                name="FileIterator-prefetch",
+                daemon=True,
+            )
+            # stops the thread if the iterator is discarded without close()
+            weakref.finalize(self, self.__stopEvent.set)
+            self.__thread.start()
+        chunk = self.__queue.get()
+        if isinstance(chunk, Exception):
+            raise chunk
+        return chunk
+
+    @staticmethod
+    def __prefetchChunks(iterRef, chunkQueue, stopEvent):
+        """Read chunks into chunkQueue until the end of the content (b''), close() or the iterator is discarded.
+
+        The iterator is only referenced during a read so that it can be finalized while the queue is full.
+        """
+        chunk = None
+        while chunk != b"" and not stopEvent.is_set():
+            fI = iterRef()
+            if fI is None:
+                return
+            try:
+                chunk = fI.read(fI.chunkSize)
+            except Exception as e:  # noqa: BLE001
+                chunk = b""
+                # the traceback would hold the iterator
+                FileIterator.__putChunk(chunkQueue, stopEvent, e.with_traceback(None))
+            del fI
+            FileIterator.__putChunk(chunkQueue, stopEvent, chunk)
+
+    @staticmethod
+    def __putChunk(chunkQueue, stopEvent, chunk):
+        while not stopEvent.is_set():
+            try:
+                chunkQueue.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def getStats(self):
+        """Return the read statistics -- bytes read, chunk size, time spent reading and the
+        elapsed time (seconds) and throughput (bytes/second) from the first read to the end or now.
+        """
+        if self.__startTime is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self.__endTime or time.perf_counter()) - self.__startTime
+        return {
+            "bytes": self.__bytesRead,
+            "chunkSize": self.chunkSize,
+            "prefetch": self.__prefetch,
+            "readSeconds": self.__readTime,
+            "elapsedSeconds": elapsed,
+            "throughput": self.__bytesRead / elapsed if elapsed > 0 else None,
+        }
+
+    def fileno(self):
+        return self.fp.fileno()
+
+    def close(self):
+        if self.__thread is not None:
+            self.__stopEvent.set()
+            self.__thread.join()
+            self.__thread = None
+        if self.__startTime is not None and self.__endTime is None:
+            self.__endTime = time.perf_counter()
+        self.fp.close()
+
+    def sendfile(self, outFd):
+        """Copy the remaining byte range to the file descriptor outFd with os.sendfile() --
+        falls back to copying through a reused buffer.  Returns the number of bytes written.
+        """
+        nSent = 0
+        self.__startTime = time.perf_counter()
+        try:
+            if self.zeroCopy and hasattr(os, "sendfile"):
+                position = self.fp.tell()
+                try:
+                    while self.__remaining > 0:
+                        nBytes = os.sendfile(outFd, self.fp.fileno(), position, min(self.__remaining, 0x7FFFF000))
+                        if nBytes == 0:
+                            break
+                        position += nBytes
+                        nSent += nBytes
+                        self.__bytesRead += nBytes
+                        self.__remaining -= nBytes
+                    return nSent
+                except OSError:
+                    # e.g. file system or descriptor not supported - copy the remainder
+                    self.fp.seek(position)
+            for view in self.iterViews():
+                nSent += len(view)
+                while view:
+                    view = view[os.write(outFd, view) :]
+            return nSent
+        finally:
+            self.close()
+
+
+def getWsgiFileIterable(rspDict, environ, blockSize=None):
+    """Return the response body iterable for the FILE_ITERATOR in rspDict -- plain file content is passed
+    to the server's wsgi.file_wrapper (which may use sendfile) when the server provides one.
+    blockSize defaults to the chunk size of the iterator.
+    """
+    fI = rspDict["FILE_ITERATOR"]
+    if blockSize is None:
+        blockSize = getattr(fI, "chunkSize", FileIterator.CHUNK_SIZE)
+    if getattr(fI, "zeroCopy", False) and "wsgi.file_wrapper" in environ:
+        return environ["wsgi.file_wrapper"](fI, blockSize)
+    return fI
+
+
+class CompressingIterator:
+    """Iterator compressing the chunks of another iterator (e.g. a FileIterator) with a streaming encoder.
+
+    Attributes:
+        fileName (str): name of file
+        fileSize (None): the compressed size is not known in advance
+        coding (str): content coding -- 'gzip', 'zstd' or 'br'
+        bytesIn (int): number of bytes read from the source iterator
+        bytesOut (int): number of compressed bytes returned
+    """
+
+    def __init__(self, source, coding="gzip", level=6):
+        self.fileName = getattr(source, "fileName", None)
+        self.fileSize = None
+        self.coding = coding
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.__source = source
+        self.__encoder = _makeEncoder(coding, level)
+        self.__chunks = self.__generate()
+
+    def __generate(self):
+        for chunk in self.__source:
+            self.bytesIn += len(chunk)
+            data = self.__encoder.compress(chunk)
+            if data:
+                self.bytesOut += len(data)
+                yield data
+        data = self.__encoder.flush()
+        self.bytesOut += len(data)
+        if data:
+            yield data
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return next(self.__chunks)
+
+    __next__ = next
+
+    def close(self):
+        self.__chunks.close()
+        if hasattr(self.__source, "close"):
+            self.__source.close()
+
+
+class TextStreamIterator:
+    """Iterator over the encoded pieces of a text response -- a prefix, the file content and a suffix.
+
+    The file is read in chunks of chunkSize so memory use does not depend on the file size.  With
+    escapeJson the content is sent as a JSON string (quoted and escaped chunk by chunk).
+
+    Attributes:
+        fileName (str): name of file
+        fileSize (int): number of bytes returned or None if not known in advance (escapeJson)
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, filePath, prefix="", suffix="", escapeJson=False, chunkSize=None):
+        self.filePath = filePath
+        self.fileName = os.path.basename(filePath)
+        self.__prefix = prefix.encode("utf-8")
+        self.__suffix = suffix.encode("utf-8")
+        self.__escapeJson = escapeJson
+        self.__chunkSize = chunkSize or self.CHUNK_SIZE
+        self.fileSize = None
+        if not escapeJson:
+            self.fileSize = len(self.__prefix) + os.path.getsize(filePath) + len(self.__suffix)
+        self.__chunks = self.__generate()
+
+    def __generate(self):
+        if self.__prefix:
+            yield self.__prefix
+        if self.__escapeJson:
+            yield b'"'
+            with open(self.filePath, encoding="utf-8", errors="replace") as fin:
+                for chunk in iter(lambda: fin.read(self.__chunkSize), ""):
+                    # complete characters are escaped independently - the quotes are stripped
+                    yield dumps(chunk)[1:-1].encode("ascii")
+            yield b'"'
+        else:
+            with open(self.filePath, "rb") as fin:
+                yield from iter(lambda: fin.read(self.__chunkSize), b"")
+        if self.__suffix:
+            yield self.__suffix
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return next(self.__chunks)
+
+    __next__ = next
+
+    def close(self):
+        self.__chunks.close()
+
+
+class ByteRangesIterator:
+    """Iterator over a multipart/byteranges body for several byte ranges of a file.
+
+    Attributes:
+        fileName (str): name of file
+        fileSize (int): number of bytes in the multipart body
+        boundary (str): multipart boundary string
+    """
+
+    def __init__(self, filePath, fileSize, rangeList, contentType):
+        """
+        Args:
+            filePath (str): path of file
+            fileSize (int): size in bytes of file
+            rangeList (list): (first, last) inclusive byte positions
+            contentType (str): content type of each part
+        """
+        self.filePath = filePath
+        self.fileName = os.path.basename(filePath)
+        self.boundary = secrets.token_hex(16)
+        self.__partL = []
+        nBytes = 0
+        for first, last in rangeList:
+            head = "--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n" % (self.boundary, contentType, first, last, fileSize)
+            head = head.encode("ascii")
+            self.__partL.append((head, first, last - first + 1))
+            nBytes += len(head) + last - first + 1 + 2
+        self.__tail = ("--%s--\r\n" % self.boundary).encode("ascii")
+        self.fileSize = nBytes + len(self.__tail)
+        self.__chunks = self.__generate()
+
+    def __generate(self):
+        for head, offset, length in self.__partL:
+            yield head
+            yield from FileIterator(self.filePath, None, offset=offset, length=length)
+            yield b"\r\n"
+        yield self.__tail
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return next(self.__chunks)
+
+    __next__ = next
+
+    def close(self):
+        self.__chunks.close()
+
+
+# archive format -> (content type, file extension)
+_ARCHIVE_FORMATS = {
+    "zip": ("application/zip", ".zip"),
+    "tar": ("application/x-tar", ".tar"),
+    "tgz": ("application/gzip", ".tar.gz"),
+}
+
+
+class _ArchiveBuffer:
+    """Write-only stream collecting the output of an archive writer until it is drained."""
+
+    def __init__(self):
+        self.__chunkL = []
+
+    def write(self, data):
+        self.__chunkL.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunkL, self.__chunkL = self.__chunkL, []
+        return chunkL
+
+
+class ArchiveIterator:
+    """Iterator streaming a ZIP or tar archive of a list of files without a temporary file.
+
+    Memory use is bounded by the read chunk size.  Files with an extension in
+    ResponseContent.COMPRESSED_EXTENSIONS are stored in ZIP archives, others are deflated.
+
+    Attributes:
+        fileName (str): archive name
+        fileSize (int): size of the archive -- known in advance only for the 'tar' format, otherwise None
+        archiveFormat (str): 'zip', 'tar' or 'tgz' (gzip compressed tar)
+        contentType (str): content type of the archive format
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, filePathList, archiveName="files", archiveFormat="zip", level=6):
+        """Args:
+        filePathList (list): file paths or (file path, name in archive) tuples -- names default to the file name
+        archiveName (str): archive name, the format extension is added if missing
+        archiveFormat (str): 'zip', 'tar' or 'tgz'
+        level (int): compression level for tgz
+        """
+        if archiveFormat not in _ARCHIVE_FORMATS:
+            raise ValueError("Unsupported archive format %r" % archiveFormat)
+        self.archiveFormat = archiveFormat
+        self.contentType, ext = _ARCHIVE_FORMATS[archiveFormat]
+        self.fileName = archiveName if archiveName.endswith(ext) else archiveName + ext
+        self.__entryL = []
+        pathSet = set()
+        for entry in filePathList:
+            filePath, arcName = entry if isinstance(entry, tuple) else (entry, os.path.basename(entry))
+            if filePath not in pathSet:
+                pathSet.add(filePath)
+                self.__entryL.append((filePath, arcName))
+        self.fileSize = None
+        if archiveFormat == "zip":
+            self.__chunks = self.__generateZip()
+        else:
+            headerL = [self.__makeTarHeader(filePath, arcName) for filePath, arcName in self.__entryL]
+            if archiveFormat == "tar":
+                self.fileSize = self.__getTarSize(headerL)
+                self.__chunks = self.__generateTar(headerL)
+            else:
+                self.__chunks = iter(CompressingIterator(self.__generateTar(headerL), coding="gzip", level=level))
+
+    def __generateZip(self):
+        buf = _ArchiveBuffer()
+        with zipfile.ZipFile(buf, "w", allowZip64=True) as zf:
+            for filePath, arcName in self.__entryL:
+                zinfo = zipfile.ZipInfo.from_file(filePath, arcName)
+                if filePath.lower().endswith(ResponseContent.COMPRESSED_EXTENSIONS):
+                    zinfo.compress_type = zipfile.ZIP_STORED
+                else:
+                    zinfo.compress_type = zipfile.ZIP_DEFLATED
+                with open(filePath, "rb") as fin, zf.open(zinfo, "w") as fout:
+                    chunk = fin.read(self.CHUNK_SIZE)
+                    while chunk:
+                        fout.write(chunk)
+                        yield from buf.drain()
+                        chunk = fin.read(self.CHUNK_SIZE)
+                yield from buf.drain()
+        yield from buf.drain()
+
+    @staticmethod
+    def __makeTarHeader(filePath, arcName):
+        st = os.stat(filePath)
+        tarInfo = tarfile.TarInfo(arcName)
+        tarInfo.size = st.st_size
+        tarInfo.mtime = int(st.st_mtime)
+        tarInfo.mode = st.st_mode & 0o777
+        return tarInfo.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape"), st.st_size
+
+    @staticmethod
+    def __getTarEnd(nBytes):
+        # two zero blocks then padding to a multiple of the record size (as written by tarfile)
+        nBytes += 2 * tarfile.BLOCKSIZE
+        return b"\0" * (2 * tarfile.BLOCKSIZE + (-nBytes % tarfile.RECORDSIZE))
+
+    def __getTarSize(self, headerL):
+        nBytes = sum(len(header) + size + (-size % tarfile.BLOCKSIZE) for header, size in headerL)
+        return nBytes + len(self.__getTarEnd(nBytes))
+
+    def __generateTar(self, headerL):
+        nBytes = 0
+        for (filePath, _arcName), (header, size) in zip(self.__entryL, headerL):
+            yield header
+            nRead = 0
+            for chunk in FileIterator(filePath, None, length=size, chunkSize=self.CHUNK_SIZE):
+                nRead += len(chunk)
+                yield chunk
+            # pad a file truncated since the header was made - and the last block of the file
+            yield b"\0" * (size - nRead + (-size % tarfile.BLOCKSIZE))
+            nBytes += len(header) + size + (-size % tarfile.BLOCKSIZE)
+        yield self.__getTarEnd(nBytes)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return next(self.__chunks)
+
+    __next__ = next
+
+    def close(self):
+        if hasattr(self.__chunks, "close"):
+            self.__chunks.close()
+
 
 class ResponseContent:
     MULTIPART_THRESHOLD = 8 * 1024 * 1024  # file size threshold to send file in chunks, 8mb
+    COMPRESS_MIN_SIZE = 256 * 1024  # smallest file compressed on the fly
+    COMPRESS_MAX_SIZE = 256 * 1024 * 1024  # largest file compressed on the fly
+    COMPRESS_LEVEL = 6
+    # file extensions of content which is not compressed on the fly
+    COMPRESSED_EXTENSIONS = (".gz", ".bz2", ".xz", ".zip", ".zst", ".br", ".tgz", ".png", ".jpg", ".jpeg", ".gif", ".pdf")
 
     def __init__(self, reqObj=None, verbose=False, log=sys.stderr):
         """
@@ -402,18 +1197,34 @@ class ResponseContent:
         for k, v in cD.items():
             self._cD[k] = v
 
-    def setTextFile(self, filePath):
+    def setTextFile(self, filePath, stream=False):
+        """Set the text content from filePath -- if stream, the file is sent in chunks of
+        TextStreamIterator.CHUNK_SIZE rather than read into memory.
+        """
         try:
-            if os.path.exists(filePath):
-                self._readFile(filePath, dataContent="textcontent")
+            if os.path.exists(filePath) and not self.__checkNotModified(filePath):
+                if stream:
+                    self._cD["fileiterator"] = TextStreamIterator(filePath)
+                else:
+                    self._readFile(filePath, dataContent="textcontent")
         except Exception as e:  # noqa: BLE001
             self.__lfh.write("+setTextFile() File read failed %s %s\n" % (filePath, str(e)))
             traceback.print_exc(file=self.__lfh)
 
-    def setTextFileO(self, filePath):
+    def setTextFileO(self, filePath, stream=False):
+        if stream:
+            self._cD["fileiterator"] = TextStreamIterator(filePath)
+            return
         with open(filePath) as fin:
             self._cD["textcontent"] = fin.read()
 
+    def setJsonDataFile(self, filePath):
+        """Set the content for return format jsonData from filePath, streamed in chunks --
+        .json files are sent unchanged and other files as a JSON string.
+        """
+        isJson = os.path.splitext(filePath)[1].lower() == ".json"
+        self._cD["datacontent"] = TextStreamIterator(filePath, escapeJson=not isJson)
+
     @staticmethod
     def getMimetypeAndEncoding(filename):
         mtype, encoding = mimetypes.guess_type(filename)
@@ -427,34 +1238,204 @@ class ResponseContent:
             ret = (mtype, encoding)
         return ret
 
-    def _readFile(self, filePath, uncompress=False, dataContent="datacontent"):
+    def _readFile(self, filePath, uncompress=False, dataContent="datacontent", offset=0, length=None):
         fileSize = os.path.getsize(filePath)
-        if fileSize > ResponseContent.MULTIPART_THRESHOLD:
+        nBytes = fileSize - offset if length is None else length
+        if uncompress and nBytes <= ResponseContent.MULTIPART_THRESHOLD:
+            # small compressed files are read into memory if the uncompressed content is also small
+            with gzip.open(filePath, "rb") as fin:
+                data = fin.read(ResponseContent.MULTIPART_THRESHOLD + 1)
+            if len(data) <= ResponseContent.MULTIPART_THRESHOLD:
+                self._cD[dataContent] = data
+                return
+            nBytes = len(data)
+        if nBytes > ResponseContent.MULTIPART_THRESHOLD:
             self.__lfh.write("+ResponseContent._readFile() File too big (%s), sending as multipart\n" % (fileSize))
-            self._cD["fileiterator"] = FileIterator(filePath, fileSize, uncompress=uncompress)
+            self._cD["fileiterator"] = FileIterator(
+                filePath, fileSize, uncompress=uncompress, offset=offset, length=length, **self.__getFileIteratorOptions()
+            )
             self._cD["disposition"] = "attachment"
             self._cD["datafileName"] = self._cD["fileiterator"].fileName
         else:
             with open(filePath, "rb") as fin:
-                self._cD[dataContent] = fin.read()
+                fin.seek(offset)
+                self._cD[dataContent] = fin.read(nBytes)
 
-    def setBinaryFile(self, filePath, attachmentFlag=False, serveCompressed=True):
+    def __getFileIteratorOptions(self):
+        """Return the FileIterator chunk size and prefetch options from the request parameters
+        "ResponseChunkSize", "ResponseMaxChunkSize" and "ResponsePrefetch".
+        """
+        optD = {}
+        if self.__reqObj is None:
+            return optD
+        for ky, opt in [("ResponseChunkSize", "chunkSize"), ("ResponseMaxChunkSize", "maxChunkSize")]:
+            value = self.__reqObj.getValue(ky)
+            if value:
+                optD[opt] = int(value)
+        if self.__reqObj.getValue("ResponsePrefetch").lower() in ["true", "yes", "y", "1"]:
+            optD["prefetch"] = True
+        return optD
+
+    def __getRequestHeader(self, key, value):
+        """Return value or, if None, the request parameter key (e.g. HTTP_RANGE)."""
+        if value is None and self.__reqObj is not None:
+            value = self.__reqObj.getValue(key)
+        return value
+
+    def __checkNotModified(self, filePath, variant=None):
+        """Set the validators for filePath and, if the conditional request headers (request parameters
+        "HTTP_IF_NONE_MATCH" or "HTTP_IF_MODIFIED_SINCE") match, a 304 Not Modified response.
+
+        Returns True for a 304 response -- the file need not be read.
+        """
+        st = os.stat(filePath)
+        etag, lastModified = getFileValidators(st, variant)
+        self._cD["etag"] = etag
+        self._cD["lastmodified"] = lastModified
+        ifNoneMatch = self.__getRequestHeader("HTTP_IF_NONE_MATCH", None)
+        ifModifiedSince = self.__getRequestHeader("HTTP_IF_MODIFIED_SINCE", None)
+        notModified = False
+        if ifNoneMatch:
+            notModified = matchesETag(ifNoneMatch, etag)
+        elif ifModifiedSince:
+            try:
+                tModified = email.utils.parsedate_to_datetime(ifModifiedSince)
+                if tModified.tzinfo is None:
+                    # HTTP dates are always UTC -- e.g. a -0000 zone or an asctime date
+                    tModified = tModified.replace(tzinfo=timezone.utc)  # noqa: UP017
+                notModified = int(st.st_mtime) <= tModified.timestamp()
+            except (TypeError, ValueError, IndexError):
+                notModified = False
+        if notModified:
+            self._cD["httpstatus"] = 304
+            self._cD["datacontent"] = b""
+            self._cD["textcontent"] = ""
+        return notModified
+
+    def __readFileRanges(self, filePath, rangeSpec, contentType):
+        """Set up a partial content (206) response for the byte ranges in rangeSpec.
+
+        Returns False if the whole file should be sent.
+        """
+        fileSize = os.path.getsize(filePath)
+        self._cD["acceptranges"] = "bytes"
+        ifRange = self.__getRequestHeader("HTTP_IF_RANGE", None)
+        if ifRange and ifRange not in (self._cD.get("etag"), self._cD.get("lastmodified")):
+            # the client copy is out of date - send the whole file
+            return False
+        rangeList = parseByteRanges(rangeSpec, fileSize)
+        if rangeList is None:
+            return False
+        if not rangeList:
+            self._cD["httpstatus"] = 416
+            self._cD["contentrange"] = "bytes */%d" % fileSize
+            self._cD["datacontent"] = b""
+            self._cD["contentlength"] = 0
+            return True
+        self._cD["httpstatus"] = 206
+        if len(rangeList) == 1:
+            first, last = rangeList[0]
+            self._readFile(filePath, offset=first, length=last - first + 1)
+            self._cD["contentrange"] = "bytes %d-%d/%d" % (first, last, fileSize)
+            self._cD["contentlength"] = last - first + 1
+        else:
+            self._cD["fileiterator"] = ByteRangesIterator(filePath, fileSize, rangeList, contentType)
+            self._cD["multipartboundary"] = self._cD["fileiterator"].boundary
+            self._cD["contentlength"] = self._cD["fileiterator"].fileSize
+        return True
+
+    def __getCompressCoding(self, filePath, acceptEncoding, rangeSpec):
+        """Select the content coding for on-the-fly compression of filePath or None."""
+        if rangeSpec or filePath.lower().endswith(self.COMPRESSED_EXTENSIONS):
+            return None
+        minSize = self.COMPRESS_MIN_SIZE
+        maxSize = self.COMPRESS_MAX_SIZE
+        if self.__reqObj is not None:
+            minSize = int(self.__reqObj.getValueOrDefault("ResponseCompressMinSize", default=minSize))
+            maxSize = int(self.__reqObj.getValueOrDefault("ResponseCompressMaxSize", default=maxSize))
+        if not minSize <= os.path.getsize(filePath) <= maxSize:
+            return None
+        for coding in getCompressionCodings():
+            if acceptsEncoding(acceptEncoding, coding):
+                return coding
+        return None
+
+    def __readFileCompressed(self, filePath, coding):
+        level = self.COMPRESS_LEVEL
+        if self.__reqObj is not None:
+            level = int(self.__reqObj.getValueOrDefault("ResponseCompressLevel", default=level))
+        fileSize = os.path.getsize(filePath)
+        cI = CompressingIterator(FileIterator(filePath, fileSize, **self.__getFileIteratorOptions()), coding=coding, level=level)
+        if fileSize > ResponseContent.MULTIPART_THRESHOLD:
+            self._cD["fileiterator"] = cI
+            self._cD["disposition"] = "attachment"
+        else:
+            self._cD["datacontent"] = b"".join(cI)
+
+    def setBinaryFile(
+        self, filePath, attachmentFlag=False, serveCompressed=True, rangeSpec=None, acceptEncoding=None, compress=False
+    ):
+        """Serve the file as binary content.
+
+        rangeSpec is an HTTP Range header value (defaults to the request parameter "HTTP_RANGE").
+        Byte ranges are served with status 206, single ranges as the file slice and multiple
+        ranges as a multipart/byteranges body.  Ranges are ignored for files uncompressed on the server.
+
+        If serveCompressed is False, .gz files are served as the uncompressed content.  When the
+        client accepts gzip (acceptEncoding, defaulting to the request parameter "HTTP_ACCEPT_ENCODING")
+        the stored bytes are sent unchanged with encoding gzip (Content-Encoding), otherwise the
+        file is uncompressed on the server.
+
+        If compress is set, other files of COMPRESS_MIN_SIZE to COMPRESS_MAX_SIZE bytes (request
+        parameters "ResponseCompressMinSize" and "ResponseCompressMaxSize") are compressed on the fly with the preferred content coding
+        accepted by the client (see getCompressionCodings()) at level COMPRESS_LEVEL (request
+        parameter "ResponseCompressLevel").  Files larger than MULTIPART_THRESHOLD are compressed
+        chunk by chunk while streaming and have no declared length.
+
+        ETag and Last-Modified validators are set from the file status, and a 304 response is
+        returned without reading the file when the request's If-None-Match or If-Modified-Since
+        headers match.
+        """
+        rangeSpec = self.__getRequestHeader("HTTP_RANGE", rangeSpec)
+        acceptEncoding = self.__getRequestHeader("HTTP_ACCEPT_ENCODING", acceptEncoding)
         try:
             if os.path.exists(filePath):
                 _dir, fn = os.path.split(filePath)
+                # representation - 'file' bytes as stored, 'uncompress' or compressed on the fly ('gzip', ...)
                 if not serveCompressed and fn.endswith(".gz"):
-                    self._readFile(filePath, uncompress=True)
+                    contentType, _encodingType = self.getMimetypeAndEncoding(filePath[:-3])
+                    self._cD["vary"] = "Accept-Encoding"
+                    if acceptsEncoding(acceptEncoding, "gzip"):
+                        encodingType = "gzip"
+                        representation = "file"
+                    else:
+                        encodingType = None
+                        representation = "uncompress"
                     self._cD["datafileName"] = fn[:-3]
-                    contentType, encodingType = self.getMimetypeAndEncoding(filePath[:-3])
-                    encodingType = "gzip"
                 else:
-                    self._readFile(filePath)
-                    self._cD["datafileName"] = fn
                     if fn.endswith(".gz"):
                         contentType = "application/octet-stream"
                         encodingType = None
                     else:
                         contentType, encodingType = self.getMimetypeAndEncoding(filePath)
+                    coding = self.__getCompressCoding(filePath, acceptEncoding, rangeSpec) if compress else None
+                    if compress:
+                        self._cD["vary"] = "Accept-Encoding"
+                    if coding is not None:
+                        encodingType = coding
+                        representation = coding
+                    else:
+                        representation = "file"
+                    self._cD["datafileName"] = fn
+                # each content coding of the file has its own entity tag
+                variant = encodingType if representation == "file" else representation
+                if not self.__checkNotModified(filePath, variant=variant):
+                    if representation == "uncompress":
+                        self._readFile(filePath, uncompress=True)
+                    elif representation != "file":
+                        self.__readFileCompressed(filePath, representation)
+                    elif not self.__readFileRanges(filePath, rangeSpec, contentType):
+                        self._readFile(filePath)
                 self._cD["datatype"] = contentType
                 self._cD["encodingtype"] = encodingType
                 if attachmentFlag:
@@ -475,18 +1456,52 @@ class ResponseContent:
             self.__lfh.write("ResponseContent.setBinaryFile() File read failed %s error: %r\n" % (filePath, str(e)))
             traceback.print_exc(file=self.__lfh)
 
-    def wrapFileAsJsonp(self, filePath, callBack=None):
+    def setArchiveFiles(self, filePathList, archiveName="files", archiveFormat="zip"):
+        """Serve the files in filePathList as a ZIP or tar archive attachment streamed by ArchiveIterator.
+
+        archiveFormat is 'zip', 'tar' or 'tgz'.  Returns True if the archive content is set.
+        """
+        try:
+            level = self.COMPRESS_LEVEL
+            if self.__reqObj is not None:
+                level = int(self.__reqObj.getValueOrDefault("ResponseCompressLevel", default=level))
+            aI = ArchiveIterator(filePathList, archiveName=archiveName, archiveFormat=archiveFormat, level=level)
+            self._cD["fileiterator"] = aI
+            self._cD["datafileName"] = aI.fileName
+            self._cD["datatype"] = aI.contentType
+            self._cD["encodingtype"] = None
+            self._cD["disposition"] = "attachment"
+            if self.__verbose:
+                self.__lfh.write(
+                    "+ResponseContent.setArchiveFiles() Serving %d files as %s\n" % (len(filePathList), aI.fileName)
+                )
+            return True
+        except Exception as e:  # noqa: BLE001
+            self.__lfh.write("ResponseContent.setArchiveFiles() Archive failed %s error: %r\n" % (archiveName, str(e)))
+            traceback.print_exc(file=self.__lfh)
+        return False
+
+    def wrapFileAsJsonp(self, filePath, callBack=None, stream=False):
+        """Set the content to the JSONP callBack wrapping the file -- .json files are inserted unchanged
+        and other files as {"data": <file text>}.  If stream, the content is sent in chunks.
+        """
         try:
             if os.path.exists(filePath):
                 _dir, fn = os.path.split(filePath)
                 (_rn, ext) = os.path.splitext(fn)
-                dd = {}
-                with open(filePath) as fin:
-                    dd["data"] = fin.read()
-                if ext.lower() != ".json":
-                    self._cD["datacontent"] = callBack + "(" + dumps(dd) + ");"
+                isJson = ext.lower() == ".json"
+                if stream and isJson:
+                    self._cD["datacontent"] = TextStreamIterator(filePath, callBack + "(", ");")
+                elif stream:
+                    self._cD["datacontent"] = TextStreamIterator(filePath, callBack + '({"data": ', "});", escapeJson=True)
                 else:
-                    self._cD["datacontent"] = callBack + "(" + dd["data"] + ");"
+                    dd = {}
+                    with open(filePath) as fin:
+                        dd["data"] = fin.read()
+                    if not isJson:
+                        self._cD["datacontent"] = callBack + "(" + dumps(dd) + ");"
+                    else:
+                        self._cD["datacontent"] = callBack + "(" + dd["data"] + ");"
                 self._cD["datafileName"] = fn
                 contentType = "application/x-javascript"
                 encodingType = None
@@ -543,7 +1558,12 @@ class ResponseContent:
         return False
 
     def get(self):
-        """Repackage the response for Apache according to the input return_format='html|json|text|...'"""
+        """Repackage the response for Apache according to the input return_format='html|json|text|...'
+
+        The dictionary holds CONTENT_TYPE and the content as RETURN_STRING or FILE_ITERATOR.  Binary and
+        text file responses may also hold STATUS_CODE (if not 200), HEADERS (list of (name, value) pairs of
+        additional response headers), CONTENT_LENGTH, ENCODING and DISPOSITION.
+        """
         rD = {}
         if self.__returnFormat == "html":
             if self._cD["errorflag"] is False:
@@ -587,9 +1607,17 @@ class ResponseContent:
 
         if "fileiterator" in myD:
             rspDict["FILE_ITERATOR"] = myD["fileiterator"]
+            if getattr(myD["fileiterator"], "zeroCopy", False):
+                # file region for servers using os.sendfile() directly
+                rspDict["FILE_DESCRIPTOR"] = myD["fileiterator"].fileno()
+                rspDict["FILE_OFFSET"] = myD["fileiterator"].offset
         else:
             rspDict["RETURN_STRING"] = myD["datacontent"]
 
+        if myD.get("multipartboundary") is not None:
+            rspDict["CONTENT_TYPE"] = "multipart/byteranges; boundary=%s" % myD["multipartboundary"]
+        ResponseContent.__setStatusAndHeaders(rspDict, myD)
+
         try:
             rspDict["ENCODING"] = myD["encodingtype"]
             if myD["disposition"] is not None:
@@ -604,7 +1632,12 @@ class ResponseContent:
             myD = {}
         rspDict = {}
         rspDict["CONTENT_TYPE"] = "application/json"
-        rspDict["RETURN_STRING"] = dumps(myD)
+        if isinstance(myD, TextStreamIterator):
+            rspDict["FILE_ITERATOR"] = myD
+            if myD.fileSize is not None:
+                rspDict["CONTENT_LENGTH"] = myD.fileSize
+        else:
+            rspDict["RETURN_STRING"] = dumps(myD)
         return rspDict
 
     @staticmethod
@@ -613,7 +1646,12 @@ class ResponseContent:
             myD = {}
         rspDict = {}
         rspDict["CONTENT_TYPE"] = myD["datatype"]
-        rspDict["RETURN_STRING"] = myD["datacontent"]
+        if isinstance(myD["datacontent"], TextStreamIterator):
+            rspDict["FILE_ITERATOR"] = myD["datacontent"]
+            if myD["datacontent"].fileSize is not None:
+                rspDict["CONTENT_LENGTH"] = myD["datacontent"].fileSize
+        else:
+            rspDict["RETURN_STRING"] = myD["datacontent"]
         return rspDict
 
     @staticmethod
@@ -645,8 +1683,40 @@ class ResponseContent:
         else:
             rspDict["RETURN_STRING"] = myD["textcontent"]
 
+        ResponseContent.__setStatusAndHeaders(rspDict, myD)
         return rspDict
 
+    @staticmethod
+    def __setStatusAndHeaders(rspDict, myD):
+        """Add the HTTP status and response headers for file content.
+
+        STATUS_CODE is set for responses other than 200 (206, 304, 416).  HEADERS is the list of
+        (name, value) pairs for the validator, negotiation and range headers -- these are also
+        set as individual keys (ETAG, LAST_MODIFIED, VARY, ACCEPT_RANGES, CONTENT_RANGE).
+        CONTENT_LENGTH is set when the length of the content is known.
+        """
+        if myD.get("httpstatus") is not None:
+            rspDict["STATUS_CODE"] = myD["httpstatus"]
+        headerL = []
+        for ky, rKy, hdr in [
+            ("etag", "ETAG", "ETag"),
+            ("lastmodified", "LAST_MODIFIED", "Last-Modified"),
+            ("vary", "VARY", "Vary"),
+            ("acceptranges", "ACCEPT_RANGES", "Accept-Ranges"),
+            ("contentrange", "CONTENT_RANGE", "Content-Range"),
+        ]:
+            if myD.get(ky) is not None:
+                rspDict[rKy] = myD[ky]
+                headerL.append((hdr, myD[ky]))
+        if headerL:
+            rspDict["HEADERS"] = headerL
+        if myD.get("httpstatus") == 304:
+            return
+        if myD.get("contentlength") is not None:
+            rspDict["CONTENT_LENGTH"] = myD["contentlength"]
+        elif "fileiterator" in myD and myD["fileiterator"].fileSize is not None:
+            rspDict["CONTENT_LENGTH"] = myD["fileiterator"].fileSize
+
     def __processTemplate(
         self, templateFilePath="./alignment_template.html", webIncludePath=".", parameterDict=None, insertContext=False
     ):
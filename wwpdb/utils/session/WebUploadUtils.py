@@ -20,12 +20,168 @@ __email__ = "jwest@rcsb.rutgers.edu"
 __license__ = "Creative Commons Attribution 3.0 Unported"
 __version__ = "V0.09"
 
+import bz2
+import contextlib
+import hashlib
+import io
+import json
+import lzma
 import ntpath
 import os
+import secrets
 import shutil
+import stat
+import string
 import sys
+import time
 import traceback
 import types
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+# file extension -> compression coding handled by WebUploadUtils.copyDecompressed()
+_UPLOAD_CODINGS = {".gz": "gzip", ".bz2": "bz2", ".xz": "xz", ".zst": "zstd"}
+
+# Linux ioctl cloning the data blocks of one file into another (reflink)
+_FICLONE = 0x40049409
+
+# session file name prefix of the partial file, manifest and lock of a chunked upload
+_CHUNKED_UPLOAD_PREFIX = ".chunked-upload-"
+
+
+def _mergeRanges(rangeList):
+    """Return the sorted list of [start, end) byte ranges with overlapping and adjacent ranges merged."""
+    mergedL = []
+    for start, end in sorted(rangeList):
+        if mergedL and start <= mergedL[-1][1]:
+            mergedL[-1][1] = max(mergedL[-1][1], end)
+        else:
+            mergedL.append([start, end])
+    return mergedL
+
+
+def _newDecompressor(coding):
+    if coding == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if coding == "bz2":
+        return bz2.BZ2Decompressor()
+    if coding == "xz":
+        return lzma.LZMADecompressor()
+    raise ValueError("Unsupported compression coding %r" % coding)
+
+
+def _iterDecompressed(ifh, coding, bufSize, teeFh=None):
+    """Yield the decompressed content of file object ifh in chunks of at most bufSize bytes.
+
+    Compressed data is read bufSize bytes at a time.  Concatenated members (gzip) or streams (bz2, xz, zstd)
+    are decompressed in sequence.  Each compressed read is also written to teeFh if provided.
+    """
+    if coding == "zstd":
+        if zstandard is None:
+            raise ValueError("Unsupported compression coding %r" % coding)
+        if teeFh is not None:
+            ifh = _TeeReader(ifh, teeFh)
+        with zstandard.ZstdDecompressor().stream_reader(ifh, read_across_frames=True, closefd=False) as reader:
+            chunk = reader.read(bufSize)
+            while chunk:
+                yield chunk
+                chunk = reader.read(bufSize)
+        return
+
+    dec = _newDecompressor(coding)
+    inStream = False
+    afterMember = False
+    pending = b""
+    more = False
+    while True:
+        if coding == "gzip":
+            # pending output (more) is drained before further input is read
+            if not pending and not more:
+                pending = ifh.read(bufSize)
+                if teeFh is not None:
+                    teeFh.write(pending)
+                if not pending:
+                    break
+            if afterMember and not inStream:
+                # zero padding after a member is skipped as by the gzip module
+                pending = pending.lstrip(b"\x00")
+                if not pending:
+                    continue
+            out = dec.decompress(pending, bufSize)
+            pending = dec.unconsumed_tail
+            more = len(out) == bufSize
+        elif dec.needs_input:
+            if not pending:
+                pending = ifh.read(bufSize)
+                if teeFh is not None:
+                    teeFh.write(pending)
+                if not pending:
+                    break
+            out = dec.decompress(pending, bufSize)
+            pending = b""
+        else:
+            out = dec.decompress(b"", bufSize)
+        inStream = True
+        if out:
+            yield out
+        if dec.eof:
+            # next member or stream
+            pending = dec.unused_data
+            dec = _newDecompressor(coding)
+            inStream = False
+            afterMember = True
+            more = False
+    if inStream:
+        raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+
+class DigestWriter:
+    """Write-through file object computing the size and digests of the data written.
+
+    fh may be None to only compute the size and digests.
+    """
+
+    def __init__(self, fh=None, digestNames=()):
+        self.__fh = fh
+        self.__hashD = {nm: hashlib.new(nm) for nm in digestNames}
+        self.size = 0
+
+    def write(self, data):
+        if self.__fh is not None:
+            self.__fh.write(data)
+        for hObj in self.__hashD.values():
+            hObj.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def getInfo(self):
+        """Return the dictionary of the size and the hex digest of each digest name."""
+        infoD = {"size": self.size}
+        for nm, hObj in self.__hashD.items():
+            infoD[nm] = hObj.hexdigest()
+        return infoD
+
+
+class _TeeReader:
+    """File object reading from ifh and copying the data read to teeFh."""
+
+    def __init__(self, ifh, teeFh):
+        self.__ifh = ifh
+        self.__teeFh = teeFh
+
+    def read(self, size=-1):
+        data = self.__ifh.read(size)
+        self.__teeFh.write(data)
+        return data
 
 
 class WebUploadUtils:
@@ -34,6 +190,8 @@ class WebUploadUtils:
 
     """
 
+    COPY_BUFFER_SIZE = 1024 * 1024
+
     def __init__(self, reqObj=None, verbose=False, log=sys.stderr):
         self.__reqObj = reqObj
         self.__verbose = verbose
@@ -41,6 +199,7 @@ class WebUploadUtils:
         self.__debug = False
         self.__sessionObj = self.__reqObj.getSessionObj()
         self.__sessionPath = self.__sessionObj.getPath()
+        self.__uploadInfo = None
         if self.__verbose:
             self.__lfh.write("+WebUploadUtils.__setup() - session id   %s\n" % (self.__sessionObj.getId()))
             self.__lfh.write("+WebUploadUtils.__setup() - session path %s\n" % (self.__sessionPath))
@@ -87,11 +246,19 @@ class WebUploadUtils:
                 traceback.print_exc(file=self.__lfh)
         return None
 
-    def copyToSession(self, fileTag="file", sessionFileName=None, uncompress=True):
+    def copyToSession(self, fileTag="file", sessionFileName=None, uncompress=True, keepCompressed=True, digests=None):
         """Copy uploaded file identified form element name 'fileTag' to the current session directory.
 
         File is copied to user uploaded file or to the sessionFileName if this is provided.
+
+        If uncompress is set, files with the extension .gz (or an extension in the tuple uncompress
+        from .gz, .bz2, .xz and .zst) are decompressed while they are copied and the uncompressed
+        file name is returned.  The compressed file is also stored if keepCompressed is set.
+
+        The size and the digests named in digests (e.g. ["md5", "sha256"], default from the request
+        parameter "UploadDigests") are computed in the same pass -- see getUploadFileInfo().
         """
+        self.__uploadInfo = None
         if self.__verbose:
             self.__lfh.write("+WebUploadUtils.copyToSession() - operation started\n")
 
@@ -128,16 +295,29 @@ class WebUploadUtils:
                 self.__lfh.write(
                     "+WebUploadUtils.copyToSession() - session target file name   %s\n" % sessionInputFileName
                 )
-            ofh = open(sessionInputFilePath, "wb")
-            ofh.write(fs.file.read())
-            ofh.close()
-            if uncompress and sessionInputFilePath.endswith(".gz"):
+            if not self.__sessionObj.checkQuota(self.getFileObjectSize(fs.file), filePath=sessionInputFilePath):
+                self.__lfh.write(
+                    "+WebUploadUtils.copyToSession() upload of %s rejected - session quota exceeded\n"
+                    % sessionInputFileName
+                )
+                return None
+            if digests is None:
+                digests = self.getDigestNames(self.__reqObj)
+            coding = self.__getUncompressCoding(sessionInputFilePath, uncompress)
+            if coding is not None:
                 if self.__verbose:
                     self.__lfh.write(
                         "+WebUploadUtils.copyToSession() uncompressing file %s\n" % str(sessionInputFilePath)
                     )
-                self.__copyGzip(sessionInputFilePath, sessionInputFilePath[:-3])
-                sessionInputFileName = sessionInputFileName[:-3]
+                infoD = self.__copyUncompressed(fs.file, sessionInputFilePath, coding, keepCompressed, digests)
+                infoD["compressed"]["fileName"] = sessionInputFileName if keepCompressed else None
+                sessionInputFileName = os.path.splitext(sessionInputFileName)[0]
+            else:
+                infoD = self.copyFileToPath(fs.file, sessionInputFilePath, digests)
+                self.__sessionObj.recordFileUsage(sessionInputFilePath)
+            infoD["fileName"] = sessionInputFileName
+            self.__uploadInfo = infoD
+            self.__reqObj.setValue("uploadFileInfo", infoD)
 
             if self.__verbose:
                 self.__lfh.write("+WebUploadUtils.copyToSession() Uploaded file %s\n" % str(sessionInputFileName))
@@ -148,16 +328,477 @@ class WebUploadUtils:
                 traceback.print_exc(file=self.__lfh)
             return None
 
-    def renameSessionFile(self, srcFileName, dstFileName):
+    def initChunkedUpload(self, fileName=None, fileSize=None):
+        """Start a resumable chunked upload and return its upload id or None.
+
+        fileName (default request parameter "file_name") is the session file name stored by
+        finalizeChunkedUpload() and fileSize (default "file_size") the optional total size.
+
+        Chunks are written by uploadChunk() at their offsets into a partial file in the session
+        directory.  The received byte ranges are kept in a manifest so that chunks may be retried,
+        sent in any order or concurrently, and a client can resume from getChunkedUploadStatus().
+        """
+        try:
+            if fileName is None:
+                fileName = self.__reqObj.getValue("file_name")
+            fileName = ntpath.basename(os.path.basename(str(fileName).strip()))
+            if fileSize is None and self.__reqObj.getValue("file_size"):
+                fileSize = int(self.__reqObj.getValue("file_size"))
+            if not fileName or fileName.startswith(_CHUNKED_UPLOAD_PREFIX):
+                return None
+            if fileSize is not None and not self.__sessionObj.checkQuota(
+                fileSize, filePath=os.path.join(self.__sessionPath, fileName)
+            ):
+                self.__lfh.write(
+                    "+WebUploadUtils.initChunkedUpload() upload of %s rejected - session quota exceeded\n" % fileName
+                )
+                return None
+            uploadId = secrets.token_hex(16)
+            partPath, manifestPath, lockPath = self.__getChunkedUploadPaths(uploadId)
+            for pth in [partPath, lockPath]:
+                with open(pth, "xb"):
+                    pass
+            self.__writeManifest(
+                manifestPath, {"fileName": fileName, "fileSize": fileSize, "created": time.time(), "ranges": []}
+            )
+            if self.__verbose:
+                self.__lfh.write("+WebUploadUtils.initChunkedUpload() upload %s for %s\n" % (uploadId, fileName))
+            return uploadId
+        except Exception as e:  # noqa: BLE001
+            self.__lfh.write("+WebUploadUtils.initChunkedUpload() failed %r\n" % str(e))
+            if self.__verbose:
+                traceback.print_exc(file=self.__lfh)
+        return None
+
+    def uploadChunk(self, uploadId=None, offset=None, ifh=None, fileTag="file"):
+        """Write a chunk of a chunked upload at byte offset and return the upload status
+        (see getChunkedUploadStatus()) or None on failure.
+
+        The chunk is read from the file object ifh or the uploaded file 'fileTag'.  uploadId and
+        offset default to the request parameters "upload_id" and "chunk_offset".  Repeating a chunk
+        rewrites the same bytes.
+        """
+        try:
+            uploadId = uploadId or self.__reqObj.getValue("upload_id")
+            if offset is None:
+                offset = self.__reqObj.getValue("chunk_offset") or 0
+            offset = int(offset)
+            partPath, manifestPath, lockPath = self.__getChunkedUploadPaths(uploadId)
+            if ifh is None:
+                ifh = self.__reqObj.getRawValue(fileTag).file
+            # the shared lock keeps the upload from being finalized or removed while the chunk is written
+            with self.__lockChunkedUpload(lockPath, shared=True):
+                mD = self.__readManifest(manifestPath)
+                if offset < 0 or (mD["fileSize"] is not None and offset >= mD["fileSize"]):
+                    self.__lfh.write("+WebUploadUtils.uploadChunk() upload %s offset %d out of range\n" % (uploadId, offset))
+                    return None
+                maxBytes = None if mD["fileSize"] is None else mD["fileSize"] - offset
+                nChunk = self.getFileObjectSize(ifh)
+                if maxBytes is not None:
+                    nChunk = min(nChunk, maxBytes)
+                if not self.__sessionObj.checkQuota(max(0, offset + nChunk - os.path.getsize(partPath))):
+                    self.__lfh.write("+WebUploadUtils.uploadChunk() upload %s rejected - session quota exceeded\n" % uploadId)
+                    return None
+                # chunks are written through separate descriptors at their own offsets
+                with open(partPath, "r+b") as ofh:
+                    ofh.seek(offset)
+                    nBytes = self.copyFileObject(ifh, ofh, maxBytes=maxBytes)
+                    ofh.flush()
+                    with self.__lockManifest(ofh):
+                        mD = self.__readManifest(manifestPath)
+                        mD["ranges"] = _mergeRanges(mD["ranges"] + [[offset, offset + nBytes]])
+                        self.__writeManifest(manifestPath, mD)
+                self.__sessionObj.recordFileUsage(partPath)
+            return self.__getChunkedStatus(uploadId, mD)
+        except Exception as e:  # noqa: BLE001
+            self.__lfh.write("+WebUploadUtils.uploadChunk() failed for upload %r %r\n" % (uploadId, str(e)))
+            if self.__verbose:
+                traceback.print_exc(file=self.__lfh)
+        return None
+
+    def getChunkedUploadStatus(self, uploadId=None):
+        """Return the status of a chunked upload or None if it does not exist --
+
+        {"uploadId": , "fileName": , "fileSize": , "received": <bytes>, "ranges": [[start, end], ...],
+         "missing": [[start, end], ...], "complete": <bool>}
+
+        Ranges are [start, end) byte offsets.  missing is only known if the file size was provided.
+        """
+        try:
+            uploadId = uploadId or self.__reqObj.getValue("upload_id")
+            _partPath, manifestPath, lockPath = self.__getChunkedUploadPaths(uploadId)
+            # the manifest is replaced atomically
+            with self.__lockChunkedUpload(lockPath, shared=True):
+                mD = self.__readManifest(manifestPath)
+            return self.__getChunkedStatus(uploadId, mD)
+        except Exception as e:  # noqa: BLE001
+            if self.__verbose:
+                self.__lfh.write("+WebUploadUtils.getChunkedUploadStatus() failed for %r %r\n" % (uploadId, str(e)))
+        return None
+
+    def finalizeChunkedUpload(self, uploadId=None, sessionFileName=None, uncompress=True, keepCompressed=True, digests=None):
+        """Complete a chunked upload and return the session file name or None if the upload is
+        incomplete or fails.
+
+        The partial file is moved into place -- compressed files are uncompressed as in copyToSession()
+        and the size and digests are available from getUploadFileInfo().  Without a declared file
+        size the received data must be a single range starting at offset 0.
+        """
+        self.__uploadInfo = None
         try:
-            if srcFileName != dstFileName:
-                srcPath = os.path.join(self.__sessionPath, srcFileName)
-                dstPath = os.path.join(self.__sessionPath, dstFileName)
-                shutil.copyfile(srcPath, dstPath)
+            uploadId = uploadId or self.__reqObj.getValue("upload_id")
+            partPath, manifestPath, lockPath = self.__getChunkedUploadPaths(uploadId)
+            with self.__lockChunkedUpload(lockPath):
+                mD = self.__readManifest(manifestPath)
+                sD = self.__getChunkedStatus(uploadId, mD)
+                if not sD["complete"]:
+                    self.__lfh.write(
+                        "+WebUploadUtils.finalizeChunkedUpload() upload %s incomplete %r\n" % (uploadId, sD["ranges"])
+                    )
+                    return None
+                fileSize = sD["received"]
+                os.truncate(partPath, fileSize)
+                fileName = sessionFileName if sessionFileName is not None else mD["fileName"]
+                filePath = os.path.join(self.__sessionPath, fileName)
+                if digests is None:
+                    digests = self.getDigestNames(self.__reqObj)
+                coding = self.__getUncompressCoding(filePath, uncompress)
+                # the partial file is only moved into place once it has been processed so that the
+                # upload can be finalized again after a failure
+                if coding is not None:
+                    with open(partPath, "rb") as ifh:
+                        infoD = self.__copyUncompressed(ifh, filePath, coding, False, digests)
+                    infoD["compressed"]["fileName"] = fileName if keepCompressed else None
+                else:
+                    infoD = {"size": fileSize}
+                    if digests:
+                        dW = DigestWriter(None, digests)
+                        with open(partPath, "rb") as ifh:
+                            self.copyFileObject(ifh, dW)
+                        infoD = dW.getInfo()
+                if coding is None or keepCompressed:
+                    os.replace(partPath, filePath)
+                    self.__sessionObj.recordFileUsage(filePath)
+                if coding is not None:
+                    fileName = os.path.splitext(fileName)[0]
+                self.__removeChunkedUpload(uploadId)
+            infoD["fileName"] = fileName
+            self.__uploadInfo = infoD
+            self.__reqObj.setValue("uploadFileInfo", infoD)
+            if self.__verbose:
+                self.__lfh.write("+WebUploadUtils.finalizeChunkedUpload() upload %s stored as %s\n" % (uploadId, fileName))
+            return fileName
+        except Exception as e:  # noqa: BLE001
+            self.__lfh.write("+WebUploadUtils.finalizeChunkedUpload() failed for upload %r %r\n" % (uploadId, str(e)))
+            if self.__verbose:
+                traceback.print_exc(file=self.__lfh)
+        return None
+
+    def abortChunkedUpload(self, uploadId=None):
+        """Remove the partial file and manifest of a chunked upload."""
+        try:
+            uploadId = uploadId or self.__reqObj.getValue("upload_id")
+            _partPath, _manifestPath, lockPath = self.__getChunkedUploadPaths(uploadId)
+            with self.__lockChunkedUpload(lockPath):
+                self.__removeChunkedUpload(uploadId)
             return True
+        except Exception as e:  # noqa: BLE001
+            if self.__verbose:
+                self.__lfh.write("+WebUploadUtils.abortChunkedUpload() failed for %r %r\n" % (uploadId, str(e)))
+        return False
+
+    def __getChunkedUploadPaths(self, uploadId):
+        """Return the partial file, manifest and lock paths of uploadId."""
+        if not uploadId or len(uploadId) != 32 or any(c not in string.hexdigits for c in uploadId):
+            raise ValueError("Invalid upload id %r" % uploadId)
+        basePath = os.path.join(self.__sessionPath, _CHUNKED_UPLOAD_PREFIX + uploadId)
+        return basePath + ".part", basePath + ".json", basePath + ".lock"
+
+    @staticmethod
+    @contextlib.contextmanager
+    def __lockChunkedUpload(lockPath, shared=False):
+        """Hold an advisory lock on the upload -- a no-op if fcntl is unavailable.
+
+        Chunks are written under a shared lock while the upload is read, finalized or removed under
+        an exclusive lock.  FileNotFoundError is raised if the upload does not exist.
+        """
+        if fcntl is None:  # pragma: no cover
+            yield
+            return
+        with open(lockPath, "rb") as fh:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+
+    @staticmethod
+    @contextlib.contextmanager
+    def __lockManifest(partFh):
+        """Serialize the manifest updates of the chunk writers sharing the upload lock."""
+        if fcntl is None:  # pragma: no cover
+            yield
+            return
+        fcntl.flock(partFh.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(partFh.fileno(), fcntl.LOCK_UN)
+
+    @staticmethod
+    def __readManifest(manifestPath):
+        with open(manifestPath) as fh:
+            return json.load(fh)
+
+    @staticmethod
+    def __writeManifest(manifestPath, mD):
+        # replace so that a concurrent reader never sees a partial manifest
+        tmpPath = "%s.%d.%s.tmp" % (manifestPath, os.getpid(), secrets.token_hex(4))
+        with open(tmpPath, "w") as fh:
+            json.dump(mD, fh)
+        os.replace(tmpPath, manifestPath)
+
+    @staticmethod
+    def __getChunkedStatus(uploadId, mD):
+        rangeL = mD["ranges"]
+        sD = {
+            "uploadId": uploadId,
+            "fileName": mD["fileName"],
+            "fileSize": mD["fileSize"],
+            "received": sum(end - start for start, end in rangeL),
+            "ranges": rangeL,
+        }
+        if mD["fileSize"] is None:
+            sD["missing"] = None
+            sD["complete"] = len(rangeL) == 1 and rangeL[0][0] == 0
+        else:
+            missingL = []
+            pos = 0
+            for start, end in rangeL + [[mD["fileSize"], mD["fileSize"]]]:
+                if start > pos:
+                    missingL.append([pos, start])
+                pos = end
+            sD["missing"] = missingL
+            sD["complete"] = not missingL
+        return sD
+
+    def __removeChunkedUpload(self, uploadId):
+        partPath, manifestPath, lockPath = self.__getChunkedUploadPaths(uploadId)
+        for pth in [partPath, manifestPath, lockPath]:
+            if os.path.exists(pth):
+                os.remove(pth)
+        self.__sessionObj.removeFileUsage(partPath)
+
+    @staticmethod
+    def __getUncompressCoding(filePath, uncompress):
+        """Return the compression coding of filePath if it is to be uncompressed (see copyToSession()) or None."""
+        if uncompress is True:
+            uncompress = (".gz",)
+        ext = os.path.splitext(filePath)[1]
+        if uncompress and ext in uncompress and ext in _UPLOAD_CODINGS:
+            return _UPLOAD_CODINGS[ext]
+        return None
+
+    def getUploadFileInfo(self):
+        """Return the details of the last file stored by copyToSession() or None --
+
+        {"fileName": <session file name>, "size": <bytes>, <digest name>: <hex digest>, ...}
+
+        and for uncompressed files the same details of the compressed upload as "compressed"
+        (fileName None if it was not stored).  The dictionary is also stored in the request
+        object as "uploadFileInfo".
+        """
+        return self.__uploadInfo
+
+    @staticmethod
+    def getDigestNames(reqObj):
+        """Return the list of hashlib digest names in the request parameter "UploadDigests" (e.g. "md5,sha256")."""
+        digestNames = []
+        for nm in reqObj.getValue("UploadDigests").replace(" ", "").lower().split(","):
+            if nm and nm in hashlib.algorithms_available and nm not in digestNames:
+                digestNames.append(nm)
+        return digestNames
+
+    @staticmethod
+    def copyFileToPath(ifh, filePath, digests=None):
+        """Copy the remaining content of file object ifh to filePath and return the dictionary of the
+        size and the digests named in digests computed in the same pass.
+        """
+        with open(filePath, "wb") as ofh:
+            if digests:
+                dW = DigestWriter(ofh, digests)
+                WebUploadUtils.copyFileObject(ifh, dW)
+                return dW.getInfo()
+            return {"size": WebUploadUtils.copyFileObject(ifh, ofh)}
+
+    def renameSessionFile(self, srcFileName, dstFileName, move=False, link=False):
+        """Make the session file srcFileName available as dstFileName and return the strategy used or False.
+
+        With move the file is renamed with os.replace() ('replace').  Otherwise the content is cloned
+        with a FICLONE reflink where the file system supports it ('reflink'), or copied with
+        copyFileObject() -- copy_file_range() may share the data blocks on file systems such as
+        btrfs, XFS and NFS ('copy').  With link a hard link is tried first ('link') -- both names
+        then share one file so in-place changes to either are visible through both.
+        'none' is returned if the names are the same.  dstFileName is replaced atomically.
+        """
+        try:
+            if srcFileName == dstFileName:
+                return "none"
+            srcPath = os.path.join(self.__sessionPath, srcFileName)
+            dstPath = os.path.join(self.__sessionPath, dstFileName)
+            if move:
+                os.replace(srcPath, dstPath)
+                self.__sessionObj.removeFileUsage(srcPath)
+                strategy = "replace"
+            else:
+                strategy = self.__cloneFile(srcPath, dstPath, link)
+            self.__sessionObj.recordFileUsage(dstPath)
+            if self.__verbose:
+                self.__lfh.write(
+                    "+WebUploadUtils.renameSessionFile() %s to %s using %s\n" % (srcFileName, dstFileName, strategy)
+                )
+            return strategy
         except:  # noqa: E722 pylint: disable=bare-except
+            if self.__verbose:
+                traceback.print_exc(file=self.__lfh)
             return False
 
+    @staticmethod
+    def __cloneFile(srcPath, dstPath, link):
+        """Link, reflink or copy srcPath to a temporary file replacing dstPath and return the strategy used."""
+        tmpPath = "%s.%d.%s.tmp" % (dstPath, os.getpid(), secrets.token_hex(4))
+        try:
+            if link:
+                try:
+                    os.link(srcPath, tmpPath)
+                    os.replace(tmpPath, dstPath)
+                    return "link"
+                except OSError:
+                    pass
+            with open(srcPath, "rb") as ifh, open(tmpPath, "wb") as ofh:
+                strategy = "copy"
+                if fcntl is not None:
+                    try:
+                        fcntl.ioctl(ofh.fileno(), _FICLONE, ifh.fileno())
+                        strategy = "reflink"
+                    except OSError:
+                        pass
+                if strategy == "copy":
+                    WebUploadUtils.copyFileObject(ifh, ofh)
+            os.replace(tmpPath, dstPath)
+            return strategy
+        except BaseException:
+            if os.path.lexists(tmpPath):
+                os.remove(tmpPath)
+            raise
+
+    @staticmethod
+    def getFileObjectSize(fh):
+        """Return the size in bytes of the input file object (e.g. an uploaded file) or 0 if unknown."""
+        try:
+            return os.fstat(fh.fileno()).st_size
+        except Exception:  # noqa: BLE001
+            pass
+        try:
+            pos = fh.tell()
+            fh.seek(0, os.SEEK_END)
+            nBytes = fh.tell()
+            fh.seek(pos)
+            return nBytes
+        except Exception:  # noqa: BLE001
+            return 0
+
+    @staticmethod
+    def copyFileObject(ifh, ofh, bufSize=None, maxBytes=None):
+        """Copy the remaining content of file object ifh (e.g. an uploaded file) to ofh with constant
+        memory use and return the number of bytes copied.  At most maxBytes are copied if it is set.
+
+        When both objects are backed by file descriptors the data is moved within the kernel with
+        os.copy_file_range() or os.sendfile(), otherwise it is read into a single reused buffer
+        of bufSize bytes (default COPY_BUFFER_SIZE).
+        """
+        bufSize = bufSize or WebUploadUtils.COPY_BUFFER_SIZE
+        nCopied, done = WebUploadUtils.__copyFileDescriptors(ifh, ofh, maxBytes)
+        if done:
+            return nCopied
+        if hasattr(ifh, "readinto"):
+            view = memoryview(bytearray(bufSize))
+            while maxBytes is None or nCopied < maxBytes:
+                nRead = bufSize if maxBytes is None else min(bufSize, maxBytes - nCopied)
+                nBytes = ifh.readinto(view[:nRead])
+                if not nBytes:
+                    break
+                ofh.write(view[:nBytes])
+                nCopied += nBytes
+        elif maxBytes is None:
+            pos = ofh.tell()
+            shutil.copyfileobj(ifh, ofh, bufSize)
+            nCopied += ofh.tell() - pos
+        else:
+            while nCopied < maxBytes:
+                data = ifh.read(min(bufSize, maxBytes - nCopied))
+                if not data:
+                    break
+                ofh.write(data)
+                nCopied += len(data)
+        return nCopied
+
+    @staticmethod
+    def copyDecompressed(ifh, ofh, coding="gzip", bufSize=None, teeFh=None):
+        """Decompress the remaining content of file object ifh to ofh in a single streaming pass and return
+        the number of uncompressed bytes written.
+
+        coding is 'gzip' (multi-member files are supported), 'bz2', 'xz' or 'zstd' (if the zstandard
+        package is installed).  Reads and decompressed chunks are bounded by bufSize (default
+        COPY_BUFFER_SIZE).  The compressed data read is also written to teeFh if provided.
+        Raises ValueError for an unsupported coding, EOFError for truncated input, and the
+        decompressor error for corrupt input.
+        """
+        bufSize = bufSize or WebUploadUtils.COPY_BUFFER_SIZE
+        nBytes = 0
+        for chunk in _iterDecompressed(ifh, coding, bufSize, teeFh=teeFh):
+            ofh.write(chunk)
+            nBytes += len(chunk)
+        return nBytes
+
+    @staticmethod
+    def __copyFileDescriptors(ifh, ofh, maxBytes=None):
+        """Copy regular file content between the descriptors of ifh and ofh from their current positions
+        and advance both -- returns the number of bytes copied and True if the copy is complete.
+        """
+        try:
+            inFd = ifh.fileno()
+            outFd = ofh.fileno()
+            st = os.fstat(inFd)
+            if not stat.S_ISREG(st.st_mode):
+                return 0, False
+            inPos = ifh.tell()
+            ofh.flush()
+            outPos = ofh.tell()
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            return 0, False
+        nBytes = st.st_size - inPos
+        if maxBytes is not None:
+            nBytes = min(nBytes, maxBytes)
+        nCopied = 0
+        for method in ["copy_file_range", "sendfile"]:
+            if nCopied >= nBytes or not hasattr(os, method):
+                continue
+            try:
+                while nCopied < nBytes:
+                    count = min(nBytes - nCopied, 0x7FFFF000)
+                    if method == "copy_file_range":
+                        nOut = os.copy_file_range(inFd, outFd, count, inPos + nCopied, outPos + nCopied)
+                    else:
+                        os.lseek(outFd, outPos + nCopied, os.SEEK_SET)
+                        nOut = os.sendfile(outFd, inFd, inPos + nCopied, count)
+                    if nOut == 0:
+                        break
+                    nCopied += nOut
+            except OSError:
+                # e.g. not supported between these file systems - continue with the next method
+                continue
+        ifh.seek(inPos + nCopied)
+        ofh.seek(outPos + nCopied)
+        return nCopied, nCopied >= nBytes
+
     @staticmethod
     def getFileExtension(fileName, ignoreVersion=False):
         """Return the file extension (basename.ext).
@@ -231,13 +872,32 @@ class WebUploadUtils:
 
         return fId, fType
 
-    def __copyGzip(self, inpFilePath, outFilePath):
-        """"""
+    def __copyUncompressed(self, ifh, filePath, coding, keepCompressed, digests):
+        """Store the uncompressed content of ifh in filePath without its compression extension and,
+        if keepCompressed, the compressed content in filePath.  Partial output is removed on failure.
+
+        Returns the size and digests of the uncompressed content with those of the compressed
+        content as "compressed".
+        """
+        outFilePath = os.path.splitext(filePath)[0]
+        pathList = [outFilePath, filePath] if keepCompressed else [outFilePath]
         try:
-            cmd = " gzip -cd  %s > %s " % (inpFilePath, outFilePath)
-            os.system(cmd)  # noqa: S605
-            return True
-        except:  # noqa: E722 pylint: disable=bare-except
-            if self.__verbose:
-                traceback.print_exc(file=self.__lfh)
-            return False
+            with open(outFilePath, "wb") as ofh:
+                dW = DigestWriter(ofh, digests)
+                if keepCompressed:
+                    with open(filePath, "wb") as teeFh:
+                        teeW = DigestWriter(teeFh, digests)
+                        self.copyDecompressed(ifh, dW, coding, teeFh=teeW)
+                else:
+                    teeW = DigestWriter(None, digests)
+                    self.copyDecompressed(ifh, dW, coding, teeFh=teeW)
+        except BaseException:
+            for pth in pathList:
+                if os.path.exists(pth):
+                    os.remove(pth)
+            raise
+        for pth in reversed(pathList):
+            self.__sessionObj.recordFileUsage(pth)
+        infoD = dW.getInfo()
+        infoD["compressed"] = teeW.getInfo()
+        return infoD